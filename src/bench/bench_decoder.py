@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+import time
+
+from pcap import chunkDetect
+from .synthetic import write_session_pcap
+
+
+def bench_records(path, raw):
+    start = time.perf_counter()
+    count = sum(1 for _ in chunkDetect.read_records(path, raw=raw))
+    return count, time.perf_counter() - start
+
+
+def main(n_chunks=200):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session.pcap")
+        total = write_session_pcap(path, n_chunks=n_chunks)
+        print(f"synthetic pcap: {total} packets, {os.path.getsize(path)} bytes")
+
+        results = {}
+        for name, raw in (("scapy", False), ("raw", True)):
+            count, elapsed = bench_records(path, raw)
+            results[name] = count / elapsed
+            print(f"{name:>6}: {count} packets in {elapsed:.3f}s, {results[name]:.0f} packets/s")
+        print(f"speedup: {results['raw'] / results['scapy']:.1f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
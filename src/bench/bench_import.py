@@ -0,0 +1,44 @@
+import statistics
+import subprocess
+import sys
+import time
+
+# 各子命令执行时导入的模块
+COMMANDS = {
+    'startup': ['main'],
+    'convert': ['main', 'pcap.chunkConvert'],
+    'predict': ['main', 'pcap.chunkDetect', 'model.model_util'],
+    'evaluate': ['main', 'model.multi_model'],
+    'train': ['main', 'model.multi_model', 'model.random_forest'],
+    'select': ['main', 'model.model_selection'],
+    'pipeline': ['main', 'model.pipeline'],
+}
+
+# 改为按需导入之前, 任何命令启动时都会加载的模块
+EAGER = ['scapy.all', 'sklearn.ensemble', 'sklearn.metrics', 'joblib']
+
+
+def import_time(modules, repeat):
+    """在新的解释器中导入modules, 返回扣除解释器自身启动时间后的中位数耗时(秒)"""
+    def run(code):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-W', 'ignore', '-c', code], check=True)
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+
+    return run('import ' + ', '.join(modules)) - run('pass')
+
+
+def main(repeat=5):
+    eager = import_time(EAGER, repeat)
+    print(f"{'eager imports':>14}: {eager:.3f}s")
+    for command, modules in COMMANDS.items():
+        lazy = import_time(modules, repeat)
+        before = import_time(modules + EAGER, repeat)
+        print(f"{command:>14}: {lazy:.3f}s  (with eager imports {before:.3f}s, {before / lazy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
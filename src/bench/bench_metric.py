@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+import time
+
+from pcap import metricParser
+from .synthetic import write_metric_file
+
+
+def main(n_lines=100000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session_merged.txt")
+        write_metric_file(path, n_lines)
+        with open(path, 'r') as f:
+            text = f.read()
+        print(f"synthetic metric file: {n_lines} lines, {len(text)} bytes")
+
+        start = time.perf_counter()
+        metrics = metricParser.parse_metric(text)
+        baseline = time.perf_counter() - start
+        print(f"parse_metric:       {baseline:.3f}s, {len(metrics) / baseline:.0f} lines/s")
+
+        start = time.perf_counter()
+        table = metricParser.parse_metric_table(text)
+        elapsed = time.perf_counter() - start
+        print(f"parse_metric_table: {elapsed:.3f}s, {len(table) / elapsed:.0f} lines/s")
+        print(f"speedup: {baseline / elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from pcap import chunkDetect, metricParser
+from model import compiled_forest, model_util, random_forest
+from .synthetic import write_session
+
+# 规模 -> (视频chunk数, 视频流数)
+SCALES = {
+    'small': (100, 2),
+    'medium': (500, 2),
+    'large': (2000, 4),
+}
+
+BASELINE_DIR = 'output/bench'
+# 比基线慢超过该比例的阶段视为性能回退
+DEFAULT_THRESHOLD = 0.2
+# 低于该耗时(秒)的阶段计时误差太大, 不判定回退
+NOISE_FLOOR = 0.005
+
+
+def timeit(func, repeat):
+    """运行func repeat次, 返回(最后一次的结果, 每次耗时列表)"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def run_suite(scale='small', repeat=5, seed=0):
+    """在确定性生成的数据上分别计时各阶段, 返回可序列化为JSON的结果
+
+    每个阶段记录中位数和最小耗时, 以及处理的条目数和吞吐量
+    """
+    n_chunks, n_flows = SCALES[scale]
+    stages = {}
+
+    def record(name, func, items):
+        result, times = timeit(func, repeat)
+        median = statistics.median(times)
+        count = items(result) if callable(items) else items
+        stages[name] = {
+            'seconds': median,
+            'min_seconds': min(times),
+            'items': count,
+            'items_per_s': count / median if median > 0 else None,
+        }
+        print(f"{name:>24}: {median:.4f}s  ({count} items)")
+        return result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pcap_file, metric_file = write_session(tmp, n_chunks=n_chunks, n_flows=n_flows, seed=seed)
+        n_packets = sum(1 for _ in chunkDetect.read_records(pcap_file))
+        text_file = os.path.join(tmp, 'session.txt')
+        binary_file = os.path.join(tmp, 'session.chk')
+        with open(metric_file, 'r') as f:
+            metric_text = f.read()
+
+        stream_map = record('chunk_detect', lambda: chunkDetect.chunk_detect(pcap_file), n_packets)
+        record('chunk_detect_vectorized', lambda: chunkDetect.chunk_detect(pcap_file, vectorized=True), n_packets)
+        n_chunk = sum(len(s.chunks) for s in stream_map.values())
+
+        record('save_chunk_text', lambda: chunkDetect.save_chunk(stream_map, text_file), n_chunk)
+        record('save_chunk_binary', lambda: chunkDetect.save_chunk(stream_map, binary_file), n_chunk)
+        record('load_chunk_text', lambda: chunkDetect.load_chunk(text_file), n_chunk)
+        record('load_chunk_binary', lambda: chunkDetect.load_chunk(binary_file), n_chunk)
+
+        metrics = record('parse_metric', lambda: metricParser.parse_metric(metric_text), len)
+        table = record('parse_metric_table', lambda: metricParser.parse_metric_table(metric_text), len)
+
+        record('prepare_data', lambda: model_util.prepare_data(stream_map, metrics), n_chunk)
+        X, y = record('prepare_data_table', lambda: model_util.prepare_data(stream_map, table), n_chunk)
+
+        # 样本太少时重复特征, 保证训练和预测阶段有意义的规模
+        repeats = max(1, -(-2000 // max(len(X), 1)))
+        X_train, y_train = np.tile(X, (repeats, 1)), np.tile(y, (repeats, 1))
+        model = record('train', lambda: random_forest.train_model(X_train, y_train), len(X_train))
+        record('predict', lambda: model.predict(X_train), len(X_train))
+        record('predict_row', lambda: model.predict(X_train[:1]), 1)
+
+        compiled = compiled_forest.compile_model(model)
+        record('predict_compiled', lambda: compiled.predict(X_train), len(X_train))
+        record('predict_compiled_row', lambda: compiled.predict(X_train[:1]), 1)
+
+    return {
+        'scale': scale,
+        'repeat': repeat,
+        'seed': seed,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'stages': stages,
+    }
+
+
+def baseline_path(scale, directory=BASELINE_DIR):
+    return os.path.join(directory, f"baseline_{scale}.json")
+
+
+def save_results(results, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results saved to {path}")
+
+
+def load_results(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, noise_floor=NOISE_FLOOR):
+    """逐阶段比较最小耗时, 打印变化比例, 返回比基线慢超过threshold的阶段列表
+
+    最小耗时受调度抖动的影响最小; 两次耗时都低于noise_floor秒的阶段只打印不判定
+    """
+    regressions = []
+    for name, stage in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None or not base['min_seconds']:
+            print(f"{name:>24}: {stage['min_seconds']:.4f}s  (no baseline)")
+            continue
+        ratio = stage['min_seconds'] / base['min_seconds']
+        flag = ''
+        if ratio > 1 + threshold and max(stage['min_seconds'], base['min_seconds']) >= noise_floor:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:>24}: {base['min_seconds']:.4f}s -> {stage['min_seconds']:.4f}s  ({ratio:.2f}x){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run the stage benchmark suite on synthetic data")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results of this run to a JSON file")
+    parser.add_argument('--baseline', help="baseline JSON file, defaults to output/bench/baseline_<scale>.json")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the new baseline")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.scale, args.repeat, args.seed)
+    if args.output:
+        save_results(results, args.output)
+
+    path = args.baseline or baseline_path(args.scale)
+    if args.save_baseline:
+        save_results(results, path)
+        return 0
+    if not os.path.exists(path):
+        print(f"no baseline at {path}, run with --save-baseline to create one")
+        return 0
+
+    print(f"\ncompared with {path}:")
+    regressions = compare(results, load_results(path), args.threshold)
+    if regressions:
+        print(f"regressions: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
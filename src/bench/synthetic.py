@@ -0,0 +1,142 @@
+import os
+import random
+import socket
+import struct
+
+CLIENT_IP = "192.168.1.10"
+
+AUDIO_SIZE = (90 * 1024, 150 * 1024)
+VIDEO_SIZE = (300 * 1024, 900 * 1024)
+MSS = 1400
+
+
+def _ip_header(src, dst, proto, total_len):
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, total_len, 0, 0, 64, proto, 0,
+                       socket.inet_aton(src), socket.inet_aton(dst))
+
+
+def _write_packet(out, t, src, dst, proto, sport, dport, payload_len):
+    """写入一条只保留头部的以太网帧记录, 原始长度按载荷补齐"""
+    if proto == 6:
+        l4 = struct.pack('!HHIIBBHHH', sport, dport, 0, 0, 0x50, 0x18, 65535, 0, 0)
+    else:
+        l4 = struct.pack('!HHHH', sport, dport, payload_len + 8, 0)
+    ip = _ip_header(src, dst, proto, 20 + len(l4) + payload_len)
+    frame = b'\x00' * 12 + b'\x08\x00' + ip + l4
+
+    usec = int(round(t * 1e6))
+    out.write(struct.pack('<IIII', usec // 1000000, usec % 1000000,
+                          len(frame), len(frame) + payload_len))
+    out.write(frame)
+
+
+def write_session_pcap(path, n_chunks=100, n_flows=2, n_background=20, seed=0,
+                       start=1600000000.0):
+    """生成确定性的视频会话pcap
+
+    每个视频流交替使用TCP和QUIC(UDP 443), 由客户端GET请求触发一段
+    音频或视频大小的下行突发; 另外混入少量小流量的后台连接和DNS包
+    返回写入的包数
+    """
+    rnd = random.Random(seed)
+    servers = [f"142.250.{i // 250}.{i % 250 + 1}" for i in range(n_flows)]
+    count = 0
+    t = start
+
+    with open(path, 'wb') as out:
+        out.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+
+        _write_packet(out, t, CLIENT_IP, "8.8.8.8", 17, 5353, 53, 40)
+        count += 1
+
+        for c in range(n_chunks):
+            for i, server in enumerate(servers):
+                proto = 6 if i % 2 == 0 else 17
+                port = 40000 + i
+
+                # GET请求
+                t += rnd.uniform(0.01, 0.2)
+                _write_packet(out, t, CLIENT_IP, server, proto, port, 443, rnd.randint(350, 900))
+                count += 1
+
+                size = rnd.randint(*(VIDEO_SIZE if rnd.random() < 0.6 else AUDIO_SIZE))
+                t += rnd.uniform(0.02, 0.1)
+                while size > 0:
+                    payload = min(MSS, size)
+                    size -= payload
+                    _write_packet(out, t, server, CLIENT_IP, proto, 443, port, payload)
+                    count += 1
+                    t += rnd.uniform(0.0001, 0.002)
+
+                # ACK
+                if rnd.random() < 0.3:
+                    _write_packet(out, t, CLIENT_IP, server, proto, port, 443, 40)
+                    count += 1
+
+            # 后台连接
+            if n_background and rnd.random() < n_background / max(n_chunks, 1):
+                host = f"31.13.{c % 250}.{rnd.randint(1, 250)}"
+                _write_packet(out, t, CLIENT_IP, host, 6, 50000 + c % 10000, 443, 500)
+                _write_packet(out, t, host, CLIENT_IP, 6, 443, 50000 + c % 10000, MSS)
+                count += 2
+
+    return count
+
+
+def metric_line(rnd, relative_time, epoch):
+    """生成一行*_merged.txt格式的指标记录"""
+    packets_sent, packets_received = rnd.randint(0, 500), rnd.randint(0, 3000)
+    header = (f"{relative_time}, {packets_sent}, {packets_received}, "
+              f"{packets_sent * rnd.randint(60, 900)}, {packets_received * rnd.randint(600, 1400)}")
+
+    networks = []
+    for _ in range(rnd.randint(1, 4)):
+        protocol = rnd.choice(['TCP', 'UDP', '0'])
+        networks.append(f"[{CLIENT_IP}, 142.250.{rnd.randint(0, 9)}.{rnd.randint(1, 250)}, {protocol}, "
+                        f"{rnd.randint(0, 200)}, {rnd.randint(0, 900)}, "
+                        f"{rnd.randint(0, 90000)}, {rnd.randint(0, 900000)}]")
+
+    event = [0, 0, 0, 0]
+    event[rnd.choice([0, 1, 2, 2, 2, 3])] = 1
+    quality = [0] * 9
+    if rnd.random() > 0.05:
+        quality[rnd.randint(1, 8)] = 1
+    buffer_health = round(rnd.uniform(0, 60), 3)
+    buffer_progress = 'null' if rnd.random() < 0.2 else round(rnd.uniform(0, 1), 4)
+    buffer_valid = rnd.choice(['-1', 'true', 'false'])
+    playback = (f"[[{', '.join(map(str, event))}], {epoch}, {epoch - rnd.randint(0, 10000)}, "
+                f"{round(relative_time * 0.9, 3)}, {round(rnd.uniform(60, 600), 2)}, "
+                f"[{', '.join(map(str, quality))}], {buffer_health}, {buffer_progress}, {buffer_valid}]")
+
+    return f"[{header}, [{', '.join(networks)}], {playback}]"
+
+
+def write_metric_file(path, n_lines=1000, interval=0.1, seed=0, epoch=1600000000000):
+    """生成确定性的*_merged.txt指标文件, 每隔interval秒一条记录"""
+    rnd = random.Random(seed)
+    with open(path, 'w') as out:
+        for i in range(n_lines):
+            relative_time = round(i * interval, 3)
+            out.write(metric_line(rnd, relative_time, epoch + int(relative_time * 1000)) + '\n')
+    return n_lines
+
+
+def write_session(directory, name="session", n_chunks=100, n_flows=2, interval=0.1, seed=0):
+    """生成一对相互匹配的pcap和*_merged.txt文件, 指标记录覆盖pcap的整个时长
+
+    返回(pcap路径, 指标文件路径)
+    """
+    from pcap.pcapDecoder import iter_packets
+
+    pcap_file = os.path.join(directory, f"{name}.pcap")
+    metric_file = os.path.join(directory, f"{name}_merged.txt")
+    write_session_pcap(pcap_file, n_chunks=n_chunks, n_flows=n_flows, seed=seed)
+
+    first = last = None
+    for record in iter_packets(pcap_file):
+        if first is None:
+            first = record[0]
+        last = record[0]
+    duration = (last - first) / 1e9 if first is not None else 0.0
+    write_metric_file(metric_file, int(duration / interval) + 2, interval, seed)
+    return pcap_file, metric_file
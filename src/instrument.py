@@ -0,0 +1,259 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows没有resource模块, CPU时间只统计本进程, 不记录峰值内存
+    resource = None
+
+# 流水线各阶段的计时和计数
+#
+# 用stage(name)包住一个阶段, 记录调用次数、墙钟时间、CPU时间(包括已结束的子进程)和阶段结束时的峰值RSS,
+# 阶段内用count(name, value)累加包数、chunk数、流数等计数, 报告中自动换算为每秒吞吐量;
+# observe(name, value)记录分布(如每个文件的样本行数)
+# 默认关闭, 设置环境变量QOS_INSTRUMENT=1或调用enable()开启;
+# 关闭时stage()返回共享的空对象, count()/observe()只检查一次开关, 开销可以忽略
+
+ENV_VAR = 'QOS_INSTRUMENT'
+
+_enabled = os.environ.get(ENV_VAR, '') not in ('', '0')
+_lock = threading.Lock()
+_local = threading.local()
+_stages = {}
+_observations = {}
+
+
+def enable(flag=True):
+    """开启或关闭统计, 同时设置环境变量使之后启动的子进程也开启"""
+    global _enabled
+    _enabled = flag
+    os.environ[ENV_VAR] = '1' if flag else '0'
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _cpu_time():
+    if resource is None:
+        return time.process_time()
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def peak_rss(children=False):
+    """峰值常驻内存(字节), Linux上ru_maxrss的单位为KB; 没有resource模块时为0"""
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class _NullStage:
+    enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, name, value=1):
+        pass
+
+    def counted(self, items, name):
+        return items
+
+
+NULL_STAGE = _NullStage()
+
+
+class Stage:
+    enabled = True
+
+    def __init__(self, name):
+        self.name = name
+        self.counters = {}
+
+    def __enter__(self):
+        _stack().append(self)
+        self.wall = time.perf_counter()
+        self.cpu = _cpu_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = _cpu_time() - self.cpu
+        _stack().pop()
+        _add_stage(self.name, {
+            'calls': 1,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'peak_rss_bytes': peak_rss(),
+            'counters': self.counters,
+        })
+        return False
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def counted(self, items, name):
+        """逐个产出items并在迭代结束时把数量计入name"""
+        n = 0
+        try:
+            for item in items:
+                n += 1
+                yield item
+        finally:
+            self.count(name, n)
+
+
+def stage(name):
+    return Stage(name) if _enabled else NULL_STAGE
+
+
+def timed(name):
+    """把函数的每次调用记为一个阶段"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """计入当前线程最内层的阶段"""
+    if _enabled:
+        stack = _stack()
+        if stack:
+            stack[-1].count(name, value)
+
+
+def observe(name, value):
+    if _enabled:
+        _add_observation(name, {'count': 1, 'sum': value, 'min': value, 'max': value})
+
+
+def _add_stage(name, data):
+    with _lock:
+        stats = _stages.get(name)
+        if stats is None:
+            _stages[name] = {**data, 'counters': dict(data['counters'])}
+            return
+        for key in ('calls', 'wall_seconds', 'cpu_seconds'):
+            stats[key] += data[key]
+        stats['peak_rss_bytes'] = max(stats['peak_rss_bytes'], data['peak_rss_bytes'])
+        for key, value in data['counters'].items():
+            stats['counters'][key] = stats['counters'].get(key, 0) + value
+
+
+def _add_observation(name, data):
+    with _lock:
+        stats = _observations.get(name)
+        if stats is None:
+            _observations[name] = dict(data)
+            return
+        stats['count'] += data['count']
+        stats['sum'] += data['sum']
+        stats['min'] = min(stats['min'], data['min'])
+        stats['max'] = max(stats['max'], data['max'])
+
+
+def drain():
+    """取出并清空当前进程的统计, 用于把子进程的结果传回主进程合并"""
+    with _lock:
+        data = {'stages': dict(_stages), 'observations': dict(_observations)}
+        _stages.clear()
+        _observations.clear()
+    return data
+
+
+def merge(data):
+    if not data:
+        return
+    for name, stats in data['stages'].items():
+        _add_stage(name, stats)
+    for name, stats in data['observations'].items():
+        _add_observation(name, stats)
+
+
+def reset():
+    drain()
+
+
+def report():
+    """返回可序列化为JSON的统计结果, 每个计数附带按墙钟时间计算的每秒吞吐量"""
+    with _lock:
+        stages = {}
+        for name, stats in _stages.items():
+            wall = stats['wall_seconds']
+            rates = {f"{key}_per_s": value / wall for key, value in stats['counters'].items() if wall > 0}
+            stages[name] = {**stats, 'counters': dict(stats['counters']), 'rates': rates}
+        observations = {name: {**stats, 'mean': stats['sum'] / stats['count']}
+                        for name, stats in _observations.items()}
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'peak_rss_bytes': peak_rss(),
+        'children_peak_rss_bytes': peak_rss(children=True),
+        'stages': stages,
+        'observations': observations,
+    }
+
+
+def to_prometheus(data=None, prefix='qos'):
+    """把report()的结果转换为Prometheus文本格式"""
+    data = report() if data is None else data
+    lines = []
+
+    def metric(name, kind, samples):
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if labels else f"{prefix}_{name} {value}")
+
+    stages = data['stages']
+    metric('stage_calls_total', 'counter', [({'stage': s}, v['calls']) for s, v in stages.items()])
+    metric('stage_wall_seconds_total', 'counter', [({'stage': s}, v['wall_seconds']) for s, v in stages.items()])
+    metric('stage_cpu_seconds_total', 'counter', [({'stage': s}, v['cpu_seconds']) for s, v in stages.items()])
+    metric('stage_peak_rss_bytes', 'gauge', [({'stage': s}, v['peak_rss_bytes']) for s, v in stages.items()])
+    metric('stage_items_total', 'counter', [({'stage': s, 'item': k}, n)
+                                            for s, v in stages.items() for k, n in v['counters'].items()])
+    metric('stage_items_per_second', 'gauge', [({'stage': s, 'item': k[:-len('_per_s')]}, r)
+                                               for s, v in stages.items() for k, r in v['rates'].items()])
+    for name, stats in data['observations'].items():
+        lines.append(f"# TYPE {prefix}_{name} summary")
+        lines.append(f"{prefix}_{name}_count {stats['count']}")
+        lines.append(f"{prefix}_{name}_sum {stats['sum']}")
+        metric(f"{name}_max", 'gauge', [({}, stats['max'])])
+    metric('peak_rss_bytes', 'gauge', [({'process': 'self'}, data['peak_rss_bytes']),
+                                       ({'process': 'children'}, data['children_peak_rss_bytes'])])
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(path):
+    """写出统计结果, 扩展名为.prom时使用Prometheus文本格式, 否则为JSON"""
+    data = report()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        if path.endswith('.prom'):
+            f.write(to_prometheus(data))
+        else:
+            json.dump(data, f, indent=2)
+    print(f"instrumentation written to {path}")
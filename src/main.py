@@ -1,23 +1,247 @@
+import argparse
 import os
-from pcap import chunkDetect
+import sys
 
-from model import  multi_model
+import instrument
 
-def pcap_to_chunk():
-    pcap_directory = "data/A1/PCAP_FILES"
-    out_path = "output/chunk/A1"
-    for filename in os.listdir(pcap_directory):
-        if filename.endswith('.pcap'):
-            pcap_file = os.path.join(pcap_directory, filename)
-            stream_map = chunkDetect.chunk_detect(pcap_file)
-            outfile = out_path + "/chunk_" + filename.replace('.pcap', '.txt')
-            chunkDetect.save_chunk(stream_map, outfile)
+# 各子命令只在执行时导入自己用到的模块: pcap转换不加载sklearn, 评估和预测编译后的模型不加载scapy和sklearn
 
 
-if __name__ == "__main__":
-    pcap_to_chunk()
-    # multi_model.train_final_model()
-    # multi_model.train_multiple_models()
-    # multi_model.test_final_models()
+def pcap_to_chunk(dataset="A1", workers=None, text=False, force=False, idle_timeout=None, max_flows=None):
+    from pcap import chunkConvert
+
+    pcap_directory = f"data/{dataset}/PCAP_FILES"
+    out_path = f"output/chunk/{dataset}"
+    return chunkConvert.convert_directory(pcap_directory, out_path, workers, text, force, idle_timeout, max_flows)
+
+
+def convert(args):
+    if args.pcap:
+        from pcap import chunkConvert
+
+        outfile = args.output or chunkConvert.chunk_file_name(os.path.basename(args.pcap), args.text)
+        streams, elapsed, _ = chunkConvert.convert_file(args.pcap, outfile, args.shards,
+                                                        args.idle_timeout, args.max_flows)
+        print(f"{args.pcap}: {streams} streams, {elapsed:.1f}s")
+        return 0
+    failed = pcap_to_chunk(args.dataset, args.workers, args.text, args.force, args.idle_timeout, args.max_flows)
+    return 1 if failed else 0
+
+
+def train(args):
+    from model import multi_model
+
+    if args.multiple:
+        multi_model.train_multiple_models()
+    else:
+        multi_model.train_final_model()
+    return 0
+
+
+def evaluate(args):
+    import json
+    from model import multi_model
+
+    report = multi_model.test_final_models(args.model, args.chunks, args.metrics, args.workers)
+    if report is None:
+        return 1
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"report saved to {args.output}")
+    return 0
+
+
+def predict(args):
+    from model import model_util
+    from pcap import chunkDetect
+
+    model = model_util.load_model(args.model)
+    if model is None:
+        return 1
+
+    if args.input.endswith('.pcap'):
+        stream_map = chunkDetect.chunk_detect(args.input, workers=args.shards)
+        if stream_map is None:
+            return 1
+        X = model_util.chunk_features(stream_map)
+    else:
+        X = model_util.chunk_features(chunkDetect.load_chunk_table(args.input)[1])
+
+    if len(X) == 0:
+        print("no chunks")
+        return 1
+    for row, labels in zip(X, model_util.predict(model, X)):
+        print(f"{row[0]:.3f}: " + ', '.join(model_util.labels_to_string(labels)))
+    return 0
+
+
+def pipeline(args):
+    import json
+    from model import model_util
+    from model import pipeline as qoe_pipeline
+
+    if args.train:
+        from model import random_forest
+        model = random_forest.IncrementalForest()
+    elif args.model:
+        model = model_util.load_model(args.model)
+        if model is None:
+            return 1
+    else:
+        model = None
+
+    runner = qoe_pipeline.Pipeline(f"data/{args.dataset}/PCAP_FILES", f"output/chunk/{args.dataset}",
+                                   f"data/{args.dataset}/MERGED_FILES", model,
+                                   None if args.train else f"output/predict/{args.dataset}",
+                                   args.train, args.workers, args.queue_size, args.batch_rows, force=args.force)
+    jobs = runner.run()
+    runner.print_summary()
+
+    if args.train:
+        model_util.save_model(runner.model, args.output or f"output/model_{args.dataset}_pipeline.joblib")
+    elif model is not None:
+        report = qoe_pipeline.score_jobs(jobs)
+        if report is not None:
+            print(', '.join(f"{output} F4 {scores['f4']:.4f}" for output, scores in report['micro'].items()))
+            if args.output:
+                with open(args.output, 'w') as f:
+                    json.dump(report, f, indent=2)
+                print(f"report saved to {args.output}")
+    return 1 if runner.failed else 0
+
+
+def export(args):
+    from model import compiled_forest
+
+    output = args.output or os.path.splitext(args.model)[0] + compiled_forest.COMPILED_SUFFIX
+    try:
+        compiled_forest.export_model(args.model, output)
+    except Exception as e:
+        print(f"导出模型时出错: {e}")
+        return 1
+    return 0
 
 
+def serve(args):
+    from model import predict_server
+
+    return 0 if predict_server.serve(args.model, args.host, args.port, args.max_batch, args.max_delay) else 1
+
+
+def online(args):
+    from model import online_qoe
+
+    stats = online_qoe.run_online(args.input, args.model, args.follow, args.speed, args.follow_timeout,
+                                  args.idle_timeout, args.max_flows)
+    return 0 if stats is not None else 1
+
+
+def select(args):
+    from model import model_selection
+
+    return model_selection.main(args.args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="video QoE inference from encrypted traffic")
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('convert', help="convert pcap files to chunk files")
+    p.add_argument('--dataset', default="A1", help="convert data/<dataset>/PCAP_FILES to output/chunk/<dataset>")
+    p.add_argument('--workers', type=int, help="number of files converted in parallel")
+    p.add_argument('--text', action='store_true', help="write text chunk files instead of binary")
+    p.add_argument('--force', action='store_true', help="reconvert files the build manifest marks as up to date")
+    p.add_argument('--pcap', help="convert a single pcap file instead of a dataset")
+    p.add_argument('--output', help="output file for --pcap")
+    p.add_argument('--shards', type=int, help="split a single --pcap across this many processes by flow")
+    p.add_argument('--idle-timeout', type=float,
+                   help="finalize and drop flows idle for this many seconds (changes the output of such flows)")
+    p.add_argument('--max-flows', type=int, help="track at most this many flows, evicting the least recently active "
+                                                 "(with --shards the limit is split between shards, so the "
+                                                 "output differs from an unsharded run)")
+    p.set_defaults(func=convert)
+
+    p = subparsers.add_parser('train', help="train the final model on all datasets")
+    p.add_argument('--multiple', action='store_true', help="train output/model_A0_final.joblib on A0 only")
+    p.set_defaults(func=train)
+
+    p = subparsers.add_parser('evaluate', help="evaluate a model on a test set")
+    p.add_argument('--model', default="output/model_final.joblib")
+    p.add_argument('--chunks', default="output/chunk/A2", help="directory of chunk files")
+    p.add_argument('--metrics', default="data/A2/MERGED_FILES", help="directory of merged metric files")
+    p.add_argument('--workers', type=int, help="processes used to extract uncached features")
+    p.add_argument('--output', help="write the evaluation report to a JSON file")
+    p.set_defaults(func=evaluate)
+
+    p = subparsers.add_parser('pipeline', help="convert, align and predict (or train) a dataset in one "
+                                               "overlapped pass")
+    p.add_argument('--dataset', default="A2")
+    p.add_argument('--model', default="output/model_final.joblib",
+                   help="model used for prediction, an empty string only converts and aligns")
+    p.add_argument('--train', action='store_true', help="train an incremental forest instead of predicting")
+    p.add_argument('--workers', type=int, help="files detected in parallel")
+    p.add_argument('--queue-size', type=int, default=4, help="files buffered between two stages")
+    p.add_argument('--batch-rows', type=int, default=8192, help="rows merged into one predict call")
+    p.add_argument('--force', action='store_true', help="redetect files the build manifest marks as up to date")
+    p.add_argument('--output', help="evaluation report (JSON) or, with --train, the model file")
+    p.set_defaults(func=pipeline)
+
+    p = subparsers.add_parser('select', help="compare model families and hyperparameters with "
+                                             "leave-one-dataset-out cross-validation",
+                              description="arguments are passed to model.model_selection, see its --help",
+                              add_help=False, prefix_chars='+')
+    # 不把以-开头的参数当作select自己的选项, 全部原样交给model_selection解析(包括--help)
+    p.add_argument('args', nargs=argparse.REMAINDER, help="model_selection arguments")
+    p.set_defaults(func=select)
+
+    p = subparsers.add_parser('predict', help="predict QoE labels for every chunk of a pcap or chunk file")
+    p.add_argument('input', help="pcap file or chunk file")
+    p.add_argument('--model', default="output/model_final.joblib")
+    p.add_argument('--shards', type=int, help="split a pcap input across this many processes by flow")
+    p.set_defaults(func=predict)
+
+    p = subparsers.add_parser('export', help="compile a forest into a memory-mappable file for fast loading "
+                                             "and small-batch prediction")
+    p.add_argument('--model', default="output/model_final.joblib")
+    p.add_argument('--output', help="compiled model file (default: the model file with a .forest suffix)")
+    p.set_defaults(func=export)
+
+    p = subparsers.add_parser('serve', help="serve predictions over HTTP, batching concurrent requests")
+    p.add_argument('--model', default="output/model_final.joblib")
+    p.add_argument('--host', default="127.0.0.1")
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--max-batch', type=int, default=256, help="rows merged into one predict call")
+    p.add_argument('--max-delay', type=float, default=0.005,
+                   help="seconds a batch waits for more requests after the first")
+    p.set_defaults(func=serve)
+
+    p = subparsers.add_parser('online', help="predict each chunk as soon as it completes while reading a pcap")
+    p.add_argument('input', help="pcap file")
+    p.add_argument('--model', default="output/model_final.joblib")
+    p.add_argument('--follow', action='store_true', help="keep reading a pcap that is still being written")
+    p.add_argument('--speed', type=float, help="replay packets at this multiple of their capture rate")
+    p.add_argument('--follow-timeout', type=float, default=5.0,
+                   help="with --follow, stop after the file has not grown for this many seconds")
+    p.add_argument('--idle-timeout', type=float, help="finalize and drop flows idle for this many seconds")
+    p.add_argument('--max-flows', type=int, help="track at most this many flows, evicting the least recently active")
+    p.set_defaults(func=online)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # 不带子命令时与之前一样转换A1数据集
+        args = build_parser().parse_args(['convert'])
+    status = args.func(args)
+
+    # 设置环境变量QOS_INSTRUMENT=1时输出各阶段的耗时和吞吐量统计
+    if instrument.enabled():
+        instrument.write_report("output/instrument.json")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
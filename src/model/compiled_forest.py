@@ -0,0 +1,296 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+# 编译后的随机森林文件格式(小端):
+#   文件头   magic(8字节) 版本号(u4) 元数据长度(u4)
+#   元数据   JSON, 记录类别、树的分组以及各数组的dtype/形状/偏移
+#   数组区   各节点数组按64字节对齐连续存放, 可以直接用np.memmap映射
+MAGIC = b'QOSFRST\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+ALIGN = 64
+
+COMPILED_SUFFIX = '.forest'
+# 达到这么多行的批量预测交给原模型(sklearn逐树的Cython遍历更快), 单核上约1000行时两者耗时相同
+LARGE_BATCH_ROWS = 1024
+
+# 所有树的节点按树的顺序拼接, 每棵树内按层重新编号使兄弟节点相邻: 内部节点i的左右子节点为
+# child[i]和child[i]+1(全局下标), 特征值大于threshold[i]时走右子节点
+# 特征为float32, threshold取不大于sklearn阈值的最大float32, 比较结果与float64阈值完全相同
+# leaf为叶节点在values中的行号(内部节点为-1), values为sklearn树中已归一化的叶节点类别概率
+ARRAYS = ('feature', 'threshold', 'child', 'leaf', 'roots', 'values')
+
+
+class CompiledForest:
+    """把随机森林的所有树展平为连续的节点数组, 用NumPy对整批样本同时遍历所有树
+
+    与sklearn一样先把特征转换为float32, 按树的顺序累加叶节点概率后求平均,
+    结果与原模型的predict_proba/predict完全一致
+    groups中每一组对应原模型中的一个随机森林: 组内树的下标范围以及每个输出在values中的列范围
+    weighted为True时(IncrementalForest)各组概率按树的数量加权平均, 否则每个输出只由一组决定
+    加载时只映射数组, 单个样本或小批量(几百行以内)的预测远快于sklearn; 上千行的大批量仍是sklearn更快,
+    因此source(export_model记录的原joblib模型)存在时, 达到LARGE_BATCH_ROWS行的批量在第一次用到时加载原模型预测,
+    结果相同; 原模型不存在时仍用节点数组
+    """
+
+    def __init__(self, arrays, classes, groups, n_features, weighted=False, source=None):
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.child = arrays['child']
+        self.leaf = arrays['leaf']
+        self.roots = arrays['roots']
+        self.values = arrays['values']
+        self.classes_ = [np.asarray(c) for c in classes]
+        self.groups = groups
+        self.n_features_in_ = n_features
+        self.weighted = weighted
+        self.source = source
+        self._source_model = None
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    def apply(self, X):
+        """返回每棵树中每个样本落入的叶节点在values中的行号, 形状为(树的数量, 样本数)"""
+        n = len(X)
+        flat = X.ravel()
+        node = np.repeat(self.roots, n)
+        row = np.tile(np.arange(n, dtype=np.int32) * np.int32(X.shape[1]), self.n_estimators)
+
+        # 只继续遍历尚未到达叶节点的(树, 样本)对
+        active = np.flatnonzero(self.leaf[node] < 0).astype(np.int32)
+        while len(active):
+            current = node[active]
+            current = self.child[current] + (flat[row[active] + self.feature[current]] > self.threshold[current])
+            node[active] = current
+            active = active[self.leaf[current] < 0]
+
+        return self.leaf[node].reshape(self.n_estimators, n)
+
+    def _large_batch_model(self, n_rows):
+        """n_rows达到LARGE_BATCH_ROWS且原模型可用时返回原模型, 否则返回None"""
+        if n_rows < LARGE_BATCH_ROWS or self.source is None:
+            return None
+        if self._source_model is None:
+            try:
+                import joblib
+
+                self._source_model = joblib.load(self.source)
+            except Exception as e:
+                print(f"加载原模型时出错, 大批量预测仍使用编译后的森林: {e}")
+                self.source = None
+                return None
+        return self._source_model
+
+    def predict_proba(self, X, block_rows=2048):
+        """返回每个输出的类别概率列表, 列顺序与classes_[k]一致"""
+        model = self._large_batch_model(len(X))
+        if model is not None:
+            proba = model.predict_proba(X)
+            return proba if isinstance(proba, list) else [proba]
+
+        X = np.asarray(X, dtype=np.float32).reshape(-1, self.n_features_in_)
+        proba = [np.zeros((len(X), len(c))) for c in self.classes_]
+
+        for start in range(0, len(X), block_rows):
+            block = np.ascontiguousarray(X[start:start + block_rows])
+            rows = slice(start, start + len(block))
+            leaves = self.apply(block)
+            for group in self.groups:
+                first, count = group['first'], group['count']
+                width = max(column + n_classes for _, column, n_classes, _ in group['outputs'])
+                tree_values = self.values[:, :width]
+                total = np.zeros((len(block), width))
+                for t in range(first, first + count):
+                    total += tree_values[leaves[t]]
+                total /= count
+
+                for output, column, n_classes, class_columns in group['outputs']:
+                    group_proba = total[:, column:column + n_classes]
+                    if self.weighted:
+                        proba[output][rows, class_columns] += group_proba * count
+                    else:
+                        proba[output][rows] = group_proba
+
+        if self.weighted:
+            for p in proba:
+                p /= self.n_estimators
+        return proba
+
+    def predict(self, X):
+        model = self._large_batch_model(len(X))
+        if model is not None:
+            return model.predict(X)
+        proba = self.predict_proba(X)
+        return np.column_stack([self.classes_[k][np.argmax(p, axis=1)] for k, p in enumerate(proba)])
+
+    def save(self, outfile):
+        """写入outfile, source保存为相对于outfile所在目录的路径"""
+        arrays = {name: np.ascontiguousarray(getattr(self, name)) for name in ARRAYS}
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += -(-array.nbytes // ALIGN) * ALIGN
+
+        meta = json.dumps({
+            'classes': [c.tolist() for c in self.classes_],
+            'groups': self.groups,
+            'n_features': self.n_features_in_,
+            'weighted': self.weighted,
+            'source': (os.path.relpath(os.path.abspath(self.source), os.path.dirname(os.path.abspath(outfile)))
+                       if self.source is not None else None),
+            'arrays': layout,
+        }).encode()
+        data_start = -(-(HEADER.size + len(meta)) // ALIGN) * ALIGN
+
+        with open(outfile, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(meta)))
+            f.write(meta)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+
+
+def is_compiled_model(file_path) -> bool:
+    with open(file_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_compiled(file_path, mmap=True):
+    """读取编译后的森林, mmap为True时节点数组以只读方式映射, 不需要反序列化"""
+    with open(file_path, 'rb') as f:
+        magic, version, meta_len = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a compiled forest file: {file_path}")
+        meta = json.loads(f.read(meta_len))
+        data_start = -(-(HEADER.size + meta_len) // ALIGN) * ALIGN
+
+        arrays = {}
+        for name, info in meta['arrays'].items():
+            dtype, shape = np.dtype(info['dtype']), tuple(info['shape'])
+            offset = data_start + info['offset']
+            if mmap and np.prod(shape) > 0:
+                arrays[name] = np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=shape)
+            else:
+                f.seek(offset)
+                arrays[name] = np.frombuffer(f.read(int(np.prod(shape)) * dtype.itemsize),
+                                             dtype=dtype).reshape(shape)
+
+    source = meta.get('source')
+    if source is not None:
+        source = os.path.join(os.path.dirname(os.path.abspath(file_path)), source)
+        if not os.path.exists(source):
+            source = None
+    return CompiledForest(arrays, meta['classes'], meta['groups'], meta['n_features'], meta['weighted'], source)
+
+
+def _forest_parts(model):
+    """返回(森林列表, 每个森林负责的输出下标, 各输出的类别, 是否加权)"""
+    # 只有编译模型时才需要sklearn, 加载和预测编译后的森林不导入sklearn
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.multioutput import MultiOutputClassifier
+    from .random_forest import IncrementalForest
+
+    if isinstance(model, MultiOutputClassifier):
+        forests = model.estimators_
+        return forests, [[k] for k in range(len(forests))], [f.classes_ for f in forests], False
+    if isinstance(model, IncrementalForest):
+        n_outputs = model.forests[0].n_outputs_
+        return (model.forests, [list(range(n_outputs))] * len(model.forests),
+                [model.classes(k) for k in range(n_outputs)], True)
+    if isinstance(model, RandomForestClassifier):
+        classes = model.classes_ if model.n_outputs_ > 1 else [model.classes_]
+        return [model], [list(range(model.n_outputs_))], classes, False
+    raise TypeError(f"unsupported model type: {type(model).__name__}")
+
+
+def _round_down(threshold):
+    """不大于threshold的最大float32"""
+    rounded = threshold.astype(np.float32)
+    return np.where(rounded > threshold, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+
+
+def _sibling_order(tree):
+    """按层遍历的节点顺序, 每个内部节点的两个子节点连续排列"""
+    left, right = tree.children_left.tolist(), tree.children_right.tolist()
+    order = [0]
+    for node in order:
+        if left[node] >= 0:
+            order += (left[node], right[node])
+    return np.array(order)
+
+
+def compile_model(model):
+    """把MultiOutputClassifier(RandomForestClassifier)、RandomForestClassifier或IncrementalForest编译为CompiledForest"""
+    forests, forest_outputs, classes, weighted = _forest_parts(model)
+    classes = [np.asarray(c) for c in classes]
+
+    feature, threshold, child, leaf, roots, values = [], [], [], [], [], []
+    groups = []
+    n_nodes = n_leaves = 0
+
+    for forest, outputs in zip(forests, forest_outputs):
+        forest_classes = forest.classes_ if forest.n_outputs_ > 1 else [forest.classes_]
+        n_classes = [len(forest_classes[i]) for i in range(len(outputs))]
+        columns = np.cumsum([0] + n_classes)
+        groups.append({
+            'first': len(roots),
+            'count': len(forest.estimators_),
+            'outputs': [[k, int(columns[i]), n_classes[i],
+                         np.searchsorted(classes[k], forest_classes[i]).tolist()]
+                        for i, k in enumerate(outputs)],
+        })
+
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            order = _sibling_order(tree)
+            new_id = np.empty(tree.node_count, dtype=np.int64)
+            new_id[order] = np.arange(tree.node_count)
+            is_leaf = tree.children_left[order] < 0
+            n_leaf = int(is_leaf.sum())
+
+            roots.append(n_nodes)
+            feature.append(np.where(is_leaf, 0, tree.feature[order]))
+            threshold.append(_round_down(tree.threshold[order]))
+            child.append(np.where(is_leaf, np.arange(tree.node_count),
+                                  new_id[tree.children_left[order]]) + n_nodes)
+            leaf_rows = np.full(tree.node_count, -1)
+            leaf_rows[is_leaf] = np.arange(n_leaf) + n_leaves
+            leaf.append(leaf_rows)
+            # tree_.value中已是每个叶节点的类别比例, 即DecisionTreeClassifier.predict_proba的结果
+            leaf_value = tree.value[order[is_leaf]]
+            values.append(np.concatenate([leaf_value[:, i, :n_classes[i]] for i in range(len(outputs))], axis=1))
+            n_nodes += tree.node_count
+            n_leaves += n_leaf
+
+    width = max(v.shape[1] for v in values)
+    arrays = {
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold),
+        'child': np.concatenate(child).astype(np.int32),
+        'leaf': np.concatenate(leaf).astype(np.int32),
+        'roots': np.array(roots, dtype=np.int32),
+        'values': np.vstack([np.pad(v, ((0, 0), (0, width - v.shape[1]))) for v in values]),
+    }
+    return CompiledForest(arrays, classes, groups, forests[0].n_features_in_, weighted)
+
+
+def export_model(model_file='output/model_final.joblib', outfile='output/model_final' + COMPILED_SUFFIX):
+    """把joblib保存的模型编译后写入outfile, 之后可用model_util.load_model直接加载
+
+    outfile中记录model_file的位置, 大批量预测时使用原模型
+    """
+    import joblib
+
+    model = joblib.load(model_file)
+    compiled = compile_model(model)
+    compiled.source = model_file
+    compiled.save(outfile)
+    print(f"compiled {compiled.n_estimators} trees: {model_file} -> {outfile}")
+    return compiled
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pcap import chunkConvert, chunkDetect, metricParser
+from . import model_util
+
+
+def extract_features(chunk_file, metric_file, tolerance=0.1):
+    """读取一对chunk/metric文件并对齐为(X, y)"""
+    flows, chunks = chunkDetect.load_chunk_table(chunk_file)
+    metrics = metricParser.read_metric_table(metric_file)
+    return model_util.prepare_data(chunks, metrics, tolerance)
+
+
+class FeatureCache:
+    """按内容哈希缓存每对chunk/metric文件提取出的(X, y)
+
+    缓存键由两个文件内容的sha256、特征提取版本model_util.FEATURE_VERSION和
+    对齐参数共同决定, 文件内容或特征提取逻辑变化后自动失效;
+    缓存总大小超过max_bytes时按最近使用时间淘汰最旧的条目
+    文件哈希按(路径, 大小, 修改时间)记录在index.json中, 文件未变时不必重新计算;
+    新计算的哈希在load/load_many结束时一次写入index.json
+    """
+
+    def __init__(self, cache_dir='output/feature_cache', max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(cache_dir, 'index.json')
+        try:
+            with open(self.index_file, 'r') as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+        self.dirty = False
+
+    def file_digest(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return 'missing'
+        path = os.path.abspath(path)
+        entry = self.index.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+
+        digest = chunkConvert.file_digest(path)
+        self.index[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        self.dirty = True
+        return digest
+
+    def key(self, chunk_file, metric_file, tolerance=0.1):
+        text = '|'.join([self.file_digest(chunk_file), self.file_digest(metric_file),
+                         str(model_util.FEATURE_VERSION), repr(tolerance)])
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as data:
+                X, y = data['X'], data['y']
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(path)  # 记录最近使用时间
+        return X, y
+
+    def put(self, key, X, y):
+        path = self._entry_path(key)
+        tmp = path + '.tmp.npz'
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.savez(tmp, X=X, y=y)
+        os.replace(tmp, path)
+        self.evict()
+
+    def load(self, chunk_file, metric_file, tolerance=0.1):
+        """读取缓存的特征, 未命中时提取后写入缓存"""
+        key = self.key(chunk_file, metric_file, tolerance)
+        self.save_index()
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        X, y = extract_features(chunk_file, metric_file, tolerance)
+        self.put(key, X, y)
+        return X, y
+
+    def load_many(self, pairs, tolerance=0.1, workers=None):
+        """批量读取多对(chunk文件, metric文件)的特征, 返回与pairs顺序一致的(X, y)列表
+
+        未命中缓存的文件用进程池并行提取, 缓存只由当前进程读写
+        """
+        pairs = list(pairs)
+        keys = [self.key(chunk_file, metric_file, tolerance) for chunk_file, metric_file in pairs]
+        self.save_index()
+        results = [self.get(key) for key in keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if not missing:
+            return results
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(extract_features, *pairs[i], tolerance) for i in missing]
+            for i, future in zip(missing, futures):
+                results[i] = future.result()
+                self.put(keys[i], *results[i])
+        return results
+
+    def evict(self):
+        """总大小超过上限时淘汰最久未使用的条目"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz') and '.tmp' not in name:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            os.remove(os.path.join(self.cache_dir, name))
+        self.index = {}
+        self.dirty = False
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def save_index(self):
+        """把新计算的文件哈希写入index.json, 没有新哈希时不写"""
+        if not self.dirty:
+            return
+        tmp = self.index_file + '.tmp'
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_file)
+        self.dirty = False
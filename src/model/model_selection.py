@@ -0,0 +1,238 @@
+import argparse
+import itertools
+import json
+import os
+import pickle
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.ensemble import ExtraTreesClassifier, HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.multioutput import MultiOutputClassifier
+
+from . import model_util
+from .multi_model import chunk_files, shared_feature_cache
+
+# 模型选择: 在缓存的特征上按数据集留一交叉验证比较不同模型族和超参数
+#
+# 每个候选为(模型名, 参数), 模型名对应MODELS中的构造函数; 所有(候选, 折)组合由进程池并行训练,
+# 每个任务内的模型只用一个核(n_jobs=1, 并把OpenMP/BLAS线程池限制为1), 避免与进程池争抢;
+# 报告每个候选在各折上的平均准确率/召回率/F4(与evaluate_metrics_to_string相同)、训练耗时、预测延迟和模型大小
+
+DATASETS = ('A0', 'A1', 'A2')
+RESULTS_FILE = 'output/model_selection.json'
+
+
+def random_forest(n_estimators=100, max_depth=None, min_samples_leaf=1, n_jobs=1, random_state=0):
+    return MultiOutputClassifier(RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth,
+                                                        min_samples_leaf=min_samples_leaf,
+                                                        n_jobs=n_jobs, random_state=random_state))
+
+
+def extra_trees(n_estimators=100, max_depth=None, min_samples_leaf=1, n_jobs=1, random_state=0):
+    return MultiOutputClassifier(ExtraTreesClassifier(n_estimators=n_estimators, max_depth=max_depth,
+                                                      min_samples_leaf=min_samples_leaf,
+                                                      n_jobs=n_jobs, random_state=random_state))
+
+
+def hist_gradient_boosting(max_iter=100, learning_rate=0.1, max_leaf_nodes=31, random_state=0):
+    # HistGradientBoostingClassifier不支持多输出, 每个输出单独训练一个模型
+    return MultiOutputClassifier(HistGradientBoostingClassifier(max_iter=max_iter, learning_rate=learning_rate,
+                                                                max_leaf_nodes=max_leaf_nodes,
+                                                                random_state=random_state))
+
+
+# 模型名 -> 构造函数, 新的模型族在这里注册即可参与搜索
+MODELS = {
+    'random_forest': random_forest,
+    'extra_trees': extra_trees,
+    'hist_gradient_boosting': hist_gradient_boosting,
+}
+
+# 默认的搜索空间: 模型名 -> {参数名: 候选值列表}
+DEFAULT_SEARCH = {
+    'random_forest': {'n_estimators': [50, 100], 'max_depth': [None, 16]},
+    'extra_trees': {'n_estimators': [50, 100], 'max_depth': [None, 16]},
+    'hist_gradient_boosting': {'max_iter': [100, 200], 'learning_rate': [0.1]},
+}
+
+
+def build_model(name, **params):
+    return MODELS[name](**params)
+
+
+def expand_search(search):
+    """把搜索空间展开为(模型名, 参数字典)列表"""
+    candidates = []
+    for name, grid in search.items():
+        keys = sorted(grid)
+        for values in itertools.product(*(grid[key] for key in keys)):
+            candidates.append((name, dict(zip(keys, values))))
+    return candidates
+
+
+def load_datasets(datasets=DATASETS, chunk_root='output/chunk', metric_root='data', workers=None):
+    """读取各数据集的特征(经FeatureCache缓存), 返回拼接后的X, y以及每行所属数据集的下标"""
+    features, labels, groups = [], [], []
+    for index, dataset in enumerate(datasets):
+        files = sorted(chunk_files(os.path.join(chunk_root, dataset),
+                                   os.path.join(metric_root, dataset, 'MERGED_FILES')))
+        pairs = [(chunk_file, metric_file) for _, chunk_file, metric_file in files]
+        data = shared_feature_cache().load_many(pairs, workers=workers)
+        rows = 0
+        for (filename, _, _), (X, y) in zip(files, data):
+            if len(X) <= 5:
+                print(f"stream map is empty: {filename}")
+                continue
+            features.append(X)
+            labels.append(y)
+            groups.append(np.full(len(X), index))
+            rows += len(X)
+        print(f"{dataset}: {rows} rows")
+
+    if not features:
+        return np.zeros((0, len(model_util.FEATURE_COLUMNS))), np.zeros((0, 3)), np.zeros(0, dtype=np.int64)
+    return np.vstack(features), np.vstack(labels), np.concatenate(groups)
+
+
+def leave_one_dataset_out(groups):
+    """每折留出一个数据集作为测试集, 返回[(留出的数据集下标, 训练行下标, 测试行下标), ...]"""
+    return [(int(held_out), np.flatnonzero(groups != held_out), np.flatnonzero(groups == held_out))
+            for held_out in np.unique(groups)]
+
+
+# 进程池中每个子进程只接收一次数据
+_data = {}
+
+
+def _init_worker(X, y):
+    # HistGradientBoosting和BLAS用OpenMP线程池, 默认占满所有核; 每个子进程限制为单线程,
+    # 与n_jobs=1的随机森林一样只用一个核, 各候选的耗时才可以比较
+    from threadpoolctl import threadpool_limits
+
+    os.environ['OMP_NUM_THREADS'] = '1'
+    threadpool_limits(1)
+    _data['X'], _data['y'] = X, y
+
+
+def evaluate_candidate(name, params, train, test, X=None, y=None, latency_repeat=20):
+    """训练一个候选并在测试集上评估, 返回一折的结果"""
+    X = _data['X'] if X is None else X
+    y = _data['y'] if y is None else y
+
+    model = build_model(name, **params)
+    start = time.perf_counter()
+    model.fit(X[train], y[train])
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    y_pred = model.predict(X[test])
+    batch_seconds = time.perf_counter() - start
+
+    # 单行预测的延迟, 对应在线推断时每个chunk的开销
+    row = X[test[:1]]
+    latencies = []
+    for _ in range(latency_repeat):
+        start = time.perf_counter()
+        model.predict(row)
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        'scores': model_util.scores_to_dict(model_util.score_outputs(y[test], y_pred)[0]),
+        'fit_seconds': fit_seconds,
+        'predict_rows_per_s': len(test) / batch_seconds if batch_seconds > 0 else None,
+        'predict_row_ms': statistics.median(latencies) * 1000,
+        'model_bytes': len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)),
+    }
+
+
+def _average(folds):
+    """各折结果取平均"""
+    scores = {output: {name: float(np.mean([fold['scores'][output][name] for fold in folds]))
+                       for name in model_util.SCORE_NAMES}
+              for output in model_util.OUTPUT_NAMES}
+    summary = {'scores': scores}
+    for key in ('fit_seconds', 'predict_row_ms', 'model_bytes'):
+        summary[key] = float(np.mean([fold[key] for fold in folds]))
+    rates = [fold['predict_rows_per_s'] for fold in folds if fold['predict_rows_per_s']]
+    summary['predict_rows_per_s'] = float(np.mean(rates)) if rates else None
+    summary['f4'] = float(np.mean([scores[output]['f4'] for output in model_util.OUTPUT_NAMES]))
+    return summary
+
+
+def search(X, y, groups, space=None, workers=None, datasets=DATASETS):
+    """对搜索空间space(默认为DEFAULT_SEARCH)中的每个候选做按数据集留一交叉验证,
+    返回按平均F4从高到低排列的结果列表"""
+    candidates = expand_search(DEFAULT_SEARCH if space is None else space)
+    folds = leave_one_dataset_out(groups)
+    if len(folds) < 2:
+        raise ValueError("leave-one-dataset-out needs at least two datasets")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(X, y)) as executor:
+        futures = [[executor.submit(evaluate_candidate, name, params, train, test) for _, train, test in folds]
+                   for name, params in candidates]
+
+        results = []
+        for (name, params), fold_futures in zip(candidates, futures):
+            fold_results = [future.result() for future in fold_futures]
+            for (held_out, _, _), fold in zip(folds, fold_results):
+                fold['held_out'] = datasets[held_out]
+            results.append({'model': name, 'params': params, **_average(fold_results), 'folds': fold_results})
+            print(f"{name} {params}: F4 {results[-1]['f4']:.4f}, fit {results[-1]['fit_seconds']:.2f}s, "
+                  f"row {results[-1]['predict_row_ms']:.2f}ms")
+
+    results.sort(key=lambda result: result['f4'], reverse=True)
+    return results
+
+
+def select_best(results, latency_budget_ms=None):
+    """平均F4最高且单行预测延迟不超过latency_budget_ms的候选, 没有满足条件的候选时返回None"""
+    for result in results:
+        if latency_budget_ms is None or result['predict_row_ms'] <= latency_budget_ms:
+            return result
+    return None
+
+
+def print_results(results, latency_budget_ms=None):
+    print(f"\n{'model':<24}{'params':<40}{'acc':>8}{'F4':>8}{'fit s':>8}{'row ms':>8}{'size MB':>9}")
+    for result in results:
+        accuracy = np.mean([result['scores'][output]['accuracy'] for output in model_util.OUTPUT_NAMES])
+        flag = '' if latency_budget_ms is None or result['predict_row_ms'] <= latency_budget_ms else '  over budget'
+        print(f"{result['model']:<24}{json.dumps(result['params']):<40}{accuracy:>8.4f}{result['f4']:>8.4f}"
+              f"{result['fit_seconds']:>8.2f}{result['predict_row_ms']:>8.2f}"
+              f"{result['model_bytes'] / 1e6:>9.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="leave-one-dataset-out model selection over cached features")
+    parser.add_argument('--datasets', nargs='+', default=list(DATASETS))
+    parser.add_argument('--models', nargs='+', choices=sorted(MODELS), help="restrict the search to these models")
+    parser.add_argument('--chunk-root', default='output/chunk')
+    parser.add_argument('--metric-root', default='data')
+    parser.add_argument('--workers', type=int, help="processes used for the search, defaults to all cores")
+    parser.add_argument('--budget-ms', type=float, help="single-row prediction latency budget")
+    parser.add_argument('--output', default=RESULTS_FILE)
+    args = parser.parse_args(argv)
+
+    X, y, groups = load_datasets(args.datasets, args.chunk_root, args.metric_root, args.workers)
+    space = {name: grid for name, grid in DEFAULT_SEARCH.items() if not args.models or name in args.models}
+    results = search(X, y, groups, space, args.workers, args.datasets)
+    print_results(results, args.budget_ms)
+
+    best = select_best(results, args.budget_ms)
+    if best is None:
+        print("no candidate meets the latency budget")
+    else:
+        print(f"\nbest: {best['model']} {best['params']}")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'datasets': args.datasets, 'budget_ms': args.budget_ms, 'results': results}, f, indent=2)
+    print(f"results saved to {args.output}")
+    return 0 if best is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
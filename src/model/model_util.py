@@ -1,43 +1,105 @@
 
 import numpy as np
-from sklearn.exceptions import UndefinedMetricWarning
-from sklearn.metrics import accuracy_score, recall_score, fbeta_score, classification_report
-import joblib
 import warnings
-warnings.filterwarnings('ignore', category=UndefinedMetricWarning)
+
+import instrument
+from pcap.chunk import CHUNK_DTYPE
+from .compiled_forest import is_compiled_model, load_compiled
+
+
+def _sklearn_metrics():
+    """按需导入sklearn.metrics, 只用编译后的森林预测时不必加载sklearn"""
+    from sklearn import metrics
+    from sklearn.exceptions import UndefinedMetricWarning
+    warnings.filterwarnings('ignore', category=UndefinedMetricWarning)
+    return metrics
+
+
+# chunk特征的列名, 与CHUNK_DTYPE中的字段对应
+FEATURE_COLUMNS = ('request_time', 'first_byte_wait_time', 'download_time', 'slack_time', 'size', 'type')
+# 特征提取版本, 修改chunk_features或prepare_data的结果时需要增加, 使特征缓存失效
+FEATURE_VERSION = 1
+
+
+def chunk_features(chunks):
+    """提取chunk特征矩阵, chunks可以是stream_map或chunk记录结构化数组"""
+    if isinstance(chunks, np.ndarray):
+        if len(chunks) == 0:
+            return np.zeros((0, len(FEATURE_COLUMNS)))
+        return np.column_stack([chunks[name].astype(np.float64) for name in FEATURE_COLUMNS])
+
+    # IpStream.chunks的记录与chunk文件的记录格式相同, 拼接后按结构化数组处理
+    tables = [ip_stream.chunks.array for ip_stream in chunks.values()]
+    return chunk_features(np.concatenate(tables) if tables else np.zeros(0, dtype=CHUNK_DTYPE))
+
+
+def metric_labels(metrics):
+    """返回指标的相对时间和(事件类型, 画质类型, 缓冲警告)标签, metrics可以是Metric列表或MetricTable"""
+    if hasattr(metrics, 'labels'):
+        return np.asarray(metrics.relative_time, dtype=np.float64), metrics.labels()
+
+    times = np.array([metric.relative_time for metric in metrics], dtype=np.float64)
+    labels = np.array([[metric.playback.playback_event_type,
+                        metric.playback.playback_quality_type,
+                        metric.playback.buffer_warning] for metric in metrics], dtype=np.int64)
+    return times, labels.reshape(len(times), 3)
+
+
+def match_nearest(query, times, tolerance):
+    """为每个查询时间在times中找最近的时间点(merge-asof), 返回下标和是否在容差内
+
+    times不要求有序, 距离相等时取时间较早的一个
+    """
+    query = np.asarray(query, dtype=np.float64)
+    if len(times) == 0:
+        return np.zeros(len(query), dtype=np.int64), np.zeros(len(query), dtype=bool)
+
+    order = np.argsort(times, kind='stable')
+    sorted_times = times[order]
+    right = np.clip(np.searchsorted(sorted_times, query), 0, len(sorted_times) - 1)
+    left = np.clip(right - 1, 0, len(sorted_times) - 1)
+
+    use_left = np.abs(query - sorted_times[left]) <= np.abs(sorted_times[right] - query)
+    nearest = np.where(use_left, left, right)
+    matched = np.abs(sorted_times[nearest] - query) < tolerance
+    return order[nearest], matched
 
 
 # 数据准备
-def prepare_data(stream_map, metrics):
-    X = []
-    y = []
-
-    # 从stream_map中提取特征
-    for key, ip_stream in stream_map.items():
-        for chunk in ip_stream.chunks:
-            features = [
-                chunk.request_time,
-                chunk.first_byte_wait_time,
-                chunk.download_time,
-                chunk.slack_time,
-                chunk.size,
-                chunk.type.value
-            ]
-            X.append(features)
-
-            # 这里需要根据时间点匹配对应的 metric
-            # 假设可以通过相对时间来匹配
-            for metric in metrics:
-                if abs(metric.relative_time - chunk.request_time) < 0.1:  # 简单的时间匹配
-                    y.append([metric.playback.playback_event_type,
-                              metric.playback.playback_quality_type,
-                              metric.playback.buffer_warning])
-                    break
-    return np.array(X), np.array(y)
+@instrument.timed('prepare_data')
+def prepare_data(chunks, metrics, tolerance=0.1, unmatched='drop'):
+    """对齐chunk特征和指标标签, 返回等长的X, y
+
+    每个chunk按请求时间匹配相对时间最近且相差小于tolerance秒的指标;
+    找不到匹配的chunk在unmatched为'drop'时丢弃, 为'raise'时抛出ValueError
+    """
+    X = chunk_features(chunks).reshape(-1, len(FEATURE_COLUMNS))
+    X, y = align_labels(X, *metric_labels(metrics), tolerance, unmatched)
+
+    instrument.count('rows', len(X))
+    instrument.observe('rows_per_file', len(X))
+    return X, y
+
+
+def align_labels(X, times, labels, tolerance=0.1, unmatched='drop'):
+    """按特征矩阵第0列(请求时间)为每行匹配标签, 参数含义见prepare_data"""
+    index, matched = match_nearest(X[:, 0], times, tolerance)
+    if not matched.all():
+        if unmatched == 'raise':
+            raise ValueError(f"{np.count_nonzero(~matched)} chunks have no metric within {tolerance}s")
+        X, index = X[matched], index[matched]
+    return X, labels[index]
+
+def predict(model, X):
+    """model.predict, 计入predict阶段"""
+    with instrument.stage('predict') as stage:
+        stage.count('rows', len(X))
+        return model.predict(X)
+
 
 def print_metrics(model, X_test, y_test):
     # 模型评估
-    y_pred = model.predict(X_test)
+    y_pred = predict(model, X_test)
 
     # 分割预测值和实际值
     y_pred_event = y_pred[:, 0]
@@ -61,7 +123,7 @@ def print_metrics(model, X_test, y_test):
 
 def print_metrics_to_string(model, X_test, y_test):
     # 模型评估
-    y_pred = model.predict(X_test)
+    y_pred = predict(model, X_test)
 
     y_pred_event = y_pred[:, 0]
     y_test_event = y_test[:, 0]
@@ -79,6 +141,7 @@ def print_metrics_to_string(model, X_test, y_test):
 # 新增：计算并打印多种评估指标
 # 低缓冲警告的准确率为92%，视频状态的准确率为84%，视频分辨率的准确率为66%
 def evaluate_metrics(y_true, y_pred):
+    metrics = _sklearn_metrics()
 
     # 对于多分类问题，我们假设y_pred是概率分布，选择值最大的类别作为预测结果
     if y_pred.ndim > 1 and y_pred.shape[1] > 1:  # 检查是否为多分类问题
@@ -86,9 +149,9 @@ def evaluate_metrics(y_true, y_pred):
         y_true_class = np.argmax(y_true, axis=1) if y_true.ndim > 1 and y_true.shape[1] > 1 else y_true
 
         # 计算分类指标
-        accuracy = accuracy_score(y_true_class, y_pred_class)
-        recall = recall_score(y_true_class, y_pred_class, average='weighted')
-        f4 = fbeta_score(y_true_class, y_pred_class, beta=4, average='weighted')
+        accuracy = metrics.accuracy_score(y_true_class, y_pred_class)
+        recall = metrics.recall_score(y_true_class, y_pred_class, average='weighted')
+        f4 = metrics.fbeta_score(y_true_class, y_pred_class, beta=4, average='weighted')
 
         print(f"\n准确率 (Accuracy): {accuracy:.4f}")
         print(f"召回率 (Recall): {recall:.4f}")
@@ -96,22 +159,23 @@ def evaluate_metrics(y_true, y_pred):
 
         # 打印详细的分类报告
         print("\n详细分类报告:")
-        print(classification_report(y_true_class, y_pred_class))
+        print(metrics.classification_report(y_true_class, y_pred_class))
     else:
         # 对于二分类或连续值问题，使用阈值方法
         y_true_binary = (y_true > 0.5).astype(int)
         y_pred_binary = (y_pred > 0.5).astype(int)
 
         # 计算分类指标
-        accuracy = accuracy_score(y_true_binary, y_pred_binary)
-        recall = recall_score(y_true_binary, y_pred_binary, average='weighted')
-        f4 = fbeta_score(y_true_binary, y_pred_binary, beta=4, average='weighted')
+        accuracy = metrics.accuracy_score(y_true_binary, y_pred_binary)
+        recall = metrics.recall_score(y_true_binary, y_pred_binary, average='weighted')
+        f4 = metrics.fbeta_score(y_true_binary, y_pred_binary, beta=4, average='weighted')
 
         print(f"\n准确率 (Accuracy): {accuracy:.4f}")
         print(f"召回率 (Recall): {recall:.4f}")
         print(f"F4分数 (F4 Score): {f4:.4f}")
 
 def evaluate_metrics_to_string(y_true, y_pred):
+    metrics = _sklearn_metrics()
 
     # 对于多分类问题，我们假设y_pred是概率分布，选择值最大的类别作为预测结果
     if y_pred.ndim > 1 and y_pred.shape[1] > 1:  # 检查是否为多分类问题
@@ -119,9 +183,9 @@ def evaluate_metrics_to_string(y_true, y_pred):
         y_true_class = np.argmax(y_true, axis=1) if y_true.ndim > 1 and y_true.shape[1] > 1 else y_true
 
         # 计算分类指标
-        accuracy = accuracy_score(y_true_class, y_pred_class)
-        recall = recall_score(y_true_class, y_pred_class, average='weighted')
-        f4 = fbeta_score(y_true_class, y_pred_class, beta=4, average='weighted')
+        accuracy = metrics.accuracy_score(y_true_class, y_pred_class)
+        recall = metrics.recall_score(y_true_class, y_pred_class, average='weighted')
+        f4 = metrics.fbeta_score(y_true_class, y_pred_class, beta=4, average='weighted')
 
         return [accuracy, recall, f4]
 
@@ -131,14 +195,75 @@ def evaluate_metrics_to_string(y_true, y_pred):
         y_pred_binary = (y_pred > 0.5).astype(int)
 
         # 计算分类指标
-        accuracy = accuracy_score(y_true_binary, y_pred_binary)
-        recall = recall_score(y_true_binary, y_pred_binary, average='weighted')
-        f4 = fbeta_score(y_true_binary, y_pred_binary, beta=4, average='weighted')
+        accuracy = metrics.accuracy_score(y_true_binary, y_pred_binary)
+        recall = metrics.recall_score(y_true_binary, y_pred_binary, average='weighted')
+        f4 = metrics.fbeta_score(y_true_binary, y_pred_binary, beta=4, average='weighted')
 
         return [accuracy, recall, f4]
 
+# 三个输出和每个输出的评估指标, 与print_metrics_to_string返回的9个值的顺序一致
+OUTPUT_NAMES = ('event', 'quality', 'warning')
+SCORE_NAMES = ('accuracy', 'recall', 'f4')
+
+
+def binary_counts(y_true, y_pred, groups=None, n_groups=1):
+    """标签按0.5阈值二值化后每组的混淆矩阵, 返回形状为(n_groups, 真实值, 预测值)的数组
+
+    groups为每行所属的组号(None时全部为第0组)
+    """
+    true = (np.asarray(y_true) > 0.5).astype(np.int64)
+    pred = (np.asarray(y_pred) > 0.5).astype(np.int64)
+    groups = np.zeros(len(true), dtype=np.int64) if groups is None else np.asarray(groups)
+
+    counts = np.bincount(groups * 4 + true * 2 + pred, minlength=n_groups * 4)
+    return counts.reshape(n_groups, 2, 2).astype(np.float64)
+
+
+def counts_to_scores(counts, beta=4):
+    """由混淆矩阵计算准确率、加权召回率和加权F-beta, counts形状为(..., 2, 2), 返回(..., 3)"""
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum(axis=(-2, -1))
+    tp = counts[..., [0, 1], [0, 1]]
+    support = counts.sum(axis=-1)
+    predicted = counts.sum(axis=-2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        denom = beta ** 2 * precision + recall
+        f = np.where(denom > 0, (1 + beta ** 2) * precision * recall / denom, 0.0)
+        scores = np.stack([
+            tp.sum(axis=-1) / total,
+            (recall * support).sum(axis=-1) / total,
+            (f * support).sum(axis=-1) / total,
+        ], axis=-1)
+    return np.nan_to_num(scores)
+
+
+def binary_scores(y_true, y_pred, groups=None, n_groups=1, beta=4):
+    """按组批量计算与evaluate_metrics_to_string对一维标签相同的指标, 返回形状为(n_groups, 3)的数组"""
+    return counts_to_scores(binary_counts(y_true, y_pred, groups, n_groups), beta)
+
+
+def output_counts(y_true, y_pred, groups=None, n_groups=1):
+    """三个输出各自的混淆矩阵, 返回形状为(n_groups, 3个输出, 2, 2)的数组"""
+    return np.stack([binary_counts(y_true[:, k], y_pred[:, k], groups, n_groups)
+                     for k in range(len(OUTPUT_NAMES))], axis=1)
+
+
+def score_outputs(y_true, y_pred, groups=None, n_groups=1):
+    """对三个输出分别计算指标, 返回形状为(n_groups, 3个输出, 3个指标)的数组"""
+    return counts_to_scores(output_counts(y_true, y_pred, groups, n_groups))
+
+
+def scores_to_dict(scores):
+    """把(3个输出, 3个指标)的数组转换为{输出: {指标: 值}}"""
+    return {output: {name: float(scores[k, i]) for i, name in enumerate(SCORE_NAMES)}
+            for k, output in enumerate(OUTPUT_NAMES)}
+
 # 新增：保存模型到本地文件
 def save_model(model, filename='output/random_forest_model.joblib'):
+    import joblib
     try:
         joblib.dump(model, filename)
         print(f"模型已成功保存到 {filename}")
@@ -148,7 +273,12 @@ def save_model(model, filename='output/random_forest_model.joblib'):
 # 新增：从本地文件加载模型
 def load_model(filename='output/model_A1_final.joblib'):
     try:
-        model = joblib.load(filename)
+        # 编译后的森林直接映射节点数组, 否则按joblib反序列化
+        if is_compiled_model(filename):
+            model = load_compiled(filename)
+        else:
+            import joblib
+            model = joblib.load(filename)
         print(f"模型已成功从 {filename} 加载")
         return model
     except Exception as e:
@@ -190,4 +320,14 @@ def metrics_to_string(y_pred):
     warning_value = int(np.round(slices['warning'][0]))  # 转换为0/1整数
     results.append(MAPPINGS['warning'][warning_value])
 
-    return results
\ No newline at end of file
+    return results
+
+
+def labels_to_string(labels):
+    """把predict输出的一行(事件类型, 画质类型, 缓冲警告)转换为文字描述, 类型为-1时按第0类处理"""
+    event, quality, warning = (int(v) for v in labels)
+    y_pred = np.zeros(4 + 9 + 1)
+    y_pred[max(event, 0)] = 1
+    y_pred[4 + max(quality, 0)] = 1
+    y_pred[-1] = warning
+    return metrics_to_string(y_pred)
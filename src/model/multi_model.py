@@ -1,131 +1,144 @@
 import os
 
-from . import random_forest
-from . import model_util
-from pcap import chunkDetect, metricParser
-
-
-def train_multiple_models():
-    final_model = []
+import numpy as np
 
-    pcap_directory = "output/chunk/A0"
-    metric_directory = "data/A0/MERGED_FILES"
-
-    flag = 1
-
-    # 遍历数据目录，为每个文件训练一个模型
-    for filename in os.listdir(pcap_directory):
-        if filename.endswith('.txt'):
-            pcap_file = os.path.join(pcap_directory, filename)
-            metric_file = os.path.join(metric_directory,
-                                       filename
-                                       .replace('chunk_', '')
-                                       .replace('.txt', '_merged.txt'))
-
-            # 提取指标
-            stream_map = chunkDetect.load_chunk(pcap_file)
-            metrics = metricParser.read_metric(metric_file)
-
-            X, y = model_util.prepare_data(stream_map, metrics)
-            if len(X) <= 5:
-                print(f"stream map is empty: {filename}")
-                continue
-            print(filename)
-
-            if flag == 1:
-                final_model = random_forest.train_model(X, y)
-                flag = 0
-            else:
-                final_model = random_forest.train_model_base_on(X, y, final_model)
-
-    model_filename = f"output/model_A0_final.joblib"
-    model_util.save_model(final_model, model_filename)
+from . import model_util
+from .feature_cache import FeatureCache
+from pcap.chunkStore import CHUNK_SUFFIX, TEXT_SUFFIX
 
-def test_final_models():
-    final_model =  model_util.load_model("output/model_final.joblib")
+_feature_cache = None
 
-    pcap_directory = "output/chunk/A2"
-    metric_directory = "data/A2/MERGED_FILES"
 
-    m = [0.0] * 9
-    count = 0
+def shared_feature_cache():
+    """共享的特征缓存, 第一次使用时才读取缓存目录的索引"""
+    global _feature_cache
+    if _feature_cache is None:
+        _feature_cache = FeatureCache()
+    return _feature_cache
 
-    for filename in os.listdir(pcap_directory):
-        if filename.endswith('.txt'):
-            pcap_file = os.path.join(pcap_directory, filename)
-            metric_file = os.path.join(metric_directory,
-                                       filename
-                                       .replace('chunk_', '')
-                                       .replace('.txt', '_merged.txt'))
 
-            # 提取指标
-            stream_map = chunkDetect.load_chunk(pcap_file)
-            metrics = metricParser.read_metric(metric_file)
+def chunk_files(pcap_directory, metric_directory):
+    """遍历chunk目录, 产出(文件名, chunk文件, 对应的metric文件), 支持二进制和文本两种格式
 
-            X, y = model_util.prepare_data(stream_map, metrics)
-            if len(X) <= 5:
-                print(f"stream map is empty: {filename}")
-                continue
-            count = count + 1
-            print(filename)
-            res = model_util.print_metrics_to_string(final_model, X, y)
-            m = [a + b for a, b in zip(m, res)]
+    同一抓包同时有二进制和文本两种chunk文件时(如之前用--text转换过)只产出二进制的一个
+    """
+    filenames = set(os.listdir(pcap_directory))
+    for filename in sorted(filenames):
+        for suffix in (CHUNK_SUFFIX, TEXT_SUFFIX):
+            if filename.endswith(suffix):
+                name = filename[:-len(suffix)]
+                if suffix == TEXT_SUFFIX and name + CHUNK_SUFFIX in filenames:
+                    continue
+                pcap_file = os.path.join(pcap_directory, filename)
+                metric_file = os.path.join(metric_directory,
+                                           name.replace('chunk_', '') + '_merged.txt')
+                yield filename, pcap_file, metric_file
 
 
-    for metric in m:
-        metric /= count
+def train_multiple_models():
+    # sklearn只在训练时导入, 评估编译后的模型不需要
+    from . import random_forest
 
-    print("\n=== Playback Event 评估 ===")
+    final_model = random_forest.IncrementalForest()
 
-    print(f"\n准确率 (Accuracy): {m[0]:.4f}")
-    print(f"召回率 (Recall): {m[1]:.4f}")
-    print(f"F4分数 (F4 Score): {m[2]:.4f}")
+    pcap_directory = "output/chunk/A0"
+    metric_directory = "data/A0/MERGED_FILES"
 
-    print("\n=== Playback Quality 评估 ===")
+    # 遍历数据目录，为每个文件训练一个模型
+    for filename, pcap_file, metric_file in chunk_files(pcap_directory, metric_directory):
+        # 提取指标, 文件未变化时直接使用缓存的特征
+        X, y = shared_feature_cache().load(pcap_file, metric_file)
+        if len(X) <= 5:
+            print(f"stream map is empty: {filename}")
+            continue
+        print(filename)
 
-    print(f"\n准确率 (Accuracy): {m[3]:.4f}")
-    print(f"召回率 (Recall): {m[4]:.4f}")
-    print(f"F4分数 (F4 Score): {m[5]:.4f}")
+        final_model = random_forest.train_model_base_on(X, y, final_model)
 
-    print("\n=== Buffer Health 评估 ===")
+    model_filename = f"output/model_A0_final.joblib"
+    model_util.save_model(final_model, model_filename)
 
-    print(f"\n准确率 (Accuracy): {m[6]:.4f}")
-    print(f"召回率 (Recall): {m[7]:.4f}")
-    print(f"F4分数 (F4 Score): {m[8]:.4f}")
+def test_final_models(model_file="output/model_final.joblib", pcap_directory="output/chunk/A2",
+                      metric_directory="data/A2/MERGED_FILES", workers=None):
+    """在测试集上评估模型, 返回每个文件以及汇总的评估结果
+
+    未缓存的文件用进程池并行提取特征, 所有文件的特征拼接后只调用一次predict,
+    再按每个文件在拼接矩阵中的偏移分组计算指标;
+    micro为所有样本合在一起计算的指标, macro为各文件指标的平均值
+    """
+    final_model = model_util.load_model(model_file)
+    if final_model is None:
+        return None
+
+    files = sorted(chunk_files(pcap_directory, metric_directory))
+    pairs = [(pcap_file, metric_file) for _, pcap_file, metric_file in files]
+    data = shared_feature_cache().load_many(pairs, workers=workers)
+
+    names, features, labels = [], [], []
+    for (filename, _, _), (X, y) in zip(files, data):
+        if len(X) <= 5:
+            print(f"stream map is empty: {filename}")
+            continue
+        names.append(filename)
+        features.append(X)
+        labels.append(y)
+    if not names:
+        print("no test data")
+        return None
+
+    rows = np.array([len(X) for X in features])
+    offsets = np.concatenate([[0], np.cumsum(rows)])
+    y_true = np.vstack(labels)
+    y_pred = model_util.predict(final_model, np.vstack(features))
+
+    groups = np.repeat(np.arange(len(names)), rows)
+    file_scores = model_util.score_outputs(y_true, y_pred, groups, len(names))
+    micro = model_util.score_outputs(y_true, y_pred)[0]
+    macro = file_scores.mean(axis=0)
+
+    report = {
+        'files': [{'file': name, 'offset': int(offsets[i]), 'rows': int(rows[i]),
+                   'scores': model_util.scores_to_dict(file_scores[i])}
+                  for i, name in enumerate(names)],
+        'micro': model_util.scores_to_dict(micro),
+        'macro': model_util.scores_to_dict(macro),
+    }
+
+    for i, name in enumerate(names):
+        print(f"{name}: {rows[i]} rows, " + ', '.join(
+            f"{output} {file_scores[i, k, 0]:.4f}" for k, output in enumerate(model_util.OUTPUT_NAMES)))
+
+    for title, output in (("Playback Event", 'event'), ("Playback Quality", 'quality'),
+                          ("Buffer Health", 'warning')):
+        print(f"\n=== {title} 评估 ===")
+        for average in ('macro', 'micro'):
+            scores = report[average][output]
+            print(f"\n[{average}] 准确率 (Accuracy): {scores['accuracy']:.4f}")
+            print(f"[{average}] 召回率 (Recall): {scores['recall']:.4f}")
+            print(f"[{average}] F4分数 (F4 Score): {scores['f4']:.4f}")
+
+    return report
 
 def train_final_model():
-    final_model = []
+    # sklearn只在训练时导入, 评估编译后的模型不需要
+    from . import random_forest
+
+    final_model = random_forest.IncrementalForest()
 
     pcap_directories = ["output/chunk/A0", "output/chunk/A1", "output/chunk/A2"]
     metric_directories = ["data/A0/MERGED_FILES", "data/A1/MERGED_FILES", "data/A2/MERGED_FILES"]
 
-    flag = 1
-
     for pcap_directory, metric_directory in zip(pcap_directories, metric_directories):
         # 遍历数据目录，为每个文件训练一个模型
-        for filename in os.listdir(pcap_directory):
-            if filename.endswith('.txt'):
-                pcap_file = os.path.join(pcap_directory, filename)
-                metric_file = os.path.join(metric_directory,
-                                           filename
-                                           .replace('chunk_', '')
-                                           .replace('.txt', '_merged.txt'))
-
-                # 提取指标
-                stream_map = chunkDetect.load_chunk(pcap_file)
-                metrics = metricParser.read_metric(metric_file)
-
-                X, y = model_util.prepare_data(stream_map, metrics)
-                if len(X) <= 5:
-                    print(f"stream map is empty: {filename}")
-                    continue
-                print(filename)
+        for filename, pcap_file, metric_file in chunk_files(pcap_directory, metric_directory):
+            # 提取指标, 文件未变化时直接使用缓存的特征
+            X, y = shared_feature_cache().load(pcap_file, metric_file)
+            if len(X) <= 5:
+                print(f"stream map is empty: {filename}")
+                continue
+            print(filename)
 
-                if flag == 1:
-                    final_model = random_forest.train_model(X, y)
-                    flag = 0
-                else:
-                    final_model = random_forest.train_model_base_on(X, y, final_model)
+            final_model = random_forest.train_model_base_on(X, y, final_model)
 
     model_filename = f"output/model_final.joblib"
     model_util.save_model(final_model, model_filename)
\ No newline at end of file
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+
+from pcap import chunkDetect, pcapDecoder
+from pcap.chunk import RunningMeanClassifier
+from . import model_util
+
+
+class OnlinePredictor:
+    """实时QoE推断: 每个chunk在save_chunk保存时立即提取特征并预测
+
+    chunk类型由在线判断器在chunk保存时确定(默认为RunningMeanClassifier: 大于所在流目前为止的平均大小为视频),
+    不等待整条流结束;
+    latency记录从结束该chunk的GET包交给检测器到预测完成的耗时(秒)
+    on_result(result)在每次预测后回调, result为包含流地址、请求时间、预测标签和延迟的字典
+    长时间运行时用idle_timeout/max_flows限制同时跟踪的流, 见chunkDetect.ChunkDetector
+    """
+
+    def __init__(self, model, on_result=None, classifier=RunningMeanClassifier, idle_timeout=None, max_flows=None):
+        self.model = model
+        self.on_result = on_result
+        self.detector = chunkDetect.ChunkDetector(on_chunk=self._on_chunk, classifier=classifier,
+                                                  idle_timeout=idle_timeout, max_flows=max_flows)
+        self.latencies = []
+        self._arrival = 0.0
+
+    def _timed(self, records):
+        for record in records:
+            self._arrival = time.perf_counter()
+            yield record
+
+    def _on_chunk(self, ip_stream, chunk):
+        features = np.array([[chunk.request_time, chunk.first_byte_wait_time, chunk.download_time,
+                              chunk.slack_time, chunk.size, chunk.type.value]])
+        labels = self.model.predict(features)[0]
+        latency = time.perf_counter() - self._arrival
+        self.latencies.append(latency)
+
+        if self.on_result is not None:
+            self.on_result({
+                'src': ip_stream.src,
+                'dst': ip_stream.dst,
+                'request_time': chunk.request_time,
+                'labels': labels,
+                'text': model_util.labels_to_string(labels),
+                'latency': latency,
+            })
+
+    def run(self, records):
+        """处理包记录直到结束, 返回按批处理方式判断类型后的stream_map"""
+        self.detector.feed(self._timed(records))
+        return self.detector.finish()
+
+    def latency_stats(self):
+        if not self.latencies:
+            return {'chunks': 0}
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'chunks': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'max_ms': float(latencies.max()),
+        }
+
+
+def print_result(result):
+    event, quality, warning = result['text']
+    print(f"[{result['request_time']:.3f}s] {result['src']} -> {result['dst']}: "
+          f"{event}, {quality}, {warning} ({result['latency'] * 1000:.1f} ms)")
+    if result['labels'][2] == 1:
+        print("!!! 缓冲不足警告")
+
+
+def run_online(pcap_file, model_file='output/model_final.joblib', follow=False, speed=None,
+               follow_timeout=5.0, idle_timeout=None, max_flows=None):
+    """对pcap文件做实时推断
+
+    follow为True时跟踪仍在写入的文件, 文件follow_timeout秒未增长时结束; speed不为None时按包时间戳以speed倍速回放;
+    idle_timeout/max_flows限制同时跟踪的流, 与convert的同名参数含义相同(见chunkDetect.ChunkDetector)
+    """
+    model = model_util.load_model(model_file)
+    if model is None:
+        return None
+
+    if follow:
+        records = pcapDecoder.follow_packets(pcap_file, idle_timeout=follow_timeout)
+    else:
+        records = pcapDecoder.iter_packets(pcap_file)
+    if speed is not None:
+        records = pcapDecoder.replay(records, speed)
+
+    predictor = OnlinePredictor(model, on_result=print_result, idle_timeout=idle_timeout, max_flows=max_flows)
+    predictor.run(records)
+    stats = predictor.latency_stats()
+    print(f"latency: {stats}")
+    return stats
@@ -0,0 +1,309 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+import instrument
+from pcap import chunkConvert, chunkDetect, chunkStore, metricParser
+from . import model_util
+
+# 异步流水线: 把数据集目录的处理拆成以有界队列相连的阶段, 使磁盘读写、解析和模型计算同时进行
+#
+#   发现文件 -> 检测chunk/解析指标(进程池) -> 对齐特征 -> 批量预测或增量训练(线程) -> 写出结果(线程)
+#
+# 每个队列最多容纳queue_size项, 下游阶段跟不上时上游在put处等待(背压), 内存占用与数据集大小无关;
+# 写出后每个文件只保留行数和三个输出的混淆矩阵(用于score_jobs), 特征和标签随即释放;
+# 检测阶段同时处理workers个文件, 其余阶段各一个协程, 吞吐量接近最慢的阶段.
+# chunk文件在检测后直接写出, 特征由内存中的chunk记录提取, 不再重新读取chunk文件;
+# 输出目录中的清单(chunkConvert.BuildManifest)未过期的pcap直接读取已有的chunk文件
+
+QUEUE_SIZE = 4
+# 预测阶段合并多个文件的特征, 累计达到这么多行或上游暂时没有数据时调用一次predict
+BATCH_ROWS = 8192
+
+
+@dataclass
+class Job:
+    """流水线中的一个pcap文件, 各阶段依次填入结果"""
+    name: str
+    pcap_file: str
+    chunk_file: str
+    metric_file: Optional[str]
+    current: bool = False           # chunk文件未过期, 跳过检测
+    source: Optional[tuple] = None  # 检测前输入的(大小, 修改时间, sha256), 用于更新清单
+    chunks: Optional[np.ndarray] = None
+    times: Optional[np.ndarray] = None
+    labels: Optional[np.ndarray] = None
+    X: Optional[np.ndarray] = None
+    y: Optional[np.ndarray] = None
+    y_pred: Optional[np.ndarray] = None
+    rows: int = 0
+    counts: Optional[np.ndarray] = None  # (3个输出, 真实值, 预测值)的混淆矩阵, 写出后代替y和y_pred
+
+
+def detect_chunks(pcap_file, chunk_file, current=False, known=None):
+    """子进程: 检测chunk并原子地写出chunk文件, current为True时直接读取已有的chunk文件
+
+    known为清单中记录的输入状态, 见chunkConvert.source_state;
+    返回(输入的(大小, 修改时间, sha256)或None, chunk记录, 本进程的统计数据)
+    """
+    if current:
+        _, records = chunkDetect.load_chunk_table(chunk_file)
+        return None, np.array(records), instrument.drain()
+
+    source = chunkConvert.source_state(pcap_file, known)
+    stream_map = chunkDetect.chunk_detect(pcap_file, vectorized=True)
+    if stream_map is None:
+        raise RuntimeError(f"chunk detect failed: {pcap_file}")
+    chunkConvert.write_chunk_file(stream_map, chunk_file)
+    return source, chunkStore.stream_map_to_table(stream_map)[1], instrument.drain()
+
+
+def read_labels(metric_file):
+    """子进程: 读取指标文件的相对时间和标签"""
+    times, labels = model_util.metric_labels(metricParser.read_metric_table(metric_file))
+    return times, labels, instrument.drain()
+
+
+class Pipeline:
+    """处理一个数据集目录的流水线, model为None时只转换和提取特征
+
+    train为True时对每个文件的特征调用random_forest.train_model_base_on增量训练model,
+    否则批量预测, 预测结果写入result_path/<pcap文件名>.txt
+    busy记录每个阶段实际工作的秒数(检测阶段为所有并发任务之和), 用于找出瓶颈
+    """
+
+    def __init__(self, pcap_directory, chunk_path, metric_directory=None, model=None, result_path=None,
+                 train=False, workers=None, queue_size=QUEUE_SIZE, batch_rows=BATCH_ROWS,
+                 tolerance=0.1, force=False):
+        self.pcap_directory = pcap_directory
+        self.chunk_path = chunk_path
+        self.metric_directory = metric_directory
+        self.model = model
+        self.result_path = result_path
+        self.train = train
+        self.workers = workers or os.cpu_count()
+        self.queue_size = queue_size
+        self.batch_rows = batch_rows
+        self.tolerance = tolerance
+        self.force = force
+
+        self.manifest = None
+        self.params = chunkConvert.build_params()
+        self.busy = {name: 0.0 for name in ('discover', 'detect', 'align', 'model', 'write')}
+        self.elapsed = 0.0
+        self.done = []
+        self.failed = []
+
+    def run(self):
+        """运行流水线, 返回处理完成的Job列表(按文件名排序)"""
+        return asyncio.run(self.run_async())
+
+    async def run_async(self):
+        os.makedirs(self.chunk_path, exist_ok=True)
+        if self.result_path:
+            os.makedirs(self.result_path, exist_ok=True)
+        self.manifest = chunkConvert.BuildManifest(self.chunk_path)
+
+        files = asyncio.Queue(self.queue_size)
+        parsed = asyncio.Queue(self.queue_size)
+        aligned = asyncio.Queue(self.queue_size)
+        predicted = asyncio.Queue(self.queue_size)
+
+        start = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                await self._gather(
+                    self.discover(files),
+                    self.detect(files, parsed, executor),
+                    self.align(parsed, aligned),
+                    self.apply_model(aligned, predicted),
+                    self.write(predicted),
+                )
+        finally:
+            self.manifest.save(force=True)
+        self.elapsed = time.perf_counter() - start
+
+        self.done.sort(key=lambda job: job.name)
+        for name, seconds in self.busy.items():
+            instrument.observe(f"pipeline_{name}_busy_seconds", seconds)
+        return self.done
+
+    @staticmethod
+    async def _gather(*stages):
+        """并发运行各阶段, 任一阶段出错时取消其他阶段, 避免它们在队列上永远等待"""
+        tasks = [asyncio.ensure_future(stage) for stage in stages]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def discover(self, files):
+        """按文件大小从大到小产出Job, 清单中未过期的文件标记为current"""
+        start = time.perf_counter()
+        names = [f for f in os.listdir(self.pcap_directory) if f.endswith('.pcap')]
+        names.sort(key=lambda f: os.path.getsize(os.path.join(self.pcap_directory, f)), reverse=True)
+        self.busy['discover'] += time.perf_counter() - start
+
+        for name in names:
+            start = time.perf_counter()
+            job = Job(name=name,
+                      pcap_file=os.path.join(self.pcap_directory, name),
+                      chunk_file=os.path.join(self.chunk_path, chunkConvert.chunk_file_name(name)),
+                      metric_file=None)
+            if self.metric_directory is not None:
+                metric_file = os.path.join(self.metric_directory, name.replace('.pcap', '_merged.txt'))
+                job.metric_file = metric_file if os.path.exists(metric_file) else None
+            job.current = not self.force and self.manifest.is_current(name, job.pcap_file, job.chunk_file,
+                                                                      self.params)
+            self.busy['discover'] += time.perf_counter() - start
+            await files.put(job)
+        for _ in range(self.workers):
+            await files.put(None)
+
+    async def detect(self, files, parsed, executor):
+        """workers个协程并发地在进程池中检测chunk和解析指标, 单个文件失败不影响其他文件"""
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            while (job := await files.get()) is not None:
+                start = time.perf_counter()
+                try:
+                    tasks = [loop.run_in_executor(executor, detect_chunks,
+                                                  job.pcap_file, job.chunk_file, job.current,
+                                                  self.manifest.source(job.name))]
+                    if job.metric_file is not None:
+                        tasks.append(loop.run_in_executor(executor, read_labels, job.metric_file))
+                    results = await asyncio.gather(*tasks)
+                except Exception as e:
+                    self.failed.append(job.name)
+                    print(f"{job.name} 处理失败: {e}")
+                    continue
+                finally:
+                    self.busy['detect'] += time.perf_counter() - start
+
+                job.source, job.chunks, stats = results[0]
+                instrument.merge(stats)
+                if job.source is not None:
+                    self.manifest.record(job.name, job.source, job.chunk_file, self.params)
+                    self.manifest.save()
+                if len(results) > 1:
+                    job.times, job.labels, stats = results[1]
+                    instrument.merge(stats)
+                await parsed.put(job)
+
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
+        await parsed.put(None)
+
+    async def align(self, parsed, aligned):
+        """提取特征并按请求时间匹配标签, 没有指标文件时只提取特征"""
+        while (job := await parsed.get()) is not None:
+            start = time.perf_counter()
+            job.X = model_util.chunk_features(job.chunks)
+            job.chunks = None
+            if job.labels is not None:
+                job.X, job.y = model_util.align_labels(job.X, job.times, job.labels, self.tolerance)
+                job.times = job.labels = None
+            job.rows = len(job.X)
+            self.busy['align'] += time.perf_counter() - start
+            await aligned.put(job)
+        await aligned.put(None)
+
+    async def apply_model(self, aligned, predicted):
+        """训练时逐个文件增量训练; 预测时合并已到达的文件, 每批只调用一次predict"""
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            job = await aligned.get()
+            if job is None:
+                break
+            batch, rows = [job], len(job.X)
+            # 不等待上游, 只合并已经在队列中的文件
+            while rows < self.batch_rows and not aligned.empty():
+                job = aligned.get_nowait()
+                if job is None:
+                    finished = True
+                    break
+                batch.append(job)
+                rows += len(job.X)
+
+            start = time.perf_counter()
+            if self.model is not None and self.train:
+                for job in batch:
+                    if job.y is not None and len(job.X) > 5:
+                        self.model = await loop.run_in_executor(None, self._fit, job.X, job.y)
+            elif self.model is not None and rows > 0:
+                y_pred = await loop.run_in_executor(None, model_util.predict, self.model,
+                                                    np.vstack([job.X for job in batch]))
+                offset = 0
+                for job in batch:
+                    job.y_pred = y_pred[offset:offset + len(job.X)]
+                    offset += len(job.X)
+            self.busy['model'] += time.perf_counter() - start
+
+            for job in batch:
+                await predicted.put(job)
+        await predicted.put(None)
+
+    def _fit(self, X, y):
+        from . import random_forest
+
+        return random_forest.train_model_base_on(X, y, self.model)
+
+    async def write(self, predicted):
+        """把每个文件的预测结果写入result_path, 然后只保留评估所需的混淆矩阵"""
+        loop = asyncio.get_running_loop()
+        while (job := await predicted.get()) is not None:
+            start = time.perf_counter()
+            if self.result_path and job.y_pred is not None:
+                await loop.run_in_executor(None, write_predictions, job,
+                                           os.path.join(self.result_path, job.name.replace('.pcap', '.txt')))
+            if job.y is not None and job.y_pred is not None and job.rows > 5:
+                job.counts = model_util.output_counts(job.y, job.y_pred)[0]
+            job.X = job.y = job.y_pred = None
+            self.busy['write'] += time.perf_counter() - start
+            self.done.append(job)
+            print(f"[{len(self.done)}] {job.name}: {job.rows} rows")
+
+    def print_summary(self):
+        print(f"\n{len(self.done)} files, {len(self.failed)} failed, {self.elapsed:.1f}s")
+        for name, seconds in self.busy.items():
+            workers = self.workers if name == 'detect' else 1
+            print(f"{name:>10}: busy {seconds:.1f}s ({seconds / workers / self.elapsed:.0%} of wall time)"
+                  if self.elapsed > 0 else f"{name:>10}: busy {seconds:.1f}s")
+
+
+def write_predictions(job, path):
+    """每行为chunk的请求时间和预测的标签, 与main.py predict的输出相同"""
+    lines = [f"{row[0]:.3f}: " + ', '.join(model_util.labels_to_string(labels))
+             for row, labels in zip(job.X, job.y_pred)]
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(lines) + '\n' if lines else '')
+    os.replace(tmp, path)
+
+
+def score_jobs(jobs):
+    """有标签且有预测结果的文件的评估结果, 格式与multi_model.test_final_models的报告相同
+
+    由各文件的混淆矩阵计算, 微平均为所有文件混淆矩阵之和的指标
+    """
+    jobs = [job for job in jobs if job.counts is not None]
+    if not jobs:
+        return None
+
+    counts = np.stack([job.counts for job in jobs])
+    file_scores = model_util.counts_to_scores(counts)
+    return {
+        'files': [{'file': job.name, 'rows': job.rows, 'scores': model_util.scores_to_dict(file_scores[i])}
+                  for i, job in enumerate(jobs)],
+        'micro': model_util.scores_to_dict(model_util.counts_to_scores(counts.sum(axis=0))),
+        'macro': model_util.scores_to_dict(file_scores.mean(axis=0)),
+    }
@@ -0,0 +1,160 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from . import model_util
+
+
+class MicroBatcher:
+    """把并发到达的预测请求合并成批调用model.predict
+
+    后台线程取到第一个请求后, 继续收集请求直到累计行数达到max_batch或等待超过max_delay秒,
+    然后对整批特征只调用一次predict; latency记录每个请求从提交到得到结果的耗时
+    """
+
+    def __init__(self, model, max_batch=256, max_delay=0.005, history=10000):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.latencies = deque(maxlen=history)
+        self.total_requests = 0
+        self.total_rows = 0
+        self.total_batches = 0
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, features) -> Future:
+        future = Future()
+        self.requests.put((np.asarray(features, dtype=np.float64).reshape(-1, len(model_util.FEATURE_COLUMNS)),
+                           time.perf_counter(), future))
+        return future
+
+    def predict(self, features):
+        return self.submit(features).result()
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            rows = len(batch[0][0])
+            deadline = time.perf_counter() + self.max_delay
+            while rows < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                rows += len(item[0])
+            self._predict_batch(batch, rows)
+
+    def _predict_batch(self, batch, rows):
+        try:
+            labels = self.model.predict(np.vstack([features for features, _, _ in batch]))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        done = time.perf_counter()
+        with self.lock:
+            for features, submitted, future in batch:
+                future.set_result(labels[offset:offset + len(features)])
+                offset += len(features)
+                self.latencies.append(done - submitted)
+            self.total_requests += len(batch)
+            self.total_rows += rows
+            self.total_batches += 1
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            elapsed = time.perf_counter() - self.started
+            result = {
+                'requests': self.total_requests,
+                'rows': self.total_rows,
+                'batches': self.total_batches,
+                'requests_per_s': self.total_requests / elapsed,
+                'rows_per_s': self.total_rows / elapsed,
+            }
+        if len(latencies):
+            result['p50_ms'] = float(np.percentile(latencies, 50))
+            result['p99_ms'] = float(np.percentile(latencies, 99))
+        return result
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    """POST /predict {"features": [[...], ...]} 返回标签及文字描述, GET /stats 返回吞吐量和延迟统计"""
+
+    batcher = None
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            labels = self.batcher.predict(body['features'])
+        except Exception as e:
+            self._reply(400, {'error': str(e)})
+            return
+        self._reply(200, {
+            'labels': labels.tolist(),
+            'text': [model_util.labels_to_string(row) for row in labels],
+        })
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self._reply(404, {'error': 'not found'})
+            return
+        self._reply(200, self.batcher.stats())
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PredictServer(ThreadingHTTPServer):
+    # 大量短连接同时到达时避免监听队列溢出
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def make_server(model, host='127.0.0.1', port=8765, max_batch=256, max_delay=0.005):
+    handler = type('Handler', (PredictHandler,), {'batcher': MicroBatcher(model, max_batch, max_delay)})
+    return PredictServer((host, port), handler)
+
+
+def serve(model_file='output/model_final.joblib', host='127.0.0.1', port=8765,
+          max_batch=256, max_delay=0.005):
+    """常驻本地的预测服务, 模型只在启动时加载一次; 模型加载失败时返回False"""
+    model = model_util.load_model(model_file)
+    if model is None:
+        return False
+    server = make_server(model, host, port, max_batch, max_delay)
+    print(f"serving predictions on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return True
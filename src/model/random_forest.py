@@ -3,26 +3,104 @@ from sklearn.model_selection import train_test_split
 import numpy as np
 from sklearn.multioutput import MultiOutputClassifier
 
+import instrument
+
 
 # 模型训练
-def train_model(X, y):
+@instrument.timed('fit')
+def train_model(X, y, n_estimators=100, n_jobs=-1):
 
-    # 创建多输出分类器
+    # 创建多输出分类器, 默认用所有核并行训练树; 比较不同模型和参数见model_selection
     model = MultiOutputClassifier(
-        estimator=RandomForestClassifier(n_estimators=100)
+        estimator=RandomForestClassifier(n_estimators=n_estimators, n_jobs=n_jobs)
     )
 
     # 一起训练两个任务
     model.fit(X, y)
+    instrument.count('rows', len(X))
     return model
 
 # 在已有模型上训练
+@instrument.timed('fit')
 def train_model_base_on(X, y, model):
-    # 训练模型
+    instrument.count('rows', len(X))
+    # 支持增量训练的模型在原有基础上添加新的树, 否则重新训练
+    if hasattr(model, 'partial_fit'):
+        return model.partial_fit(X, y)
     model.fit(X, y)
     return model
 
 
+# IncrementalForest默认最多保留的树的数量, 模型大小和每行的预测开销基本不随训练文件数增长
+MAX_TREES = 500
+
+
+class IncrementalForest:
+    """按批增量训练的多输出随机森林
+
+    每次partial_fit只用当前批次的数据训练trees_per_batch棵新树并加入森林,
+    训练开销与数据量成线性关系;
+    树的数量超过max_trees(默认MAX_TREES)时每个批次只保留max_trees // 批次数棵树(至少1棵),
+    各批次保留的树一样多, 最早的文件不会被遗忘; 批次数超过max_trees后每批保留1棵树; max_trees为None时不设上限
+    预测时按树的数量加权平均各批次的类别概率, 类别取所有批次见过的类别的并集
+    """
+
+    def __init__(self, trees_per_batch=20, max_trees=MAX_TREES, n_jobs=None, random_state=None):
+        self.trees_per_batch = trees_per_batch
+        self.max_trees = max_trees
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.forests = []
+
+    @property
+    def n_estimators(self):
+        return sum(forest.n_estimators for forest in self.forests)
+
+    def fit(self, X, y):
+        self.forests = []
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y):
+        seed = None if self.random_state is None else self.random_state + len(self.forests)
+        forest = RandomForestClassifier(n_estimators=self.trees_per_batch,
+                                        n_jobs=self.n_jobs, random_state=seed)
+        forest.fit(X, np.asarray(y).reshape(len(y), -1))
+        self.forests.append(forest)
+
+        if self.max_trees is not None and self.n_estimators > self.max_trees:
+            self._thin(max(1, self.max_trees // len(self.forests)))
+        return self
+
+    def _thin(self, quota):
+        """每个批次只保留前quota棵树, 每棵树由不同的随机状态训练, 保留前几棵相当于随机抽样"""
+        for forest in self.forests:
+            if forest.n_estimators > quota:
+                forest.estimators_ = forest.estimators_[:quota]
+                forest.n_estimators = quota
+
+    def classes(self, output):
+        """第output个输出在所有批次中出现过的类别"""
+        return np.unique(np.concatenate([forest.classes_[output] if forest.n_outputs_ > 1
+                                         else forest.classes_ for forest in self.forests]))
+
+    def predict_proba(self, X):
+        """返回每个输出的类别概率列表, 列顺序与classes(output)一致"""
+        n_outputs = self.forests[0].n_outputs_
+        classes = [self.classes(k) for k in range(n_outputs)]
+        proba = [np.zeros((len(X), len(c))) for c in classes]
 
+        for forest in self.forests:
+            forest_proba = forest.predict_proba(X)
+            forest_classes = forest.classes_
+            if n_outputs == 1:
+                forest_proba, forest_classes = [forest_proba], [forest_classes]
+            for k in range(n_outputs):
+                columns = np.searchsorted(classes[k], forest_classes[k])
+                proba[k][:, columns] += forest_proba[k] * forest.n_estimators
 
+        total = self.n_estimators
+        return [p / total for p in proba]
 
+    def predict(self, X):
+        proba = self.predict_proba(X)
+        return np.column_stack([self.classes(k)[np.argmax(p, axis=1)] for k, p in enumerate(proba)])
@@ -1,7 +1,26 @@
 from enum import Enum
 
+import numpy as np
+
 DOWN_MIN_PAYLOAD = 80 * 1024
 
+# 一个chunk的定长记录, 也是二进制chunk文件(chunkStore)中的记录格式; flow只在文件中使用
+CHUNK_DTYPE = np.dtype([
+    ('request_time', '<f8'),
+    ('start', '<f8'),
+    ('end', '<f8'),
+    ('first_byte_wait_time', '<f8'),
+    ('download_time', '<f8'),
+    ('slack_time', '<f8'),
+    ('duration_time', '<f8'),
+    ('size', '<i8'),
+    ('flow', '<u4'),
+    ('type', 'i1'),
+], align=True)
+
+CHUNK_FIELDS = ('request_time', 'start', 'end', 'first_byte_wait_time', 'download_time',
+                'slack_time', 'duration_time', 'size')
+
 
 class PacketType(Enum):
     AUDIO = 0
@@ -11,6 +30,8 @@ class PacketType(Enum):
 
 # 下行chunk
 class Chunk:
+    __slots__ = CHUNK_FIELDS + ('type',)
+
     #   <--                           duration                          -->
     #   GET   first_byte_wait   start    download        end   slack    GET
     #    |                        |                       |              |
@@ -27,20 +48,176 @@ class Chunk:
         self.type = PacketType.BG
 
 
+class ChunkView:
+    """ChunkTable中一行的视图, 属性与Chunk相同, 读写直接作用于表中的数据"""
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def type(self):
+        return PacketType(int(self.table.array['type'][self.index]))
+
+    @type.setter
+    def type(self, value):
+        self.table.array['type'][self.index] = value.value
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)}" for name in CHUNK_FIELDS)
+        return f"ChunkView({fields}, type={self.type.name})"
+
+
+def _field_property(name):
+    def getter(self):
+        return self.table.array[name][self.index].item()
+
+    def setter(self, value):
+        self.table.array[name][self.index] = value
+
+    return property(getter, setter)
+
+
+for _name in CHUNK_FIELDS:
+    setattr(ChunkView, _name, _field_property(_name))
+
+
+# ChunkTable第一次分配的行数
+MIN_CAPACITY = 16
+# 所有空表共享的零长度数组, 追加时总是先换成新分配的数组
+_EMPTY = np.zeros(0, dtype=CHUNK_DTYPE)
+
+
+class ChunkTable:
+    """一条流的chunk, 按列连续存放在可增长的CHUNK_DTYPE结构化数组中
+
+    接口与chunk列表兼容: len、下标、迭代得到ChunkView, append接受Chunk或ChunkView;
+    array属性为已有记录的结构化数组视图, 可以不经复制直接交给NumPy
+    """
+
+    def __init__(self, capacity=0):
+        # 大多数流(背景流)从不产生chunk, 默认在第一次追加时才分配空间
+        self._data = np.zeros(capacity, dtype=CHUNK_DTYPE) if capacity else _EMPTY
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ChunkView(self, i) for i in range(*index.indices(self._size))]
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("chunk index out of range")
+        return ChunkView(self, index)
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield ChunkView(self, i)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    @property
+    def array(self):
+        return self._data[:self._size]
+
+    def column(self, name):
+        return self.array[name]
+
+    def _reserve(self, count):
+        if self._size + count > len(self._data):
+            data = np.zeros(max(2 * len(self._data), self._size + count, MIN_CAPACITY), dtype=CHUNK_DTYPE)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+    def append(self, chunk):
+        self._reserve(1)
+        row = self._data[self._size]
+        for name in CHUNK_FIELDS:
+            row[name] = getattr(chunk, name)
+        row['type'] = chunk.type.value
+        self._size += 1
+
+    def extend(self, records):
+        """追加CHUNK_DTYPE结构化数组中的记录"""
+        self._reserve(len(records))
+        self._data[self._size:self._size + len(records)] = records
+        self._size += len(records)
+
+    def clear(self):
+        self._size = 0
+
+
+class RunningMeanClassifier:
+    """在线判断chunk类型: 大于所在流目前为止(含当前chunk)的平均大小为视频, 否则为音频"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+
+    def classify(self, size) -> PacketType:
+        self.count += 1
+        self.total += size
+        return PacketType.VIDEO if size > self.total / self.count else PacketType.AUDIO
+
+
+class OnlineKMeans:
+    """在线判断chunk类型: 对chunk大小做两簇的在线k-means, 属于较大一簇的为视频
+
+    前两个chunk分别作为初始中心, 之后每个chunk归入最近的中心并把该中心移向它(步长为1/簇大小);
+    只有一个中心时按与该中心的大小关系判断
+    """
+
+    def __init__(self):
+        self.centers = []
+        self.counts = []
+
+    def classify(self, size) -> PacketType:
+        if len(self.centers) < 2:
+            video = bool(self.centers) and size > self.centers[0]
+            self.centers.append(float(size))
+            self.counts.append(1)
+        else:
+            k = 0 if abs(size - self.centers[0]) <= abs(size - self.centers[1]) else 1
+            self.counts[k] += 1
+            self.centers[k] += (size - self.centers[k]) / self.counts[k]
+            video = k == 1
+        # 保持centers[0]为音频簇, centers[1]为视频簇
+        if len(self.centers) == 2 and self.centers[0] > self.centers[1]:
+            self.centers.reverse()
+            self.counts.reverse()
+        return PacketType.VIDEO if video else PacketType.AUDIO
+
+
+CLASSIFIERS = {
+    'mean': RunningMeanClassifier,
+    'kmeans': OnlineKMeans,
+}
+
+
 class IpStream:
     def __init__(self, src, dst):
         self.src = src
         self.dst = dst
-        self.chunks = []
+        self.chunks = ChunkTable()
         self.chunk = Chunk(0)
         self.isDown = False
+        self.on_chunk = None  # chunk保存时的回调 on_chunk(ip_stream, chunk)
+        self.classifier = None  # 不为None时在chunk保存时立即判断类型, 见RunningMeanClassifier
 
     def save_chunk(self, next_get_time):
         if self.chunk.size > DOWN_MIN_PAYLOAD:
             self.chunk.download_time = self.chunk.end - self.chunk.start
             self.chunk.slack_time = next_get_time - self.chunk.end
             self.chunk.duration_time = next_get_time - self.chunk.request_time
+            if self.classifier is not None:
+                self.chunk.type = self.classifier.classify(self.chunk.size)
             self.chunks.append(self.chunk)
+            if self.on_chunk is not None:
+                self.on_chunk(self, self.chunks[-1])
         self.isDown = False
         self.chunk = Chunk(next_get_time)
 
@@ -55,13 +232,7 @@ class IpStream:
     def judge_type(self):
         if len(self.chunks) == 0: return
 
-        chunk_size = 0
-        for chunk in self.chunks:
-            chunk_size += chunk.size
-        chunk_avg_size = chunk_size / len(self.chunks)
-
-        for chunk in self.chunks:
-            if chunk.size > chunk_avg_size:
-                chunk.type = PacketType.VIDEO
-            else:
-                chunk.type = PacketType.AUDIO
+        size = self.chunks.column('size')
+        chunk_avg_size = size.sum() / len(size)
+        self.chunks.column('type')[:] = np.where(size > chunk_avg_size,
+                                                 PacketType.VIDEO.value, PacketType.AUDIO.value)
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import instrument
+from . import chunkDetect, chunkStore
+from .chunk import DOWN_MIN_PAYLOAD
+from .chunkStore import CHUNK_SUFFIX, TEXT_SUFFIX
+
+MANIFEST_NAME = 'manifest.json'
+# 两次保存清单之间至少间隔的秒数, 避免文件很多时每转换一个文件就重写一次清单
+MANIFEST_SAVE_INTERVAL = 1.0
+
+
+def chunk_file_name(filename, text=False):
+    """pcap文件名对应的chunk文件名, 默认使用二进制格式"""
+    return "chunk_" + filename.replace('.pcap', TEXT_SUFFIX if text else CHUNK_SUFFIX)
+
+
+def build_params(text=False, idle_timeout=None, max_flows=None):
+    """影响转换结果的参数和代码版本, 任何一项变化都使已有的输出过期"""
+    params = {
+        'get_min_payload': chunkDetect.GET_MIN_PAYLOAD,
+        'down_min_payload': DOWN_MIN_PAYLOAD,
+        'detect_version': chunkDetect.DETECT_VERSION,
+        'format': 'text' if text else f"binary-{chunkStore.VERSION}",
+    }
+    # 只在逐出流时记录, 不逐出时与之前的清单保持一致
+    if idle_timeout is not None:
+        params['idle_timeout'] = idle_timeout
+    if max_flows is not None:
+        params['max_flows'] = max_flows
+    return params
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_state(path, known=None):
+    """返回输入的(大小, 修改时间, sha256)
+
+    known为清单中记录的同一输入的状态, 大小和修改时间都未变时沿用其中的sha256, 不再读取整个文件
+    """
+    stat = os.stat(path)
+    if known is not None and tuple(known[:2]) == (stat.st_size, stat.st_mtime_ns):
+        return stat.st_size, stat.st_mtime_ns, known[2]
+    return stat.st_size, stat.st_mtime_ns, file_digest(path)
+
+
+class BuildManifest:
+    """记录输出目录中每个chunk文件由哪个输入、在什么参数下生成, 用于跳过未过期的文件
+
+    每项以pcap文件名为键, 记录输入的大小、修改时间和sha256, 输出文件名以及build_params();
+    输入的大小和修改时间不变时直接认为内容未变, 只有修改时间变化而大小不变时才重新计算sha256
+    """
+
+    def __init__(self, out_path):
+        self.path = os.path.join(out_path, MANIFEST_NAME)
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        self.dirty = False
+        self.saved_at = 0.0
+
+    def is_current(self, name, pcap_file, outfile, params):
+        entry = self.entries.get(name)
+        if entry is None or entry['output'] != os.path.basename(outfile) or entry['params'] != params:
+            return False
+        if not os.path.exists(outfile):
+            return False
+
+        stat = os.stat(pcap_file)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns != entry['mtime_ns']:
+            # 文件被touch或复制过, 内容相同时只更新修改时间
+            if file_digest(pcap_file) != entry['sha256']:
+                return False
+            entry['mtime_ns'] = stat.st_mtime_ns
+            self.dirty = True
+        return True
+
+    def source(self, name):
+        """清单中记录的输入状态(大小, 修改时间, sha256), 没有记录时为None"""
+        entry = self.entries.get(name)
+        return None if entry is None else (entry['size'], entry['mtime_ns'], entry['sha256'])
+
+    def record(self, name, source, outfile, params):
+        """source为转换前记录的(大小, 修改时间, sha256)"""
+        size, mtime_ns, sha256 = source
+        self.entries[name] = {
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'sha256': sha256,
+            'output': os.path.basename(outfile),
+            'params': params,
+            'built': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        self.dirty = True
+
+    def save(self, force=False):
+        """原子地写出清单; force为False时距上次保存不足MANIFEST_SAVE_INTERVAL秒则跳过"""
+        if not self.dirty or (not force and time.monotonic() - self.saved_at < MANIFEST_SAVE_INTERVAL):
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+
+def convert_file(pcap_file, outfile, shards=None, idle_timeout=None, max_flows=None):
+    """将单个pcap文件转换为chunk文件, 返回(流数量, 耗时, 本进程的统计数据)
+
+    先写入同目录下的临时文件再改名, 中断时不会留下不完整的输出;
+    shards大于1时按流分片用多个进程处理这一个文件, 见chunkDetect.detect_streams_sharded;
+    idle_timeout/max_flows限制长时间抓包中同时跟踪的流, 见chunkDetect.ChunkDetector;
+    都未指定时按列数组批量检测(结果与逐包检测相同)
+    """
+    start = time.perf_counter()
+    vectorized = (shards is None or shards <= 1) and idle_timeout is None and max_flows is None
+    stream_map = chunkDetect.chunk_detect(pcap_file, vectorized=vectorized, workers=shards,
+                                          idle_timeout=idle_timeout, max_flows=max_flows)
+    if stream_map is None:
+        raise RuntimeError(f"chunk detect failed: {pcap_file}")
+    write_chunk_file(stream_map, outfile)
+    return len(stream_map), time.perf_counter() - start, instrument.drain()
+
+
+def write_chunk_file(stream_map, outfile):
+    """原子地保存chunk文件, 按扩展名选择格式"""
+    directory, name = os.path.split(outfile)
+    tmp = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    try:
+        if not chunkDetect.save_chunk(stream_map, tmp, binary=outfile.endswith(CHUNK_SUFFIX)):
+            raise RuntimeError(f"failed to save {outfile}")
+        os.replace(tmp, outfile)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _build_file(pcap_file, outfile, idle_timeout=None, max_flows=None, known=None):
+    """在子进程中取得输入的(大小, 修改时间, sha256)后转换, 转换期间输入被改写时记录的是转换前的状态
+
+    known为清单中的记录, 见source_state; 输入未变而输出需要重建(参数改变、输出缺失或force)时不再计算sha256
+    """
+    source = source_state(pcap_file, known)
+    return (source, *convert_file(pcap_file, outfile, idle_timeout=idle_timeout, max_flows=max_flows))
+
+
+def convert_directory(pcap_directory, out_path, workers=None, text=False, force=False,
+                      idle_timeout=None, max_flows=None):
+    """用进程池并行转换目录下的pcap文件, text为True时输出文本格式
+
+    out_path中的清单(BuildManifest)记录每个输出对应的输入和参数, 只转换新增或过期的文件,
+    force为True时全部重新转换; 每个输出原子写入, 中断后再次运行会从未完成的文件继续.
+    按文件大小从大到小提交任务, 避免最大的文件最后才开始处理;
+    单个文件失败不影响其他文件, 返回失败的文件名列表
+    """
+    os.makedirs(out_path, exist_ok=True)
+    files = [f for f in os.listdir(pcap_directory) if f.endswith('.pcap')]
+    files.sort(key=lambda f: os.path.getsize(os.path.join(pcap_directory, f)), reverse=True)
+
+    manifest = BuildManifest(out_path)
+    params = build_params(text, idle_timeout, max_flows)
+    pending = [filename for filename in files
+               if force or not manifest.is_current(filename, os.path.join(pcap_directory, filename),
+                                                   os.path.join(out_path, chunk_file_name(filename, text)),
+                                                   params)]
+    print(f"{len(files) - len(pending)}/{len(files)} files up to date, converting {len(pending)}")
+
+    failed = []
+    try:
+        with instrument.stage('pcap_to_chunk') as stage, ProcessPoolExecutor(max_workers=workers) as executor:
+            stage.count('skipped', len(files) - len(pending))
+            futures = {
+                executor.submit(_build_file,
+                                os.path.join(pcap_directory, filename),
+                                os.path.join(out_path, chunk_file_name(filename, text)),
+                                idle_timeout, max_flows, manifest.source(filename)): filename
+                for filename in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                filename = futures[future]
+                try:
+                    source, streams, elapsed, stats = future.result()
+                    # 合并子进程中chunk_detect等阶段的统计
+                    instrument.merge(stats)
+                    stage.count('files')
+                    manifest.record(filename, source, chunk_file_name(filename, text), params)
+                    manifest.save()
+                    print(f"[{done}/{len(pending)}] {filename}: {streams} streams, {elapsed:.1f}s")
+                except Exception as e:
+                    failed.append(filename)
+                    print(f"[{done}/{len(pending)}] {filename} 处理失败: {e}")
+    finally:
+        manifest.save(force=True)
+
+    print(f"converted {len(pending) - len(failed)}/{len(pending)} files")
+    return failed
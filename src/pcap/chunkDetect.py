@@ -1,12 +1,19 @@
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, Tuple
 import re
-from scapy.all import rdpcap
-from scapy.layers.inet import TCP, UDP
+import numpy as np
 
-from .chunk import IpStream, Chunk, PacketType
+import instrument
+
+from . import chunkStore, chunkVector, pcapDecoder
+from .chunk import IpStream, Chunk, PacketType, CLASSIFIERS
+from .ipAddress import PRIVATE_V4, flow_key, int_to_ip, ip_to_int, is_private_int
+from .pcapDecoder import PROTO_TCP, PROTO_UDP
 
 GET_MIN_PAYLOAD = 300
+# chunk切分版本, 修改切分、类型判断的结果或输出格式时需要增加, 使chunkConvert重新转换已有的输出
+DETECT_VERSION = 2
 
 
 
@@ -25,30 +32,46 @@ def find_stream(stream_map, src: str, dst: str) -> IpStream:
 
 def is_private_ip(ip: str) -> bool:
     """判断IP地址是否为私有地址"""
-    # 分割IP地址为四部分
-    parts = list(map(int, ip.split('.')))
+    return is_private_int(ip_to_int(ip))
 
-    # 检查是否为A类私有地址 (10.0.0.0/8)
-    if parts[0] == 10:
-        return True
 
-    # 检查是否为B类私有地址 (172.16.0.0/12)
-    if parts[0] == 172 and 16 <= parts[1] <= 31:
-        return True
+def is_up_address(ip: int, client_ip: int) -> bool:
+    """从该地址发出的包是否为上行: 内网地址或客户端地址"""
+    return is_private_int(ip) or ip == client_ip
 
-    # 检查是否为C类私有地址 (192.168.0.0/16)
-    if parts[0] == 192 and parts[1] == 168:
-        return True
 
-    # 检查是否为回环地址 (127.0.0.0/8)
-    if parts[0] == 127:
-        return True
+def is_up_addresses(ip, client_ip):
+    """is_up_address的数组版本, ip为IPv4地址的整数数组"""
+    up = ip == client_ip
+    for network, mask in PRIVATE_V4:
+        up |= (ip & mask) == network
+    return up
 
-    # 检查是否为链路本地地址 (169.254.0.0/16)
-    if parts[0] == 169 and parts[1] == 254:
-        return True
 
-    return False
+# 以整数流键查找流（未找到时自动添加）
+# 返回 (IpStream, 创建时的源地址, 该源地址是否上行, 目的地址是否上行)
+# on_chunk不为None时设置为新建流的chunk回调, classifier不为None时为新建流创建一个在线类型判断器
+def find_flow(flow_table, src: int, dst: int, client_ip: int, on_chunk=None, classifier=None):
+    key = flow_key(src, dst)
+    flow = flow_table.get(key)
+    if flow is None:
+        ip_stream = IpStream(int_to_ip(src), int_to_ip(dst))
+        ip_stream.on_chunk = on_chunk
+        if classifier is not None:
+            ip_stream.classifier = classifier()
+        flow = flow_table[key] = (ip_stream, src,
+                                  is_up_address(src, client_ip), is_up_address(dst, client_ip))
+    return flow
+
+
+def to_stream_map(streams) -> Dict[Tuple[str, str], IpStream]:
+    """按字符串地址对重新组织流, 键的顺序与find_stream一致"""
+    stream_map: Dict[Tuple[str, str], IpStream] = defaultdict(IpStream)
+    for ip_stream in streams:
+        key = (ip_stream.src, ip_stream.dst) if ip_stream.src <= ip_stream.dst \
+            else (ip_stream.dst, ip_stream.src)
+        stream_map[key] = ip_stream
+    return stream_map
 
 
 def is_up_stream(src) -> bool:
@@ -57,43 +80,471 @@ def is_up_stream(src) -> bool:
 
 
 def is_GQUIC(packet):
+    from scapy.layers.inet import UDP
     return (packet.haslayer(UDP) and
             (packet['UDP'].dport == 443 or packet['UDP'].sport == 443))
 
-# 筛选包
-def chunk_detect(input_file):
-    try:
-        # 读取pcap文件
-        packets = rdpcap(input_file)
-        print("read packets: ", len(packets))
-        start_time = packets[0].time
-        client_ip = packets[0]['IP'].src
-
-        stream_map: Dict[Tuple[str, str], IpStream] = defaultdict(IpStream)
-
-        for packet in packets:
-            if packet.haslayer(TCP) or is_GQUIC(packet):
-                src_ip = packet['IP'].src
-                dst_ip = packet['IP'].dst
-                payload = packet.len
-                time = packet.time - start_time
+def read_records(input_file, streaming=True, raw=True):
+    """逐个产出pcap中IPv4包的头部字段元组, 格式见pcapDecoder
+
+    raw为True时直接解析pcap头部, 否则经scapy完整解析每个包(streaming见pcapDecoder.iter_scapy)
+    """
+    if raw:
+        return pcapDecoder.iter_packets(input_file)
+    return pcapDecoder.iter_scapy(input_file, streaming)
+
+
+def is_chunk_packet(proto, sport, dport) -> bool:
+    """TCP包或GQUIC包"""
+    return proto == PROTO_TCP or (proto == PROTO_UDP and (sport == 443 or dport == 443))
+
+
+# ChunkDetector记住的最近被逐出的流键数量, 用于识别逐出后重新出现的流
+EVICTED_KEYS_LIMIT = 1 << 16
+
+
+class ChunkDetector:
+    """逐包调用IpStream.save_chunk/add_chunk切分chunk, 包记录可以分多次喂入
+
+    on_chunk不为None时, 每个chunk在save_chunk保存时立即回调on_chunk(ip_stream, chunk)
+    classifier为在线类型判断器的类(如RunningMeanClassifier、OnlineKMeans或CLASSIFIERS中的名字),
+    设置后每个chunk在保存时即确定类型, 回调中可以直接使用; 为None时类型在finish中统一判断
+    relabel为True时finish再按整条流的平均大小重新判断一遍(judge_type), 结果与批处理完全一致
+    start_time/client_ip为None时取第一个包的时间和源地址, 分片处理时由主进程给定整个文件的基准
+
+    idle_timeout(秒)不为None时, 超过这么久没有包的流被逐出; max_flows不为None时跟踪的流数达到上限后
+    逐出最久没有包的流(LRU). 逐出的流未完成的chunk(之后没有GET)被丢弃, 没有chunk的流直接丢弃;
+    有chunk的流在on_evict不为None时判断类型后交给on_evict(ip_stream), 否则只保留其chunk记录,
+    由finish与同一地址对之后重新出现的流合并返回. evictions记录逐出的统计
+    逐出后重新出现的流(最近EVICTED_KEYS_LIMIT个被逐出的流键)在第一个GET之前的包被丢弃,
+    不会产生请求时间为0的chunk. 因此逐出会有意地改变结果: 跨越空闲期的chunk不再输出,
+    流空闲时间超过idle_timeout或被LRU逐出时与不逐出的结果不同
+    """
+
+    def __init__(self, on_chunk=None, classifier=None, relabel=True, start_time=None, client_ip=None,
+                 idle_timeout=None, max_flows=None, on_evict=None):
+        self.start_time = start_time
+        self.client_ip = client_ip
+        self.flow_table = {}
+        self.on_chunk = on_chunk
+        self.classifier = CLASSIFIERS[classifier] if isinstance(classifier, str) else classifier
+        self.relabel = relabel or classifier is None
+
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.on_evict = on_evict
+        # 流键 -> 最后一个包的相对时间, 按最后活动时间排列, 最前面的是最久没有包的流
+        self.activity = OrderedDict()
+        self.next_sweep = None
+        # 流键 -> (流的创建序号, 源地址, 目的地址, [CHUNK_DTYPE数组]), 逐出的有chunk的流只保留紧凑的chunk记录
+        self.evicted = {}
+        # 最近被逐出的流键(有界), 以及重新出现后还在等待第一个GET的流键
+        self.evicted_keys = OrderedDict()
+        self.awaiting_get = set()
+        self.created = 0
+        self.evictions = {'idle': 0, 'lru': 0, 'empty': 0, 'flushed': 0, 'chunks': 0, 'peak_flows': 0}
+
+    @property
+    def evicting(self) -> bool:
+        return self.idle_timeout is not None or self.max_flows is not None
+
+    def feed(self, records):
+        if self.evicting:
+            return self._feed_evicting(records)
+
+        start_time = self.start_time
+        client_ip = self.client_ip
+        flow_table = self.flow_table
+        on_chunk = self.on_chunk
+        classifier = self.classifier
+
+        for timestamp, src_ip, dst_ip, payload, proto, sport, dport in records:
+            # 以第一个包的时间和源地址作为基准
+            if start_time is None:
+                start_time = self.start_time = timestamp
+                client_ip = self.client_ip = src_ip
+
+            if is_chunk_packet(proto, sport, dport):
+                time = (timestamp - start_time) / 1e9
 
                 # 获取对应的流
-                ip_stream = find_stream(stream_map, src_ip, dst_ip)
+                ip_stream, flow_src, src_up, dst_up = find_flow(flow_table, src_ip, dst_ip,
+                                                                client_ip, on_chunk, classifier)
                 # GET
-                if is_up_stream(src_ip) or client_ip == src_ip:
+                if src_up if src_ip == flow_src else dst_up:
                     if payload > GET_MIN_PAYLOAD:
                         ip_stream.save_chunk(time)
                 # 接受数据
                 else:
                     ip_stream.add_chunk(time, payload)
+        return self
+
+    def _feed_evicting(self, records):
+        """与feed相同, 另外记录每条流的最后活动时间并逐出空闲或超出上限的流"""
+        start_time = self.start_time
+        client_ip = self.client_ip
+        flow_table = self.flow_table
+        activity = self.activity
+        on_chunk = self.on_chunk
+        classifier = self.classifier
+        max_flows = self.max_flows
+        idle_timeout = self.idle_timeout
+        # 每经过idle_timeout的1/8检查一次空闲的流
+        sweep_interval = idle_timeout / 8 if idle_timeout is not None else None
+        next_sweep = self.next_sweep
+        evicted_keys = self.evicted_keys
+        awaiting_get = self.awaiting_get
+
+        for timestamp, src_ip, dst_ip, payload, proto, sport, dport in records:
+            if start_time is None:
+                start_time = self.start_time = timestamp
+                client_ip = self.client_ip = src_ip
+
+            if is_chunk_packet(proto, sport, dport):
+                time = (timestamp - start_time) / 1e9
+
+                # 先逐出空闲的流, 空闲超时后再出现的包属于新的流
+                if sweep_interval is not None:
+                    if next_sweep is None:
+                        next_sweep = time + sweep_interval
+                    elif time >= next_sweep:
+                        self.evict_idle(time)
+                        next_sweep = time + sweep_interval
+
+                key = flow_key(src_ip, dst_ip)
+                flow = flow_table.get(key)
+                if flow is None:
+                    if max_flows is not None and len(flow_table) >= max_flows:
+                        self._evict(next(iter(activity)), 'lru')
+                    ip_stream, flow_src, src_up, dst_up = find_flow(flow_table, src_ip, dst_ip,
+                                                                    client_ip, on_chunk, classifier)
+                    flow_table[key] = (ip_stream, flow_src, src_up, dst_up, self.created)
+                    self.created += 1
+                    if len(flow_table) > self.evictions['peak_flows']:
+                        self.evictions['peak_flows'] = len(flow_table)
+                    activity[key] = time
+                    if key in evicted_keys:
+                        awaiting_get.add(key)
+                else:
+                    ip_stream, flow_src, src_up, dst_up, _ = flow
+                    activity[key] = time
+                    activity.move_to_end(key)
+
+                up = src_up if src_ip == flow_src else dst_up
+                if awaiting_get and key in awaiting_get:
+                    # 逐出后重新出现的流不知道之前的GET时间, 丢弃第一个GET之前的包
+                    if not (up and payload > GET_MIN_PAYLOAD):
+                        continue
+                    awaiting_get.discard(key)
+
+                if up:
+                    if payload > GET_MIN_PAYLOAD:
+                        ip_stream.save_chunk(time)
+                else:
+                    ip_stream.add_chunk(time, payload)
 
-        # 判断数据包类型, 使用list()复制键列表
-        for key in list(stream_map.keys()):
-            if not stream_map[key].chunks:
-                del stream_map[key]
+        self.next_sweep = next_sweep
+        return self
+
+    def evict_idle(self, now):
+        """逐出最后一个包早于now - idle_timeout的流"""
+        activity = self.activity
+        deadline = now - self.idle_timeout
+        while activity:
+            key, last = next(iter(activity.items()))
+            if last >= deadline:
+                break
+            self._evict(key, 'idle')
+
+    def _evict(self, key, reason):
+        ip_stream, *_, order = self.flow_table.pop(key)
+        del self.activity[key]
+        self.awaiting_get.discard(key)
+        self.evicted_keys[key] = None
+        self.evicted_keys.move_to_end(key)
+        if len(self.evicted_keys) > EVICTED_KEYS_LIMIT:
+            self.evicted_keys.popitem(last=False)
+        self.evictions[reason] += 1
+        if not ip_stream.chunks:
+            self.evictions['empty'] += 1
+            return
+
+        self.evictions['flushed'] += 1
+        self.evictions['chunks'] += len(ip_stream.chunks)
+        if self.on_evict is not None:
+            if self.relabel:
+                ip_stream.judge_type()
+            self.on_evict(ip_stream)
+            return
+
+        # 复制已有的记录, 释放IpStream和表中预留的空间
+        records = ip_stream.chunks.array.copy()
+        kept = self.evicted.get(key)
+        if kept is None:
+            self.evicted[key] = (order, ip_stream.src, ip_stream.dst, [records])
+        else:
+            kept[3].append(records)
+
+    def _streams(self):
+        """按流第一次出现的顺序产出(流键, IpStream), 包括逐出后保留的流, 不含没有chunk的流"""
+        if not self.evicting:
+            for key, (ip_stream, *_) in self.flow_table.items():
+                if ip_stream.chunks:
+                    yield key, ip_stream
+            return
+
+        merged = {}
+        for key, (order, src, dst, parts) in self.evicted.items():
+            ip_stream = IpStream(src, dst)
+            ip_stream.chunks.extend(np.concatenate(parts))
+            merged[key] = (order, ip_stream)
+        for key, (ip_stream, *_, order) in self.flow_table.items():
+            if not ip_stream.chunks:
+                continue
+            kept = merged.get(key)
+            if kept is None:
+                merged[key] = (order, ip_stream)
             else:
-                stream_map[key].judge_type()
+                kept[1].chunks.extend(ip_stream.chunks.array)
+        for key, (_, ip_stream) in sorted(merged.items(), key=lambda item: item[1][0]):
+            yield key, ip_stream
+
+    def finish_streams(self):
+        """判断数据包类型, 返回有chunk的流的[(流键, IpStream), ...], 只能调用一次"""
+        instrument.count('flows', len(self.flow_table) + self.evictions['idle'] + self.evictions['lru'])
+        if self.evicting:
+            for name, value in self.evictions.items():
+                if name != 'peak_flows':
+                    instrument.count(f"evicted_{name}", value)
+            instrument.observe('peak_flows', self.evictions['peak_flows'])
+
+        streams = list(self._streams())
+        if self.relabel:
+            for _, ip_stream in streams:
+                ip_stream.judge_type()
+        return streams
+
+    def finish(self) -> Dict[Tuple[str, str], IpStream]:
+        """判断数据包类型, 丢弃没有chunk的流, 返回stream_map"""
+        return to_stream_map(ip_stream for _, ip_stream in self.finish_streams())
+
+
+def detect_streams(records, classifier=None, relabel=True, idle_timeout=None, max_flows=None):
+    """逐包调用IpStream.save_chunk/add_chunk切分chunk, idle_timeout/max_flows见ChunkDetector"""
+    return ChunkDetector(classifier=classifier, relabel=relabel, idle_timeout=idle_timeout,
+                         max_flows=max_flows).feed(records).finish()
+
+
+def detect_columns(columns):
+    """由pcapDecoder.read_columns的列数组批量切分chunk, 不经过逐包的Python循环
+
+    与flow_key相同的无方向流键由两端地址拼成uint64, np.unique的逆映射即流编号(再按首次出现的顺序重新编号);
+    同一条流中从某个地址发出的包方向都相同, 因此上行与否只取决于包的源地址
+    """
+    time, src, dst = columns['time'], columns['src'], columns['dst']
+    proto, sport, dport = columns['proto'], columns['sport'], columns['dport']
+    if len(time) == 0:
+        instrument.count('flows', 0)
+        return chunkVector.build_stream_map(chunkVector.segment_chunks([], [], [], [], GET_MIN_PAYLOAD), [])
+    start_time, client_ip = time[0], src[0]
+
+    chunk = (proto == PROTO_TCP) | ((proto == PROTO_UDP) & ((sport == 443) | (dport == 443)))
+    time, src, dst, length = time[chunk], src[chunk], dst[chunk], columns['length'][chunk]
+
+    key = (np.minimum(src, dst).astype(np.uint64) << np.uint64(32)) | np.maximum(src, dst).astype(np.uint64)
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    appearance = np.argsort(first, kind='stable')
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[appearance] = np.arange(len(first))
+    flow = rank[inverse.ravel()]
+    first = first[appearance]
+    flows = [(int_to_ip(a), int_to_ip(b)) for a, b in zip(src[first].tolist(), dst[first].tolist())]
+
+    instrument.count('flows', len(flows))
+    chunk_columns = chunkVector.segment_chunks((time - start_time) / 1e9, flow, is_up_addresses(src, client_ip),
+                                               length, GET_MIN_PAYLOAD)
+    return chunkVector.build_stream_map(chunk_columns, flows)
+
+
+def detect_streams_vectorized(records):
+    """把包头字段收集成列数组, 由chunkVector批量切分chunk
+
+    用于不能由pcapDecoder.read_columns解析的输入(scapy解析的格式或含有IPv6包), 列数组由逐包循环收集
+    """
+    start_time = None
+    client_ip = None
+
+    flow_table = {}
+    flows = []
+    times, flow_col, up_col, length_col = [], [], [], []
+
+    for timestamp, src_ip, dst_ip, payload, proto, sport, dport in records:
+        if start_time is None:
+            start_time = timestamp
+            client_ip = src_ip
+
+        if is_chunk_packet(proto, sport, dport):
+            key = flow_key(src_ip, dst_ip)
+            flow = flow_table.get(key)
+            if flow is None:
+                flow = flow_table[key] = (len(flows), src_ip,
+                                          is_up_address(src_ip, client_ip),
+                                          is_up_address(dst_ip, client_ip))
+                flows.append((int_to_ip(src_ip), int_to_ip(dst_ip)))
+            flow_id, flow_src, src_up, dst_up = flow
+
+            times.append(timestamp)
+            flow_col.append(flow_id)
+            up_col.append(src_up if src_ip == flow_src else dst_up)
+            length_col.append(payload)
+
+    instrument.count('flows', len(flows))
+    time = (np.array(times, dtype=np.int64) - start_time) / 1e9 if times else []
+    columns = chunkVector.segment_chunks(time, flow_col, up_col, length_col, GET_MIN_PAYLOAD)
+    return chunkVector.build_stream_map(columns, flows)
+
+
+def _shard_range(input_file, first, last, n_shards):
+    """解析[first, last)字节范围内的包, 按流键的哈希把chunk相关的包分到n_shards个分片
+
+    每个分片返回(有向地址对列表, 时间戳数组, 地址对下标数组, 长度数组),
+    地址对列表中每项为(源地址, 目的地址, 该地址对在本段中第一个包的序号);
+    另外返回(读取的记录数, IP包数, 解析结束的偏移)
+    """
+    pairs = [[] for _ in range(n_shards)]
+    columns = [([], [], []) for _ in range(n_shards)]
+    seen = {}
+    cursor = [first, 0]
+    n_packets = 0
+
+    for timestamp, src_ip, dst_ip, payload, proto, sport, dport in \
+            pcapDecoder.iter_range(input_file, first, last, cursor):
+        n_packets += 1
+        if is_chunk_packet(proto, sport, dport):
+            pair = seen.get((src_ip, dst_ip))
+            if pair is None:
+                shard = hash(flow_key(src_ip, dst_ip)) % n_shards
+                pairs[shard].append((src_ip, dst_ip, n_packets))
+                pair = seen[(src_ip, dst_ip)] = (len(pairs[shard]) - 1, *columns[shard])
+            index, times, pair_col, length_col = pair
+            times.append(timestamp)
+            pair_col.append(index)
+            length_col.append(payload)
+
+    shards = [(shard_pairs, np.array(times, dtype=np.int64), np.array(pair_col, dtype=np.int32),
+               np.array(length_col, dtype=np.int64))
+              for shard_pairs, (times, pair_col, length_col) in zip(pairs, columns)]
+    return shards, (cursor[1], n_packets, cursor[0])
+
+
+def _detect_shard(parts, start_time, client_ip, classifier=None, relabel=True, idle_timeout=None, max_flows=None):
+    """按段的顺序把一个分片的包喂给ChunkDetector
+
+    parts为[(段号, _shard_range返回的该分片数据), ...]; 返回流的数量、有chunk的流的列表和逐出统计,
+    列表每项为(该流第一个包在文件中的位置(段号, 段内序号), IpStream)
+    """
+    detector = ChunkDetector(classifier=classifier, relabel=relabel, start_time=start_time, client_ip=client_ip,
+                             idle_timeout=idle_timeout, max_flows=max_flows)
+    first_seen = {}
+    for index, (pairs, times, pair_col, length_col) in parts:
+        for src_ip, dst_ip, position in pairs:
+            first_seen.setdefault(flow_key(src_ip, dst_ip), (index, position))
+        detector.feed((timestamp, pairs[pair][0], pairs[pair][1], payload, PROTO_TCP, 0, 0)
+                      for timestamp, pair, payload in zip(times.tolist(), pair_col.tolist(), length_col.tolist()))
+
+    # 判断类型并丢弃没有chunk的流
+    streams = detector.finish_streams()
+    flows = len(detector.flow_table) + detector.evictions['idle'] + detector.evictions['lru']
+    return flows, [(first_seen[key], ip_stream) for key, ip_stream in streams], detector.evictions
+
+
+def detect_streams_sharded(input_file, workers, classifier=None, relabel=True, stage=instrument.NULL_STAGE,
+                           idle_timeout=None, max_flows=None):
+    """按流分片用多个进程处理单个大pcap文件
+
+    分两步: 先把文件切成workers段(pcapDecoder.split_ranges), 各进程并行解析一段并按流键的哈希把包分到
+    workers个分片; 再由各进程按段的顺序处理各自分片中的包. 同一条流的包总在同一个分片中且保持原有顺序,
+    start_time和client_ip取整个文件的第一个包, 合并时按各流第一个包在文件中的位置排列;
+    不逐出流时结果与detect_streams相同. idle_timeout/max_flows在各分片中分别生效, max_flows按分片平均分配
+    (所有分片同时跟踪的流总数仍不超过max_flows左右), 逐出的流和空闲检查的时机与顺序处理不同, 结果也不同;
+    需要与顺序处理一致的逐出结果时不要分片. 文件格式不能直接解析, 或某段没有恰好解析到下一段的起点
+    (分段点不是真正的记录边界)时返回None, 由调用方按顺序处理
+    """
+    ranges = pcapDecoder.split_ranges(input_file, workers)
+    if ranges is None:
+        return None
+    records = pcapDecoder.iter_range(input_file, *ranges[0])
+    first_record = next(records, None)
+    records.close()
+    if first_record is None:
+        return to_stream_map([])
+    start_time, client_ip = first_record[0], first_record[1]
+    n_shards = len(ranges)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_shard_range, input_file, first, last, n_shards)
+                   for first, last in ranges]
+        results = [future.result() for future in futures]
+        for index, (_, (_, _, stop)) in enumerate(results):
+            if stop != ranges[index][1]:
+                print(f"range {index} ended at {stop} instead of {ranges[index][1]}, falling back to serial")
+                return None
+
+        parts = [[] for _ in range(n_shards)]
+        n_records = 0
+        for index, (shards, (n_read, packets, _)) in enumerate(results):
+            n_records += n_read
+            stage.count('packets', packets)
+            for shard, part in enumerate(shards):
+                parts[shard].append((index, part))
+        print("read packets: ", n_records)
+
+        shard_max_flows = -(-max_flows // n_shards) if max_flows is not None else None
+        futures = [executor.submit(_detect_shard, shard_parts, start_time, client_ip, classifier, relabel,
+                                   idle_timeout, shard_max_flows)
+                   for shard_parts in parts]
+        streams = []
+        for future in futures:
+            flows, shard_streams, evictions = future.result()
+            instrument.count('flows', flows)
+            if idle_timeout is not None or max_flows is not None:
+                for name, value in evictions.items():
+                    if name != 'peak_flows':
+                        instrument.count(f"evicted_{name}", value)
+                instrument.observe('peak_flows', evictions['peak_flows'])
+            streams += shard_streams
+
+    streams.sort(key=lambda item: item[0])
+    return to_stream_map(ip_stream for _, ip_stream in streams)
+
+
+# 筛选包
+def chunk_detect(input_file, streaming=True, raw=True, vectorized=False, classifier=None, relabel=True,
+                 workers=None, idle_timeout=None, max_flows=None):
+    """classifier/relabel/idle_timeout/max_flows见ChunkDetector, vectorized为True时总是按整条流判断类型,
+    不逐出流; 可以直接解析的IPv4 pcap文件由pcapDecoder.read_columns整体解析为列数组(detect_columns)
+
+    workers大于1时用detect_streams_sharded按流分片并行处理(只用于可以直接解析的pcap文件)
+    """
+    try:
+        with instrument.stage('chunk_detect') as stage:
+            stream_map = None
+            if workers is not None and workers > 1 and raw and not vectorized:
+                stream_map = detect_streams_sharded(input_file, workers, classifier, relabel, stage,
+                                                    idle_timeout, max_flows)
+            if stream_map is None and vectorized and raw:
+                columns = pcapDecoder.read_columns(input_file)
+                if columns is not None:
+                    stage.count('packets', len(columns['time']))
+                    stream_map = detect_columns(columns)
+            if stream_map is None:
+                records = stage.counted(read_records(input_file, streaming, raw), 'packets')
+                if vectorized:
+                    stream_map = detect_streams_vectorized(records)
+                else:
+                    stream_map = detect_streams(records, classifier, relabel, idle_timeout, max_flows)
+            if stage.enabled:
+                stage.count('chunks', sum(len(ip_stream.chunks) for ip_stream in stream_map.values()))
 
         return stream_map
 
@@ -102,28 +553,69 @@ def chunk_detect(input_file):
         return None
 
 
-def save_chunk(stream_map, outfile):
+def _time_digits(stream_map):
+    """文本格式中时间的小数位数, 与原先按抓包的Decimal时间戳相减得到的输出相同
+
+    所有时间都是整微秒时为6位, 否则为9位(纳秒精度的抓包)
+    """
+    for ip_stream in stream_map.values():
+        for name in ('request_time', 'start', 'end'):
+            micros = ip_stream.chunks.column(name) * 1e6
+            if np.any(np.abs(micros - np.round(micros)) > 1e-3):
+                return 9
+    return 6
+
+
+def _format_time(value, digits):
+    """按固定小数位数输出, 消除浮点相减的误差"""
+    return f"{value:.{digits}f}"
+
+
+def save_chunk(stream_map, outfile, binary=None):
+    """保存chunk, binary为None时按扩展名选择格式: .chk为二进制格式, 其他为文本格式
+
+    返回是否保存成功
+    """
+    if binary is None:
+        binary = outfile.endswith(chunkStore.CHUNK_SUFFIX)
     try:
-        with open(outfile, 'w') as f:
-            # 遍历所有的IpStream对象
-            for key, ipStream in stream_map.items():
-                f.write(f"Source IP: {ipStream.src}, Destination IP: {ipStream.dst}\n")
-                for chunk in ipStream.chunks:
-                    f.write(f"  "
-                            f"GET: {chunk.request_time}, "
-                            f"TTFB: {chunk.first_byte_wait_time}, "
-                            f"down: {chunk.download_time}, "
-                            f"slack: {chunk.slack_time}, "
-                            f"size: {chunk.size}, "
-                            f"type: {chunk.type.name}\n")
-                f.write('\n')
+        if binary:
+            chunkStore.write_table(*chunkStore.stream_map_to_table(stream_map), outfile)
+        else:
+            digits = _time_digits(stream_map)
+            with open(outfile, 'w') as f:
+                # 遍历所有的IpStream对象
+                for key, ipStream in stream_map.items():
+                    f.write(f"Source IP: {ipStream.src}, Destination IP: {ipStream.dst}\n")
+                    for chunk in ipStream.chunks:
+                        # 流在第一个GET之前收到数据的chunk请求时间为0, 与原输出一样写为0
+                        get_time = chunk.request_time
+                        f.write(f"  "
+                                f"GET: {_format_time(get_time, digits) if get_time else 0}, "
+                                f"TTFB: {_format_time(chunk.first_byte_wait_time, digits)}, "
+                                f"down: {_format_time(chunk.download_time, digits)}, "
+                                f"slack: {_format_time(chunk.slack_time, digits)}, "
+                                f"size: {chunk.size}, "
+                                f"type: {chunk.type.name}\n")
+                    f.write('\n')
         print(f"Data saved to {outfile} successfully.")
+        return True
     except Exception as e:
         print(f"Error saving data to file: {e}")
+        return False
+
+
+def load_chunk_table(file_path):
+    """读取chunk文件为(流表, chunk记录)结构化数组, 二进制文件的记录区直接内存映射"""
+    if chunkStore.is_chunk_store(file_path):
+        return chunkStore.read_table(file_path)
+    return chunkStore.stream_map_to_table(load_chunk(file_path))
 
 
 def load_chunk(file_path):
     try:
+        if chunkStore.is_chunk_store(file_path):
+            return chunkStore.table_to_stream_map(*chunkStore.read_table(file_path, mmap=False))
         with open(file_path, 'r') as file:
             data = file.read()
     except Exception as e:
@@ -140,7 +632,7 @@ def load_chunk(file_path):
             continue
 
         # 检查是否是新的IP流
-        ip_match = re.match(r'Source IP: (\d+\.\d+\.\d+\.\d+), Destination IP: (\d+\.\d+\.\d+\.\d+)', line)
+        ip_match = re.match(r'Source IP: ([\d.:a-fA-F]+), Destination IP: ([\d.:a-fA-F]+)', line)
         if ip_match:
             src_ip, dst_ip = ip_match.groups()
             key = (src_ip, dst_ip)
@@ -0,0 +1,85 @@
+import struct
+
+import numpy as np
+
+from .chunk import IpStream, CHUNK_DTYPE, CHUNK_FIELDS
+
+# 二进制chunk文件格式(小端):
+#   文件头   magic(8字节) 版本号(u4) 流数量(u4) chunk数量(u8)
+#   流表     每条流一条FLOW_DTYPE记录, 记录该流的地址及其chunk在记录区中的范围
+#   记录区   每个chunk一条定长的CHUNK_DTYPE记录, 按流顺序连续存放
+# 记录区可以直接用np.memmap映射, 无需逐行解析
+MAGIC = b'QOSCHNK\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQ')
+
+CHUNK_SUFFIX = '.chk'
+TEXT_SUFFIX = '.txt'
+
+FLOW_DTYPE = np.dtype([
+    ('src', 'S40'),
+    ('dst', 'S40'),
+    ('first', '<u8'),
+    ('count', '<u8'),
+])
+
+# chunk记录格式CHUNK_DTYPE与IpStream.chunks(ChunkTable)的存储格式相同, 定义在chunk模块中
+
+
+def is_chunk_store(file_path) -> bool:
+    """根据文件头判断是否为二进制chunk文件"""
+    with open(file_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def stream_map_to_table(stream_map):
+    """把stream_map转换为(流表, chunk记录)两个结构化数组"""
+    streams = list(stream_map.values())
+    flows = np.zeros(len(streams), dtype=FLOW_DTYPE)
+    records = np.zeros(sum(len(s.chunks) for s in streams), dtype=CHUNK_DTYPE)
+
+    first = 0
+    for i, ip_stream in enumerate(streams):
+        count = len(ip_stream.chunks)
+        flows[i] = (ip_stream.src.encode(), ip_stream.dst.encode(), first, count)
+        block = records[first:first + count]
+        block[:] = ip_stream.chunks.array
+        block['flow'] = i
+        first += count
+
+    return flows, records
+
+
+def table_to_stream_map(flows, records):
+    """由流表和chunk记录重建stream_map"""
+    stream_map = {}
+    for flow in flows:
+        src, dst = flow['src'].decode(), flow['dst'].decode()
+        ip_stream = IpStream(src, dst)
+        first = int(flow['first'])
+        ip_stream.chunks.extend(records[first:first + int(flow['count'])])
+        stream_map[(src, dst)] = ip_stream
+    return stream_map
+
+
+def write_table(flows, records, outfile):
+    with open(outfile, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(flows), len(records)))
+        f.write(flows.tobytes())
+        f.write(records.tobytes())
+
+
+def read_table(file_path, mmap=True):
+    """读取二进制chunk文件, 返回(流表, chunk记录), mmap为True时记录区以只读方式映射"""
+    with open(file_path, 'rb') as f:
+        magic, version, n_flows, n_chunks = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a chunk store file: {file_path}")
+        flows = np.frombuffer(f.read(n_flows * FLOW_DTYPE.itemsize), dtype=FLOW_DTYPE)
+        offset = f.tell()
+        if not mmap or n_chunks == 0:
+            records = np.frombuffer(f.read(n_chunks * CHUNK_DTYPE.itemsize), dtype=CHUNK_DTYPE)
+            return flows, records
+
+    records = np.memmap(file_path, dtype=CHUNK_DTYPE, mode='r', offset=offset, shape=(n_chunks,))
+    return flows, records
@@ -0,0 +1,129 @@
+import numpy as np
+
+from .chunk import IpStream, PacketType, CHUNK_DTYPE, CHUNK_FIELDS, DOWN_MIN_PAYLOAD
+
+
+# 按列计算的chunk切分, 与IpStream.save_chunk/add_chunk/judge_type逐包处理的结果一致
+#
+# 输入为按抓包顺序排列的列数组:
+#   time    相对时间(秒)
+#   flow    流编号, 按首次出现的顺序从0开始
+#   up      是否为上行包
+#   length  IP总长度
+# 每条流被其中的GET包(上行且长度大于get_min_payload)切分成若干段,
+# 第一段从流开始到第一个GET, 请求时间为0; 最后一段没有后续GET, 不会被保存
+
+
+def segment_chunks(time, flow, up, length, get_min_payload, down_min_payload=DOWN_MIN_PAYLOAD):
+    """返回保存下来的chunk的列数组字典, 按(流编号, 时间顺序)排列"""
+    time = np.asarray(time, dtype=np.float64)
+    flow = np.asarray(flow, dtype=np.int64)
+    up = np.asarray(up, dtype=bool)
+    length = np.asarray(length, dtype=np.int64)
+
+    if len(time) == 0:
+        return _empty_columns()
+
+    # 稳定排序, 同一条流内保持原有顺序
+    order = np.argsort(flow, kind='stable')
+    time, flow, up, length = time[order], flow[order], up[order], length[order]
+
+    is_get = up & (length > get_min_payload)
+    is_down = ~up
+    new_flow = np.empty(len(flow), dtype=bool)
+    new_flow[0] = True
+    np.not_equal(flow[1:], flow[:-1], out=new_flow[1:])
+
+    # 每个GET或每条流的第一个包开启新的一段
+    seg_first = np.flatnonzero(is_get | new_flow)
+    seg = np.cumsum(is_get | new_flow) - 1
+    seg_flow = flow[seg_first]
+    request_time = np.where(is_get[seg_first], time[seg_first], 0.0)
+
+    size = np.add.reduceat(np.where(is_down, length, 0), seg_first)
+
+    # 每段第一个和最后一个下行包的时间
+    start = np.zeros(len(seg_first))
+    end = np.zeros(len(seg_first))
+    down_idx = np.flatnonzero(is_down)
+    if len(down_idx):
+        down_seg = seg[down_idx]
+        first = np.ones(len(down_idx), dtype=bool)
+        first[1:] = down_seg[1:] != down_seg[:-1]
+        last = np.ones(len(down_idx), dtype=bool)
+        last[:-1] = first[1:]
+        start[down_seg[first]] = time[down_idx[first]]
+        end[down_seg[last]] = time[down_idx[last]]
+
+    # 只有被同一条流中的下一个GET结束的段才会保存
+    closed = np.zeros(len(seg_first), dtype=bool)
+    closed[:-1] = (seg_flow[1:] == seg_flow[:-1]) & is_get[seg_first[1:]]
+    next_get_time = np.zeros(len(seg_first))
+    next_get_time[:-1] = time[seg_first[1:]]
+
+    keep = closed & (size > down_min_payload)
+    request_time, start, end = request_time[keep], start[keep], end[keep]
+    next_get_time, size, chunk_flow = next_get_time[keep], size[keep], seg_flow[keep]
+
+    return {
+        'flow': chunk_flow,
+        'request_time': request_time,
+        'start': start,
+        'end': end,
+        'size': size,
+        'first_byte_wait_time': start - request_time,
+        'download_time': end - start,
+        'slack_time': next_get_time - end,
+        'duration_time': next_get_time - request_time,
+        'type': judge_types(chunk_flow, size),
+    }
+
+
+def judge_types(flow, size):
+    """每条流内大于平均大小的chunk为视频, 否则为音频"""
+    types = np.full(len(size), PacketType.AUDIO.value, dtype=np.int8)
+    if len(size) == 0:
+        return types
+
+    first = np.flatnonzero(np.r_[True, flow[1:] != flow[:-1]])
+    counts = np.diff(np.r_[first, len(flow)])
+    avg = np.add.reduceat(size, first) / counts
+    types[size > np.repeat(avg, counts)] = PacketType.VIDEO.value
+    return types
+
+
+def build_stream_map(columns, flows):
+    """由列数组构造stream_map, flows[i]为第i条流的(源IP, 目的IP), 没有chunk的流不保留"""
+    stream_map = {}
+    records = np.zeros(len(columns['flow']), dtype=CHUNK_DTYPE)
+    for name in CHUNK_FIELDS + ('type',):
+        records[name] = columns[name]
+
+    # 同一条流的chunk在列数组中连续存放
+    flow = columns['flow']
+    bounds = np.flatnonzero(np.r_[True, flow[1:] != flow[:-1], True])
+    for first, last in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        src, dst = flows[flow[first]]
+        key = (src, dst) if src <= dst else (dst, src)
+        ip_stream = stream_map.get(key)
+        if ip_stream is None:
+            ip_stream = stream_map[key] = IpStream(src, dst)
+        ip_stream.chunks.extend(records[first:last])
+
+    return stream_map
+
+
+def _empty_columns():
+    empty_float = np.zeros(0)
+    return {
+        'flow': np.zeros(0, dtype=np.int64),
+        'request_time': empty_float,
+        'start': empty_float,
+        'end': empty_float,
+        'size': np.zeros(0, dtype=np.int64),
+        'first_byte_wait_time': empty_float,
+        'download_time': empty_float,
+        'slack_time': empty_float,
+        'duration_time': empty_float,
+        'type': np.zeros(0, dtype=np.int8),
+    }
@@ -0,0 +1,63 @@
+import ipaddress
+
+# IP地址统一用整数表示: IPv4为32位整数, IPv6为128位整数再加上IPV6_FLAG标志位,
+# 保证两类地址的整数不会重合
+IPV6_FLAG = 1 << 128
+IPV4_MAX = 1 << 32
+
+# 私有/回环/链路本地地址段, 预先编译为(网络号, 掩码)
+PRIVATE_NETWORKS = [
+    '10.0.0.0/8',       # A类私有地址
+    '172.16.0.0/12',    # B类私有地址
+    '192.168.0.0/16',   # C类私有地址
+    '127.0.0.0/8',      # 回环地址
+    '169.254.0.0/16',   # 链路本地地址
+    '::1/128',          # IPv6回环地址
+    'fc00::/7',         # IPv6唯一本地地址
+    'fe80::/10',        # IPv6链路本地地址
+]
+
+
+def _compile(networks):
+    v4, v6 = [], []
+    for text in networks:
+        net = ipaddress.ip_network(text)
+        mask = int(net.netmask)
+        if net.version == 4:
+            v4.append((int(net.network_address), mask))
+        else:
+            v6.append((int(net.network_address) | IPV6_FLAG, mask | IPV6_FLAG))
+    return tuple(v4), tuple(v6)
+
+
+PRIVATE_V4, PRIVATE_V6 = _compile(PRIVATE_NETWORKS)
+
+
+def ip_to_int(ip: str) -> int:
+    address = ipaddress.ip_address(ip)
+    if address.version == 4:
+        return int(address)
+    return int(address) | IPV6_FLAG
+
+
+def int_to_ip(value: int) -> str:
+    if value < IPV4_MAX:
+        return str(ipaddress.IPv4Address(value))
+    return str(ipaddress.IPv6Address(value ^ IPV6_FLAG))
+
+
+def is_private_int(value: int) -> bool:
+    """按掩码判断整数形式的地址是否属于私有地址段"""
+    for network, mask in (PRIVATE_V4 if value < IPV4_MAX else PRIVATE_V6):
+        if value & mask == network:
+            return True
+    return False
+
+
+def flow_key(a: int, b: int) -> int:
+    """与方向无关的流键, 由两端地址拼成一个整数"""
+    if a > b:
+        a, b = b, a
+    if b < IPV4_MAX:
+        return (a << 32) | b
+    return (a << 129) | b
@@ -1,5 +1,9 @@
+import dataclasses
 import re
-from typing import List, Dict, Any, Optional, Union
+import numpy as np
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Sequence, Union
+
+import instrument
 from .metric import NetworkInfo, PlaybackInfo, Metric
 
 def parse_network_info(network_str: str) -> List[NetworkInfo]:
@@ -34,6 +38,13 @@ def first_non_zero_index(arr):
             return i
     return -1  # 如果所有元素都是0，返回-1
 
+def parse_buffer_valid(text: str) -> Optional[bool]:
+    """buffer_valid为-1时无效(None), 否则为true/false(不区分大小写)"""
+    text = text.strip()
+    if text == '-1':
+        return None
+    return text.lower() not in ('false', '0')
+
 def parse_playback_info(playback_str: str) -> PlaybackInfo:
     playback_str = playback_str.strip('[]')
     # 先分割出第一个列表
@@ -66,7 +77,7 @@ def parse_playback_info(playback_str: str) -> PlaybackInfo:
         buffer_progress = 0
     else:
         buffer_progress = float(text_progress)
-    buffer_valid = bool(new_parts[2].strip()) if new_parts[2].strip() != '-1' else None
+    buffer_valid = parse_buffer_valid(new_parts[2])
 
     playback = PlaybackInfo(
         playback_event=playback_event,
@@ -84,76 +95,300 @@ def parse_playback_info(playback_str: str) -> PlaybackInfo:
     )
     return playback
 
+def parse_metric_line(line: str) -> Metric:
+    """解析一行指标记录"""
+    line = line.strip().strip('[]')
+    parts = line.split(', [[', 2)
+
+    header = parts[0].split(',')
+    relative_time = float(header[0].strip())
+    packets_sent = int(header[1].strip())
+    packets_received = int(header[2].strip())
+    bytes_sent = int(header[3].strip())
+    bytes_received = int(header[4].strip())
+
+    networks = parse_network_info(parts[1])
+    playback = parse_playback_info(parts[2])
+    return Metric(
+        relative_time=relative_time,
+        packets_sent=packets_sent,
+        packets_received=packets_received,
+        bytes_sent=bytes_sent,
+        bytes_received=bytes_received,
+        networks=networks,
+        playback=playback
+    )
+
+
+@instrument.timed('parse_metric')
 def parse_metric(text: str) -> List[Metric]:
     """解析整个网络数据文本块"""
     metrics = []
     lines = text.strip().split('\n')
     for line in lines:
         if line:
-            line = line.strip('[]')
-            parts = line.split(', [[', 2)
-
-            relative_time = float(parts[0].split(',')[0].strip())
-            packets_sent = int(parts[0].split(',')[1].strip())
-            packets_received = int(parts[0].split(',')[2].strip())
-            bytes_sent = int(parts[0].split(',')[3].strip())
-            bytes_received = int(parts[0].split(',')[4].strip())
-
-            networks = parse_network_info(parts[1])
-            playback = parse_playback_info(parts[2])
-            metric = Metric(
-                relative_time=relative_time,
-                packets_sent=packets_sent,
-                packets_received=packets_received,
-                bytes_sent=bytes_sent,
-                bytes_received=bytes_received,
-                networks=networks,
-                playback=playback
-            )
-            metrics.append(metric)
+            metrics.append(parse_metric_line(line))
+    instrument.count('lines', len(metrics))
     return metrics
 
 
+# iter_metrics可以投影的字段: 记录头部字段、networks以及PlaybackInfo的所有字段
+METRIC_FIELDS = ('relative_time', 'packets_sent', 'packets_received', 'bytes_sent', 'bytes_received', 'networks')
+PLAYBACK_FIELDS = tuple(f.name for f in dataclasses.fields(PlaybackInfo))
+# 训练只需要的时间和三个标签, 与model_util.metric_labels的列一致
+LABEL_FIELDS = ('relative_time', 'playback_event_type', 'playback_quality_type', 'buffer_warning')
+
+READ_BUFFER_SIZE = 1 << 20
+
+
+def iter_metrics(file_path: str, fields: Optional[Sequence[str]] = None,
+                 buffer_size: int = READ_BUFFER_SIZE) -> Iterator[Union[Metric, tuple]]:
+    """逐行读取指标文件, 逐条产出记录, 内存占用与文件长度无关
+
+    fields为None时产出Metric对象; 否则产出按fields顺序排列的字段值元组,
+    不需要的部分不解析(例如只要LABEL_FIELDS时跳过网络信息)
+    """
+    if fields is None:
+        with open(file_path, 'r', buffering=buffer_size) as file:
+            for line in file:
+                if line.strip():
+                    yield parse_metric_line(line)
+        return
+
+    unknown = [name for name in fields if name not in METRIC_FIELDS and name not in PLAYBACK_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown metric fields: {', '.join(unknown)}")
+    need_networks = 'networks' in fields
+    need_playback = any(name in PLAYBACK_FIELDS for name in fields)
+    header_index = {name: i for i, name in enumerate(METRIC_FIELDS[:5])}
+
+    with open(file_path, 'r', buffering=buffer_size) as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            parts = line.strip('[]').split(', [[', 2)
+            header = parts[0].split(',')
+            networks = parse_network_info(parts[1]) if need_networks else None
+            playback = parse_playback_info(parts[2]) if need_playback else None
+
+            values = []
+            for name in fields:
+                if name in header_index:
+                    text = header[header_index[name]]
+                    values.append(float(text) if name == 'relative_time' else int(text))
+                elif name == 'networks':
+                    values.append(networks)
+                else:
+                    values.append(getattr(playback, name))
+            yield tuple(values)
+
+
 def read_metric(file_path: str) -> List[Metric]:
     """从文件读取网络数据"""
     try:
-        with open(file_path, 'r') as file:
-            text = file.read()
-            return parse_metric(text)
+        return list(iter_metrics(file_path))
     except Exception as e:
         print(f"Error reading file: {e}")
         return []
 
 
-def write_metric(metrics: List[Metric], file_path: str) -> None:
-    """将Metric对象列表写入文件"""
+def format_metric(metric: Metric) -> str:
+    """把Metric格式化为一行记录(不含换行), 格式与parse_metric_line解析的相同"""
+    header = (f"{metric.relative_time}, {metric.packets_sent}, {metric.packets_received}, "
+              f"{metric.bytes_sent}, {metric.bytes_received}")
+
+    network_items = []
+    for net in metric.networks:
+        protocol = net.protocol if net.protocol is not None else '0'
+        network_items.append(
+            f"[{net.src_ip}, {net.dst_ip}, {protocol}, {net.packets_sent}, {net.packets_received}, "
+            f"{net.bytes_sent}, {net.bytes_received}]")
+    networks = f"[{', '.join(network_items)}]"
+
+    playback = metric.playback
+    playback_event = f"[{', '.join(map(str, playback.playback_event))}]"
+    quality = f"[{', '.join(map(str, playback.playback_quality))}]"
+    if playback.buffer_valid is None or playback.buffer_valid == -1:
+        buffer_valid = '-1'
+    else:
+        buffer_valid = 'true' if playback.buffer_valid else 'false'
+
+    playback_info = (f"[{playback_event}, {playback.epoch_time}, {playback.start_time}, "
+                     f"{playback.playback_progress}, {playback.video_length}, {quality}, "
+                     f"{playback.buffer_health}, {playback.buffer_progress}, {buffer_valid}]")
+    return f"[{header}, {networks}, {playback_info}]"
+
+
+WRITE_BATCH_LINES = 4096
+
+
+def write_metric(metrics: Iterable[Metric], file_path: str, buffer_size: int = READ_BUFFER_SIZE) -> None:
+    """将Metric对象写入文件, metrics可以是列表或iter_metrics等生成器
+
+    按WRITE_BATCH_LINES行一批拼接后写入带缓冲的文件, 不需要把全部记录留在内存中
+    """
     try:
-        with open(file_path, 'w') as file:
+        count = 0
+        with open(file_path, 'w', buffering=buffer_size) as file:
+            batch = []
             for metric in metrics:
-                # 构建头部信息
-                header = f"[{metric.relative_time}, {metric.packets_sent}, {metric.packets_received}, {metric.bytes_sent}, {metric.bytes_received}]"
-
-                # 构建网络信息
-                network_items = []
-                for net in metric.networks:
-                    protocol = net.protocol if net.protocol is not None else '0'
-                    network_items.append(
-                        f"[{net.src_ip}, {net.dst_ip}, {protocol}, {net.packets_sent}, {net.packets_received}, {net.bytes_sent}, {net.bytes_received}]")
-                networks = f"[{', '.join(network_items)}]"
-
-                # 构建播放信息
-                playback = metric.playback
-                playback_event = f"[{', '.join(map(str, playback.playback_event))}]"
-                quality = f"[{', '.join(map(str, playback.playback_quality))}]"
-                buffer_valid = playback.buffer_valid if playback.buffer_valid is not None else -1
-
-                playback_info = (f"[{playback_event}, {playback.epoch_time}, {playback.start_time}, "
-                                 f"{playback.playback_progress}, {quality}, {playback.buffer_health}, "
-                                 f"{playback.buffer_progress}, {buffer_valid}]")
-
-                # 写入完整的一行
-                line = f"[{header}, {networks}, {playback_info}]\n"
-                file.write(line)
-        print(f"成功将 {len(metrics)} 条记录写入文件: {file_path}")
+                batch.append(format_metric(metric))
+                if len(batch) >= WRITE_BATCH_LINES:
+                    file.write('\n'.join(batch) + '\n')
+                    count += len(batch)
+                    batch = []
+            if batch:
+                file.write('\n'.join(batch) + '\n')
+                count += len(batch)
+        print(f"成功将 {count} 条记录写入文件: {file_path}")
     except Exception as e:
-        print(f"写入文件时出错: {e}")
\ No newline at end of file
+        print(f"写入文件时出错: {e}")
+
+
+# 批量解析: 整个文本只做几次整体的split/join, 数值部分按整数和浮点数分组后一次性转换为数组
+#
+# 每行格式为
+#   [时间, 发包数, 收包数, 发送字节, 接收字节, [[网络信息], ...], [[事件列表], epoch, start,
+#    progress, length, [质量列表], buffer_health, buffer_progress, buffer_valid]]
+# 按', [['切分后奇数段为网络信息, 其余部分再按方括号切分, 每条记录固定得到7段:
+#   头部 / 事件列表 / epoch..length / 质量列表 / health..valid / 空 / 换行
+# 事件和质量列表按整数解析, 比按浮点数解析快得多
+HEADER_COLUMNS = ('relative_time', 'packets_sent', 'packets_received', 'bytes_sent', 'bytes_received')
+PLAYBACK_EVENTS = 4
+PLAYBACK_QUALITIES = 9
+SEGMENTS_PER_LINE = 7
+
+
+def first_non_zero_indices(arr: np.ndarray) -> np.ndarray:
+    """每行第一个非零元素的下标, 全为0时为-1"""
+    non_zero = arr != 0
+    index = np.argmax(non_zero, axis=1)
+    index[~non_zero.any(axis=1)] = -1
+    return index
+
+
+class MetricTable:
+    """按列存放的指标数据, 只在访问单条记录时才构造Metric对象
+
+    列数组保存在columns中, 网络信息保留原始文本, 需要时再解析
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], network_texts: List[str]):
+        self.columns = columns
+        self.network_texts = network_texts
+
+    def __len__(self):
+        return len(self.network_texts)
+
+    def __getitem__(self, i) -> Metric:
+        c = self.columns
+        playback = PlaybackInfo(
+            playback_event=c['playback_event'][i].tolist(),
+            playback_event_type=int(c['playback_event_type'][i]),
+            epoch_time=int(c['epoch_time'][i]),
+            start_time=int(c['start_time'][i]),
+            playback_progress=float(c['playback_progress'][i]),
+            video_length=float(c['video_length'][i]),
+            playback_quality=c['playback_quality'][i].tolist(),
+            playback_quality_type=int(c['playback_quality_type'][i]),
+            buffer_health=float(c['buffer_health'][i]),
+            buffer_warning=int(c['buffer_warning'][i]),
+            buffer_progress=float(c['buffer_progress'][i]) if c['buffer_progress'][i] == c['buffer_progress'][i] else 0,
+            buffer_valid=bool(c['buffer_valid'][i]) if c['buffer_valid'][i] >= 0 else None
+        )
+        return Metric(
+            relative_time=float(c['relative_time'][i]),
+            packets_sent=int(c['packets_sent'][i]),
+            packets_received=int(c['packets_received'][i]),
+            bytes_sent=int(c['bytes_sent'][i]),
+            bytes_received=int(c['bytes_received'][i]),
+            networks=parse_network_info(self.network_texts[i]),
+            playback=playback
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def relative_time(self) -> np.ndarray:
+        return self.columns['relative_time']
+
+    def labels(self) -> np.ndarray:
+        """(事件类型, 画质类型, 缓冲警告)三列标签"""
+        c = self.columns
+        return np.column_stack([c['playback_event_type'], c['playback_quality_type'], c['buffer_warning']])
+
+    def to_metrics(self) -> List[Metric]:
+        return list(self)
+
+
+@instrument.timed('parse_metric_table')
+def parse_metric_table(text: str) -> MetricTable:
+    """批量解析整个指标文本为MetricTable"""
+    parts = text.strip().split(', [[')
+    n = len(parts) // 2
+    network_texts = parts[1::2]
+    segments = ']'.join([parts[0]] + parts[2::2]).replace('[', ']').split(']')
+
+    if n == 0:
+        head = np.zeros((0, len(HEADER_COLUMNS)))
+        events = np.zeros((0, PLAYBACK_EVENTS), dtype=np.int64)
+        middle = np.zeros((0, 4))
+        qualities = np.zeros((0, PLAYBACK_QUALITIES), dtype=np.int64)
+        tail = np.zeros((0, 3))
+    else:
+        if len(segments) != n * SEGMENTS_PER_LINE + 1:
+            raise ValueError("malformed metric text")
+        head = np.fromstring(','.join(segments[1::SEGMENTS_PER_LINE]), sep=',')
+        events = np.fromstring(','.join(segments[2::SEGMENTS_PER_LINE]), sep=',', dtype=np.int64)
+        # epoch_time, start_time, playback_progress, video_length
+        middle = np.fromstring(''.join(segments[3::SEGMENTS_PER_LINE]).replace(', ,', ',').strip(', '), sep=',')
+        qualities = np.fromstring(','.join(segments[4::SEGMENTS_PER_LINE]), sep=',', dtype=np.int64)
+        # buffer_health, buffer_progress, buffer_valid
+        # 与parse_buffer_valid一致: buffer_valid为-1时无效, true为1, false为0
+        tail_text = ''.join(segments[5::SEGMENTS_PER_LINE]).strip(', ')
+        tail_text = (tail_text.replace('null', 'nan').replace('true', '1').replace('True', '1')
+                     .replace('false', '0').replace('False', '0'))
+        tail = np.fromstring(tail_text, sep=',')
+
+        try:
+            head = head.reshape(n, len(HEADER_COLUMNS))
+            events = events.reshape(n, PLAYBACK_EVENTS)
+            middle = middle.reshape(n, 4)
+            qualities = qualities.reshape(n, PLAYBACK_QUALITIES)
+            tail = tail.reshape(n, 3)
+        except ValueError:
+            raise ValueError("malformed metric text")
+
+    columns = {'relative_time': head[:, 0]}
+    for i, name in enumerate(HEADER_COLUMNS[1:], 1):
+        columns[name] = head[:, i].astype(np.int64)
+
+    columns.update({
+        'playback_event': events,
+        'playback_event_type': first_non_zero_indices(events),
+        'epoch_time': middle[:, 0].astype(np.int64),
+        'start_time': middle[:, 1].astype(np.int64),
+        'playback_progress': middle[:, 2],
+        'video_length': middle[:, 3],
+        'playback_quality': qualities,
+        'playback_quality_type': first_non_zero_indices(qualities),
+        'buffer_health': tail[:, 0],
+        'buffer_warning': (tail[:, 0] < 20).astype(np.int64),
+        'buffer_progress': tail[:, 1],
+        'buffer_valid': tail[:, 2].astype(np.int8),
+    })
+    instrument.count('lines', n)
+    return MetricTable(columns, network_texts)
+
+
+def read_metric_table(file_path: str) -> MetricTable:
+    """从文件批量读取指标数据"""
+    try:
+        with open(file_path, 'r') as file:
+            return parse_metric_table(file.read())
+    except Exception as e:
+        print(f"Error reading file: {e}")
+        return parse_metric_table('')
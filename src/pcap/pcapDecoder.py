@@ -0,0 +1,486 @@
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from .ipAddress import IPV6_FLAG, ip_to_int
+
+# pcap文件头魔数 -> (字节序, 时间戳小数部分换算为纳秒的倍数)
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1000),  # 小端, 微秒
+    b'\xa1\xb2\xc3\xd4': ('>', 1000),  # 大端, 微秒
+    b'\x4d\x3c\xb2\xa1': ('<', 1),     # 小端, 纳秒
+    b'\xa1\xb2\x3c\x4d': ('>', 1),     # 大端, 纳秒
+}
+
+# 支持直接解码的链路类型
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+# 可以跳过的IPv6扩展头
+IPV6_EXT_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT = 44
+
+PCAP_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+IPV6_HEADER_LEN = 40
+
+
+# 解析结果: (时间戳(纳秒), 源IP, 目的IP, IP总长度, 协议号, 源端口, 目的端口)
+# IP地址为整数形式(见ipAddress), IPv6的总长度为载荷长度加上40字节固定头部
+# 非TCP/UDP的包端口为0
+
+
+def iter_packets(input_file):
+    """逐个产出pcap中IPv4/IPv6包的头部字段
+
+    对以太网/RAW/Linux cooked链路类型的pcap文件直接在mmap上解析头部,
+    其他格式(如pcapng)回退到scapy逐包解析
+    """
+    with open(input_file, 'rb') as f:
+        header = f.read(PCAP_HEADER_LEN)
+        if len(header) == PCAP_HEADER_LEN and header[:4] in PCAP_MAGIC:
+            endian, scale = PCAP_MAGIC[header[:4]]
+            linktype = struct.unpack_from(endian + 'I', header, 20)[0] & 0x0fffffff
+            if linktype in (LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LINUX_SLL):
+                yield from _iter_raw(f, endian, scale, linktype)
+                return
+
+    yield from iter_scapy(input_file)
+
+
+def _iter_raw(f, endian, scale, linktype):
+    cursor = [PCAP_HEADER_LEN, 0]
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield from _decode_records(mm, endian, scale, linktype, cursor)
+    print("read packets: ", cursor[1])
+
+
+def _raw_layout(header):
+    """可以直接解析的pcap文件头返回(字节序, 时间戳倍数, 链路类型, snaplen), 否则返回None"""
+    if len(header) < PCAP_HEADER_LEN or header[:4] not in PCAP_MAGIC:
+        return None
+    endian, scale = PCAP_MAGIC[header[:4]]
+    snaplen, linktype = struct.unpack_from(endian + 'II', header, 16)
+    if linktype & 0x0fffffff not in (LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LINUX_SLL):
+        return None
+    return endian, scale, linktype & 0x0fffffff, snaplen or 0x40000
+
+
+# 各链路类型的链路层头部长度
+LINK_HEADER_LEN = {LINKTYPE_ETHERNET: 14, LINKTYPE_RAW: 0, LINKTYPE_LINUX_SLL: 16}
+IPV4_HEADER_LEN = 20
+
+
+def _frame_is_ip(buf, frame, incl_len, linktype):
+    """帧是否为IPv4/IPv6包: 链路层类型字段与IP头的版本号一致"""
+    ip = frame + LINK_HEADER_LEN[linktype]
+    end = frame + incl_len
+    if linktype == LINKTYPE_RAW:
+        return ip < end and buf[ip] >> 4 in (4, 6)
+
+    ether_type = int.from_bytes(buf[ip - 2:ip], 'big')
+    while linktype == LINKTYPE_ETHERNET and ether_type in ETHERTYPE_VLAN and ip + 4 <= end:
+        ether_type = int.from_bytes(buf[ip + 2:ip + 4], 'big')
+        ip += 4
+    if ip >= end:
+        return False
+    if ether_type == ETHERTYPE_IPV4:
+        return buf[ip] >> 4 == 4
+    return ether_type == ETHERTYPE_IPV6 and buf[ip] >> 4 == 6
+
+
+def _is_record_chain(buf, offset, endian, scale, snaplen, linktype, first_sec, depth=8):
+    """从offset开始连续depth条记录是否都合理, 并且恰好首尾相接(或到达文件末尾):
+    长度不小于链路层头部加IPv4头部、不超过snaplen和非零的原始长度; 时间戳不早于第一条记录(first_sec)
+    且前后相差不超过1小时; 每一帧都是IPv4/IPv6包
+
+    全零的数据(如载荷中的填充)不能通过检查; 只含IP包才能作为分段点, 找不到时分段点顺延
+    """
+    unpack_record = struct.Struct(endian + 'IIII').unpack_from
+    frac_limit = 1000000000 // scale
+    min_len = LINK_HEADER_LEN[linktype] + IPV4_HEADER_LEN
+    end = len(buf)
+    prev_sec = None
+    for _ in range(depth):
+        if offset == end:
+            return True
+        if offset + RECORD_HEADER_LEN > end:
+            return False
+        ts_sec, ts_frac, incl_len, orig_len = unpack_record(buf, offset)
+        if ts_frac >= frac_limit or orig_len == 0 or not min_len <= incl_len <= min(snaplen, orig_len):
+            return False
+        if ts_sec < first_sec or (prev_sec is not None and abs(ts_sec - prev_sec) > 3600):
+            return False
+        frame = offset + RECORD_HEADER_LEN
+        if frame + incl_len > end or not _frame_is_ip(buf, frame, incl_len, linktype):
+            return False
+        prev_sec = ts_sec
+        offset = frame + incl_len
+    return True
+
+
+def split_ranges(input_file, n):
+    """把pcap文件的记录区切成大致等长的n段, 返回[(起始偏移, 结束偏移), ...], 每段都从记录边界开始
+
+    从每个等分点向后逐字节寻找能连成一串合理记录的位置作为分段点, 不需要从头扫描所有记录;
+    找不到分段点时与前一段合并. 这只是启发式判断, 调用方须检查每段恰好解析到下一段的起点(见iter_range);
+    文件格式不能直接解析(如pcapng)时返回None
+    """
+    with open(input_file, 'rb') as f:
+        layout = _raw_layout(f.read(PCAP_HEADER_LEN))
+        if layout is None:
+            return None
+        endian, scale, linktype, snaplen = layout
+        size = os.fstat(f.fileno()).st_size
+        if size <= PCAP_HEADER_LEN + RECORD_HEADER_LEN:
+            return [(PCAP_HEADER_LEN, size)]
+
+        bounds = [PCAP_HEADER_LEN]
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # 第一条记录的时间戳作为整个文件时间戳的下限
+            first_sec = struct.unpack_from(endian + 'I', mm, PCAP_HEADER_LEN)[0]
+            for k in range(1, n):
+                start = max(bounds[-1] + 1, PCAP_HEADER_LEN + (size - PCAP_HEADER_LEN) * k // n)
+                # 任意位置之后一条最大长度的记录之内必有一个记录边界
+                for offset in range(start, min(start + RECORD_HEADER_LEN + snaplen, size)):
+                    if _is_record_chain(mm, offset, endian, scale, snaplen, linktype, first_sec):
+                        bounds.append(offset)
+                        break
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_range(input_file, first, last, cursor=None):
+    """逐个产出pcap中[first, last)字节范围内的记录, 格式与iter_packets相同
+
+    first须为记录边界(见split_ranges); cursor不为None时在结束后cursor[0]为第一条未解析记录的偏移,
+    cursor[1]累加已读取的记录数. 分段点都是真正的记录边界时, 每段结束后cursor[0]恰好等于last
+    """
+    cursor = cursor if cursor is not None else [first, 0]
+    cursor[0] = first
+    with open(input_file, 'rb') as f:
+        endian, scale, linktype, _ = _raw_layout(f.read(PCAP_HEADER_LEN))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            with view[:last] as buf:
+                yield from _decode_records(buf, endian, scale, linktype, cursor)
+
+
+def _decode_records(buf, endian, scale, linktype, cursor):
+    """从buf的cursor[0]处开始解析完整的记录, 遇到不完整的记录时停止
+
+    结束后cursor[0]为第一条未解析记录的偏移, cursor[1]累加已读取的记录数
+    """
+    record = struct.Struct(endian + 'IIII')
+    unpack_record = record.unpack_from
+    unpack_ushort = struct.Struct('!H').unpack_from
+    unpack_ports = struct.Struct('!HH').unpack_from
+    unpack_addrs = struct.Struct('!II').unpack_from
+    from_bytes = int.from_bytes
+    end = len(buf)
+    offset = cursor[0]
+    count = 0
+
+    while offset + RECORD_HEADER_LEN <= end:
+        ts_sec, ts_frac, incl_len, _ = unpack_record(buf, offset)
+        frame = offset + RECORD_HEADER_LEN
+        if frame + incl_len > end:
+            break
+        offset = frame + incl_len
+        count += 1
+
+        # 定位IP头
+        if linktype == LINKTYPE_ETHERNET:
+            ip = frame + 14
+            ether_type = unpack_ushort(buf, ip - 2)[0]
+            while ether_type in ETHERTYPE_VLAN and ip + 4 <= offset:
+                ether_type = unpack_ushort(buf, ip + 2)[0]
+                ip += 4
+            if ether_type != ETHERTYPE_IPV4 and ether_type != ETHERTYPE_IPV6:
+                continue
+        elif linktype == LINKTYPE_LINUX_SLL:
+            ip = frame + 16
+            ether_type = unpack_ushort(buf, ip - 2)[0]
+            if ether_type != ETHERTYPE_IPV4 and ether_type != ETHERTYPE_IPV6:
+                continue
+        else:
+            ip = frame
+
+        if ip + 20 > offset:
+            continue
+        version = buf[ip] >> 4
+
+        if version == 4:
+            length = unpack_ushort(buf, ip + 2)[0]
+            proto = buf[ip + 9]
+            src, dst = unpack_addrs(buf, ip + 12)
+            l4 = ip + (buf[ip] & 0x0f) * 4
+            # 只有首个分片才带有传输层头部
+            if unpack_ushort(buf, ip + 6)[0] & 0x1fff:
+                proto = 0
+        elif version == 6:
+            if ip + IPV6_HEADER_LEN > offset:
+                continue
+            length = unpack_ushort(buf, ip + 4)[0] + IPV6_HEADER_LEN
+            proto = buf[ip + 6]
+            src = from_bytes(buf[ip + 8:ip + 24], 'big') | IPV6_FLAG
+            dst = from_bytes(buf[ip + 24:ip + 40], 'big') | IPV6_FLAG
+            l4 = ip + IPV6_HEADER_LEN
+            while l4 + 8 <= offset:
+                if proto in IPV6_EXT_HEADERS:
+                    proto, l4 = buf[l4], l4 + (buf[l4 + 1] + 1) * 8
+                elif proto == IPV6_FRAGMENT:
+                    if unpack_ushort(buf, l4 + 2)[0] & 0xfff8:
+                        proto = 0
+                    else:
+                        proto, l4 = buf[l4], l4 + 8
+                else:
+                    break
+        else:
+            continue
+
+        sport = dport = 0
+        if proto == PROTO_TCP or proto == PROTO_UDP:
+            if l4 + 4 > offset:
+                proto = 0
+            else:
+                sport, dport = unpack_ports(buf, l4)
+
+        yield ts_sec * 1000000000 + ts_frac * scale, src, dst, length, proto, sport, dport
+
+    cursor[0] = offset
+    cursor[1] += count
+
+
+# read_columns返回的列, 含义与iter_packets产出的元组相同
+COLUMNS = ('time', 'src', 'dst', 'length', 'proto', 'sport', 'dport')
+
+
+class _FieldViews:
+    """在缓冲区的任意字节偏移处读取整数: 步长为1字节的重叠视图, 第i个元素为从第i个字节开始的整数"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.views = {}
+
+    def __call__(self, dtype, pos):
+        view = self.views.get(dtype)
+        if view is None:
+            itemsize = np.dtype(dtype).itemsize
+            count = max(len(self.buffer) - itemsize + 1, 0)
+            view = self.views[dtype] = np.ndarray((count,), dtype=dtype, buffer=self.buffer, strides=(1,))
+        return view[pos].astype(np.int64)
+
+    def release(self):
+        self.views.clear()
+
+
+def read_columns(input_file):
+    """把只含IPv4包的pcap文件一次解析为列数组字典(COLUMNS, 另有'records'为读取的记录数)
+
+    Python循环只按记录长度定位各记录, 头部字段由NumPy按偏移统一取出;
+    格式不能直接解析或含有IPv6包时返回None, 由调用方逐包解析
+    """
+    with open(input_file, 'rb') as f:
+        layout = _raw_layout(f.read(PCAP_HEADER_LEN))
+        if layout is None:
+            return None
+        endian, scale, linktype, _ = layout
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            unpack_len = struct.Struct(endian + 'I').unpack_from
+            end = len(mm)
+            offsets = []
+            append = offsets.append
+            offset = PCAP_HEADER_LEN
+            while offset <= end - RECORD_HEADER_LEN:
+                append(offset)
+                offset += RECORD_HEADER_LEN + unpack_len(mm, offset + 8)[0]
+            # 最后一条记录不完整
+            if offset > end:
+                offsets.pop()
+            print("read packets: ", len(offsets))
+
+            fields = _FieldViews(mm)
+            try:
+                columns = _decode_columns(fields, np.array(offsets, dtype=np.int64), endian, scale, linktype)
+            finally:
+                fields.release()
+    if columns is not None:
+        columns['records'] = len(offsets)
+    return columns
+
+
+def _decode_columns(fields, offsets, endian, scale, linktype):
+    """按记录偏移取出各头部字段, 与_decode_records逐条解析的结果相同"""
+    u4, be2, be4 = endian + 'u4', '>u2', '>u4'
+    ts_sec = fields(u4, offsets)
+    ts_frac = fields(u4, offsets + 4)
+    frame = offsets + RECORD_HEADER_LEN
+    frame_end = frame + fields(u4, offsets + 8)
+
+    # 定位IP头, 链路层头部不完整的帧在读取前就排除, 避免越界
+    ip = frame + LINK_HEADER_LEN[linktype]
+    valid = ip + IPV4_HEADER_LEN <= frame_end
+    if linktype != LINKTYPE_RAW:
+        ether_type = np.where(valid, fields(be2, np.where(valid, ip - 2, 0)), 0)
+        if linktype == LINKTYPE_ETHERNET:
+            vlan = np.isin(ether_type, ETHERTYPE_VLAN) & (ip + 4 <= frame_end)
+            while vlan.any():
+                index = np.flatnonzero(vlan)
+                ether_type[index] = fields(be2, ip[index] + 2)
+                ip[index] += 4
+                vlan[index] = np.isin(ether_type[index], ETHERTYPE_VLAN) & (ip[index] + 4 <= frame_end[index])
+            valid &= ip + IPV4_HEADER_LEN <= frame_end
+        if (valid & (ether_type == ETHERTYPE_IPV6)).any():
+            return None
+        valid &= ether_type == ETHERTYPE_IPV4
+
+    ip, frame_end = ip[valid], frame_end[valid]
+    ts_sec, ts_frac = ts_sec[valid], ts_frac[valid]
+    first_byte = fields('u1', ip)
+    version = first_byte >> 4
+    if (version == 6).any():
+        return None
+    keep = version == 4
+    ip, frame_end, ts_sec, ts_frac, first_byte = ip[keep], frame_end[keep], ts_sec[keep], ts_frac[keep], first_byte[keep]
+
+    proto = fields('u1', ip + 9)
+    # 只有首个分片才带有传输层头部
+    proto[(fields(be2, ip + 6) & 0x1fff) != 0] = 0
+    l4 = ip + (first_byte & 0x0f) * 4
+    transport = (proto == PROTO_TCP) | (proto == PROTO_UDP)
+    proto[transport & (l4 + 4 > frame_end)] = 0
+    transport &= l4 + 4 <= frame_end
+    l4 = np.where(transport, l4, 0)
+
+    return {
+        'time': ts_sec * 1000000000 + ts_frac * scale,
+        'src': fields(be4, ip + 12),
+        'dst': fields(be4, ip + 16),
+        'length': fields(be2, ip + 2),
+        'proto': proto,
+        'sport': np.where(transport, fields(be2, l4), 0),
+        'dport': np.where(transport, fields(be2, l4 + 2), 0),
+    }
+
+
+def follow_packets(input_file, poll_interval=0.2, idle_timeout=5.0):
+    """跟踪一个仍在写入的pcap文件, 逐个产出新写入的包, 格式与iter_packets相同
+
+    读到文件末尾后每隔poll_interval秒检查一次新数据, 超过idle_timeout秒没有新数据时结束,
+    idle_timeout为None时一直等待; 只支持可以直接解析的pcap格式
+    """
+    buf = bytearray()
+    cursor = [PCAP_HEADER_LEN, 0]
+    decode = None
+    last_data = time.monotonic()
+
+    with open(input_file, 'rb') as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                if idle_timeout is not None and time.monotonic() - last_data > idle_timeout:
+                    break
+                time.sleep(poll_interval)
+                continue
+            last_data = time.monotonic()
+            buf += data
+
+            if decode is None:
+                if len(buf) < PCAP_HEADER_LEN:
+                    continue
+                if bytes(buf[:4]) not in PCAP_MAGIC:
+                    raise ValueError(f"unsupported capture format: {input_file}")
+                endian, scale = PCAP_MAGIC[bytes(buf[:4])]
+                linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0x0fffffff
+                if linktype not in (LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LINUX_SLL):
+                    raise ValueError(f"unsupported link type {linktype}: {input_file}")
+                decode = (endian, scale, linktype)
+
+            yield from _decode_records(buf, *decode, cursor)
+            # 丢弃已解析的部分, 只保留不完整的记录
+            del buf[:cursor[0]]
+            cursor[0] = 0
+
+    print("read packets: ", cursor[1])
+
+
+def replay(records, speed=1.0):
+    """按包的时间戳以speed倍速回放记录"""
+    start_wall = None
+    start_ts = 0
+    for record in records:
+        if start_wall is None:
+            start_wall = time.perf_counter()
+            start_ts = record[0]
+        delay = (record[0] - start_ts) / 1e9 / speed - (time.perf_counter() - start_wall)
+        if delay > 0:
+            time.sleep(delay)
+        yield record
+
+
+def packet_record(packet):
+    """将scapy数据包转换为与直接解析相同格式的元组, 非IP包返回None"""
+    from scapy.layers.inet import IP, TCP, UDP
+    from scapy.layers.inet6 import IPv6
+
+    if packet.haslayer(IP):
+        ip = packet[IP]
+        length = ip.len
+        proto = ip.proto
+    elif packet.haslayer(IPv6):
+        ip = packet[IPv6]
+        length = ip.plen + IPV6_HEADER_LEN
+        proto = ip.nh
+    else:
+        return None
+
+    sport = dport = 0
+    if packet.haslayer(TCP):
+        proto = PROTO_TCP
+    elif packet.haslayer(UDP):
+        proto = PROTO_UDP
+        sport, dport = packet[UDP].sport, packet[UDP].dport
+    elif proto == PROTO_TCP or proto == PROTO_UDP:
+        # 非首个分片
+        proto = 0
+    return (int(packet.time * 1000000000), ip_to_int(ip.src), ip_to_int(ip.dst),
+            length, proto, sport, dport)
+
+
+def iter_scapy(input_file, streaming=True):
+    """经scapy完整解析每个包, 逐个产出与iter_packets相同格式的记录
+
+    streaming为True时使用PcapReader按记录读取, 内存占用与文件大小无关;
+    为False时沿用rdpcap一次性读入全部数据包
+    """
+    # 只有不能直接解析的格式才用到scapy, 按需导入以缩短启动时间;
+    # 导入layers中的链路层和IP层模块后PcapReader才能把数据包解析到各层
+    from scapy.layers import l2, inet, inet6  # noqa: F401
+    from scapy.utils import rdpcap, PcapReader
+
+    if not streaming:
+        packets = rdpcap(input_file)
+        print("read packets: ", len(packets))
+        records = map(packet_record, packets)
+        yield from (record for record in records if record is not None)
+        return
+
+    count = 0
+    with PcapReader(input_file) as reader:
+        for packet in reader:
+            count += 1
+            record = packet_record(packet)
+            if record is not None:
+                yield record
+    print("read packets: ", count)
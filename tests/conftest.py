@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 源码以src为根目录导入(pcap, model, bench, instrument), 与在src下运行main.py时相同
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
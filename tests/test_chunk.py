@@ -0,0 +1,29 @@
+import numpy as np
+
+from pcap.chunk import CHUNK_DTYPE, Chunk, ChunkTable, IpStream, PacketType
+
+# ChunkTable按需分配并保持与chunk列表兼容的接口
+
+
+def test_empty_stream_allocates_no_rows():
+    ip_stream = IpStream('192.168.1.10', '142.250.0.1')
+    assert len(ip_stream.chunks) == 0
+    assert ip_stream.chunks.array.nbytes == 0
+    assert not ip_stream.chunks
+
+
+def test_append_and_extend_grow_the_table():
+    table = ChunkTable()
+    for i in range(40):
+        chunk = Chunk(float(i))
+        chunk.size = i
+        chunk.type = PacketType.VIDEO
+        table.append(chunk)
+    records = np.zeros(5, dtype=CHUNK_DTYPE)
+    records['request_time'] = np.arange(40, 45)
+    table.extend(records)
+
+    assert len(table) == 45
+    np.testing.assert_array_equal(table.column('request_time'), np.arange(45))
+    assert table[39].size == 39 and table[39].type == PacketType.VIDEO
+    assert table[-1].request_time == 44
@@ -0,0 +1,69 @@
+import json
+import os
+
+import pytest
+
+from bench.synthetic import write_session_pcap
+from pcap import chunkConvert
+
+# 转换目录时按清单跳过未过期的文件
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    pcap_directory, out_path = tmp_path / 'pcap', tmp_path / 'chunk'
+    pcap_directory.mkdir()
+    write_session_pcap(str(pcap_directory / 'a.pcap'), n_chunks=10, seed=1)
+    write_session_pcap(str(pcap_directory / 'b.pcap'), n_chunks=10, seed=2)
+    return str(pcap_directory), str(out_path)
+
+
+def convert(dataset, capsys, **kwargs):
+    assert chunkConvert.convert_directory(*dataset, workers=1, **kwargs) == []
+    return capsys.readouterr().out
+
+
+def manifest(out_path):
+    with open(os.path.join(out_path, chunkConvert.MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def test_skips_up_to_date_files(dataset, capsys):
+    pcap_directory, out_path = dataset
+    assert "0/2 files up to date, converting 2" in convert(dataset, capsys)
+    output = os.path.join(out_path, chunkConvert.chunk_file_name('a.pcap'))
+    built = os.stat(output).st_mtime_ns
+    assert "2/2 files up to date, converting 0" in convert(dataset, capsys)
+
+    # 只改变修改时间时不重新转换, 清单记录新的修改时间
+    pcap_file = os.path.join(pcap_directory, 'a.pcap')
+    os.utime(pcap_file, ns=(10 ** 18, 10 ** 18))
+    assert "2/2 files up to date, converting 0" in convert(dataset, capsys)
+    assert manifest(out_path)['a.pcap']['mtime_ns'] == 10 ** 18
+    assert os.stat(output).st_mtime_ns == built
+
+    # 内容改变或输出缺失时重新转换
+    with open(pcap_file, 'ab') as f:
+        f.write(b'\0' * 8)
+    os.remove(os.path.join(out_path, chunkConvert.chunk_file_name('b.pcap')))
+    assert "0/2 files up to date, converting 2" in convert(dataset, capsys)
+    assert manifest(out_path)['a.pcap']['size'] == os.path.getsize(pcap_file)
+    # 参数改变时输入未变, 沿用清单中的sha256
+    digest = manifest(out_path)['a.pcap']['sha256']
+    assert "0/2 files up to date, converting 2" in convert(dataset, capsys, idle_timeout=30.0)
+    assert manifest(out_path)['a.pcap']['sha256'] == digest
+    assert "0/2 files up to date, converting 2" in convert(dataset, capsys, force=True)
+
+
+def test_source_state_reuses_recorded_digest(dataset, monkeypatch):
+    pcap_file = os.path.join(dataset[0], 'a.pcap')
+    source = chunkConvert.source_state(pcap_file)
+    assert source[2] == chunkConvert.file_digest(pcap_file)
+
+    digests = []
+    monkeypatch.setattr(chunkConvert, 'file_digest', lambda path: digests.append(path) or 'new')
+    assert chunkConvert.source_state(pcap_file, source) == source
+    assert digests == []
+    os.utime(pcap_file, ns=(10 ** 18, 10 ** 18))
+    assert chunkConvert.source_state(pcap_file, source)[1:] == (10 ** 18, 'new')
+    assert digests == [pcap_file]
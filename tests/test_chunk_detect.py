@@ -0,0 +1,94 @@
+import pytest
+
+from pcap import chunkDetect
+from pcap.ipAddress import ip_to_int
+from pcap.pcapDecoder import PROTO_TCP
+
+# ChunkDetector逐出空闲和超出上限的流
+
+CLIENT = ip_to_int('192.168.1.10')
+SERVERS = [ip_to_int(f'142.250.0.{i}') for i in range(1, 5)]
+NS = 1000000000
+
+
+def get(t, server):
+    return int(t * NS), CLIENT, server, 400, PROTO_TCP, 50000, 443
+
+
+def data(t, server, packets=60):
+    # 每个chunk 60 * 1500字节, 超过DOWN_MIN_PAYLOAD
+    return [(int(t * NS) + i * 1000, server, CLIENT, 1500, PROTO_TCP, 443, 50000) for i in range(packets)]
+
+
+def session(server, get_times, data_delay=0.05):
+    records = []
+    for t in get_times:
+        records.append(get(t, server))
+        records += data(t + data_delay, server)
+    return records
+
+
+def background(until, server=SERVERS[-1]):
+    """每秒一个小包的流, 使空闲检查定期发生"""
+    return [(int(t * NS), CLIENT, server, 60, PROTO_TCP, 50001, 443) for t in range(until)]
+
+
+def detect(records, **kwargs):
+    detector = chunkDetect.ChunkDetector(**kwargs)
+    stream_map = detector.feed(sorted(records)).finish()
+    chunks = {key: [round(chunk.request_time, 3) for chunk in ip_stream.chunks]
+              for key, ip_stream in stream_map.items()}
+    return chunks, detector
+
+
+def server_key(server):
+    return tuple(sorted(('192.168.1.10', f'142.250.0.{SERVERS.index(server) + 1}')))
+
+
+def idle_session():
+    # 请求时间为2的chunk之后空闲40多秒, 之后先收到数据再发出GET
+    server = SERVERS[0]
+    records = session(server, [0, 1, 2]) + data(45, server) + session(server, [46]) + [get(47, server)]
+    return server, records + background(48)
+
+
+def test_without_eviction_keeps_chunk_spanning_idle_period():
+    server, records = idle_session()
+    chunks, _ = detect(records)
+    assert chunks[server_key(server)] == [0, 1, 2, 46]
+
+
+def test_idle_flow_is_evicted_and_recreated_flow_waits_for_get():
+    server, records = idle_session()
+    chunks, detector = detect(records, idle_timeout=5)
+    # 跨越空闲期的chunk被丢弃, 重新出现的流在GET之前的数据不产生请求时间为0的chunk
+    assert chunks[server_key(server)] == [0, 1, 46]
+    assert detector.evictions['idle'] >= 1
+    assert detector.evictions['flushed'] >= 1
+    assert not detector.awaiting_get
+
+
+def test_lru_eviction_keeps_finished_chunks():
+    a, b, c = SERVERS[:3]
+    records = session(a, [0, 1]) + [get(2, a)] + session(b, [3, 4]) + [get(5, b)] + session(c, [6, 7]) + [get(8, c)]
+    chunks, detector = detect(records, max_flows=2)
+    assert detector.evictions['lru'] == 1
+    assert detector.evictions['peak_flows'] == 2
+    assert chunks == {server_key(a): [0, 1], server_key(b): [3, 4], server_key(c): [6, 7]}
+    # 逐出的流只保留chunk记录
+    assert all(isinstance(parts, list) for *_, parts in detector.evicted.values())
+
+
+def test_evicted_flow_merges_with_its_return():
+    a, b = SERVERS[:2]
+    records = (session(a, [0, 1]) + [get(2, a)] + session(b, [3]) + [get(4, b)]
+               + session(a, [5]) + [get(6, a)])
+    chunks, detector = detect(records, max_flows=1)
+    assert detector.evictions['lru'] == 2
+    assert chunks == {server_key(a): [0, 1, 5], server_key(b): [3]}
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'idle_timeout': 60}, {'max_flows': 8}])
+def test_eviction_without_effect_matches_plain_detection(kwargs):
+    _, records = idle_session()
+    assert detect(records, **kwargs)[0] == detect(records)[0]
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from bench.synthetic import write_session_pcap
+from pcap import chunkDetect, chunkStore
+from pcap.chunk import CHUNK_DTYPE, IpStream
+
+# 二进制chunk文件(.chk)的写出与读取
+
+
+@pytest.fixture(scope='module')
+def stream_map(tmp_path_factory):
+    path = tmp_path_factory.mktemp('pcap') / 'session.pcap'
+    write_session_pcap(str(path), n_chunks=30, n_flows=3, n_background=10)
+    stream_map = chunkDetect.chunk_detect(str(path))
+    # 没有chunk的流也要保留
+    stream_map[('10.0.0.1', '10.0.0.2')] = IpStream('10.0.0.1', '10.0.0.2')
+    return stream_map
+
+
+def assert_same_map(expected, actual):
+    # 读回的stream_map按(源地址, 目的地址)为键, 顺序与写出时相同
+    assert list(actual) == [(s.src, s.dst) for s in expected.values()]
+    for ip_stream, loaded in zip(expected.values(), actual.values()):
+        a, b = ip_stream.chunks.array, loaded.chunks.array
+        assert len(a) == len(b), (ip_stream.src, ip_stream.dst)
+        for name in CHUNK_DTYPE.names:
+            if name != 'flow':
+                np.testing.assert_array_equal(a[name], b[name], err_msg=name)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip(stream_map, tmp_path, mmap):
+    flows, records = chunkStore.stream_map_to_table(stream_map)
+    assert len(flows) == len(stream_map) and len(records) > 0
+    # 记录的flow字段为所在流在流表中的下标
+    assert np.array_equal(records['flow'], np.repeat(np.arange(len(flows)), flows['count'].astype(np.int64)))
+
+    outfile = str(tmp_path / 'session.chk')
+    chunkStore.write_table(flows, records, outfile)
+    assert chunkStore.is_chunk_store(outfile)
+    read_flows, read_records = chunkStore.read_table(outfile, mmap=mmap)
+    assert isinstance(read_records, np.memmap) == mmap
+    np.testing.assert_array_equal(read_flows, flows)
+    np.testing.assert_array_equal(read_records, records)
+    assert_same_map(stream_map, chunkStore.table_to_stream_map(read_flows, read_records))
+
+
+def test_round_trip_of_empty_map(tmp_path):
+    outfile = str(tmp_path / 'empty.chk')
+    chunkStore.write_table(*chunkStore.stream_map_to_table({}), outfile)
+    flows, records = chunkStore.read_table(outfile)
+    assert len(flows) == 0 and len(records) == 0
+    assert chunkStore.table_to_stream_map(flows, records) == {}
+
+
+def test_save_and_load_chunk(stream_map, tmp_path):
+    outfile = str(tmp_path / 'session.chk')
+    assert chunkDetect.save_chunk(stream_map, outfile)
+    assert_same_map(stream_map, chunkDetect.load_chunk(outfile))
+
+
+@pytest.mark.parametrize('magic, version', [(b'QOSCHNX\x00', chunkStore.VERSION),
+                                            (chunkStore.MAGIC, chunkStore.VERSION + 1)])
+def test_rejects_bad_header(stream_map, tmp_path, magic, version):
+    outfile = tmp_path / 'bad.chk'
+    chunkStore.write_table(*chunkStore.stream_map_to_table(stream_map), str(outfile))
+    data = bytearray(outfile.read_bytes())
+    data[:chunkStore.HEADER.size] = chunkStore.HEADER.pack(magic, version, *chunkStore.HEADER.unpack_from(data)[2:])
+    outfile.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="not a chunk store file"):
+        chunkStore.read_table(str(outfile))
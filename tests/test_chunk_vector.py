@@ -0,0 +1,99 @@
+import re
+import struct
+
+import numpy as np
+import pytest
+
+from bench.synthetic import write_session_pcap
+from pcap import chunkDetect, pcapDecoder
+from pcap.chunk import CHUNK_FIELDS
+
+# 各种chunk检测路径与逐包的对象路径(chunk_detect默认参数)结果一致
+
+
+def assert_same_streams(expected, actual, exact=True):
+    assert list(expected) == list(actual)
+    for key, ip_stream in expected.items():
+        a, b = ip_stream.chunks.array, actual[key].chunks.array
+        assert len(a) == len(b), key
+        for name in CHUNK_FIELDS:
+            if exact:
+                np.testing.assert_array_equal(a[name], b[name], err_msg=name)
+            else:
+                np.testing.assert_allclose(a[name], b[name], rtol=0, atol=1e-6, err_msg=name)
+        np.testing.assert_array_equal(a['type'], b['type'])
+
+
+def pad_payloads(src, dst):
+    """把只保留头部的记录补齐为完整的帧, 补齐的载荷全为0"""
+    data = open(src, 'rb').read()
+    out = bytearray(data[:pcapDecoder.PCAP_HEADER_LEN])
+    offset = pcapDecoder.PCAP_HEADER_LEN
+    while offset < len(data):
+        ts_sec, ts_usec, incl_len, orig_len = struct.unpack_from('<IIII', data, offset)
+        frame = data[offset + 16:offset + 16 + incl_len]
+        out += struct.pack('<IIII', ts_sec, ts_usec, orig_len, orig_len) + frame + bytes(orig_len - incl_len)
+        offset += 16 + incl_len
+    with open(dst, 'wb') as f:
+        f.write(out)
+
+
+@pytest.fixture(scope='module')
+def session_pcap(tmp_path_factory):
+    path = tmp_path_factory.mktemp('pcap') / 'session.pcap'
+    write_session_pcap(str(path), n_chunks=60, n_flows=3, n_background=20)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def padded_pcap(session_pcap, tmp_path_factory):
+    path = tmp_path_factory.mktemp('pcap') / 'padded.pcap'
+    pad_payloads(session_pcap, str(path))
+    return str(path)
+
+
+def test_vectorized_matches_object_path(session_pcap):
+    expected = chunkDetect.chunk_detect(session_pcap)
+    assert sum(len(s.chunks) for s in expected.values()) > 0
+    assert_same_streams(expected, chunkDetect.chunk_detect(session_pcap, vectorized=True))
+
+
+def test_vectorized_columns_match_record_loop(padded_pcap):
+    records = list(pcapDecoder.iter_packets(padded_pcap))
+    assert_same_streams(chunkDetect.detect_streams_vectorized(records),
+                        chunkDetect.detect_columns(pcapDecoder.read_columns(padded_pcap)))
+
+
+def test_raw_decoder_matches_scapy(session_pcap):
+    pytest.importorskip('scapy')
+    # scapy的时间戳为十进制小数, 与整数纳秒换算的结果只差浮点误差
+    assert_same_streams(chunkDetect.chunk_detect(session_pcap),
+                        chunkDetect.chunk_detect(session_pcap, raw=False), exact=False)
+
+
+@pytest.mark.parametrize('workers', [2, 3, 7])
+def test_sharded_matches_serial(session_pcap, workers):
+    assert_same_streams(chunkDetect.chunk_detect(session_pcap),
+                        chunkDetect.chunk_detect(session_pcap, workers=workers))
+
+
+@pytest.mark.parametrize('workers', [3, 6, 7, 8])
+def test_sharded_matches_serial_with_zero_payloads(padded_pcap, workers):
+    # 全零的载荷不能被当成记录边界
+    for first, last in pcapDecoder.split_ranges(padded_pcap, workers):
+        cursor = [first, 0]
+        for _ in pcapDecoder.iter_range(padded_pcap, first, last, cursor):
+            pass
+        assert cursor[0] == last
+    assert_same_streams(chunkDetect.chunk_detect(padded_pcap),
+                        chunkDetect.chunk_detect(padded_pcap, workers=workers))
+
+
+def test_text_export_has_fixed_decimals(session_pcap, tmp_path):
+    # 微秒精度的抓包与按Decimal时间戳相减的原输出一样固定写6位小数, 没有浮点误差
+    outfile = tmp_path / 'chunk.txt'
+    assert chunkDetect.save_chunk(chunkDetect.chunk_detect(session_pcap), str(outfile))
+    fields = re.findall(r'(GET|TTFB|down|slack): ([^,]+),', outfile.read_text())
+    assert fields
+    for name, value in fields:
+        assert re.fullmatch(r'\d+\.\d{6}', value) or (name == 'GET' and value == '0'), (name, value)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+import joblib
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.multioutput import MultiOutputClassifier
+
+from model import compiled_forest
+from model.random_forest import IncrementalForest
+
+# 编译后的森林与sklearn模型的预测完全一致
+
+
+def training_data(rows=400, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.random((rows, 6)) * [100, 1, 1, 10, 1, 1]
+    y = np.column_stack([
+        np.digitize(X[:, 0], [25, 50, 75]),
+        (X[:, 1] * 9).astype(int) % 9,
+        X[:, 2] + rng.normal(0, 0.2, rows) > 0.5,
+    ]).astype(int)
+    return X, y
+
+
+def incremental_forest(X, y):
+    model = IncrementalForest(trees_per_batch=5, random_state=0)
+    for part in np.array_split(np.arange(len(X)), 4):
+        model.partial_fit(X[part], y[part])
+    return model
+
+
+MODELS = {
+    'multi_output': lambda X, y: MultiOutputClassifier(RandomForestClassifier(10, random_state=0)).fit(X, y),
+    'forest': lambda X, y: RandomForestClassifier(10, random_state=0).fit(X, y),
+    'single_output': lambda X, y: RandomForestClassifier(10, random_state=0).fit(X, y[:, 0]),
+    'incremental': incremental_forest,
+}
+
+
+def as_list(proba):
+    return proba if isinstance(proba, list) else [proba]
+
+
+@pytest.mark.parametrize('name', sorted(MODELS))
+def test_matches_sklearn_exactly(name, tmp_path):
+    X, y = training_data()
+    model = MODELS[name](X, y)
+    X_test = training_data(300, seed=1)[0]
+
+    path = str(tmp_path / 'model.forest')
+    compiled_forest.compile_model(model).save(path)
+    compiled = compiled_forest.load_compiled(path)
+    assert compiled.source is None
+
+    expected = as_list(model.predict_proba(X_test))
+    actual = compiled.predict_proba(X_test, block_rows=128)
+    assert len(actual) == len(expected)
+    for a, b in zip(actual, expected):
+        np.testing.assert_array_equal(a, b)
+    np.testing.assert_array_equal(compiled.predict(X_test), model.predict(X_test).reshape(len(X_test), -1))
+
+
+def test_large_batches_use_exported_source_model(tmp_path):
+    X, y = training_data()
+    model = MODELS['multi_output'](X, y)
+    joblib.dump(model, tmp_path / 'model.joblib')
+    compiled_forest.export_model(str(tmp_path / 'model.joblib'), str(tmp_path / 'model.forest'))
+    compiled = compiled_forest.load_compiled(str(tmp_path / 'model.forest'))
+
+    small = training_data(10, seed=2)[0]
+    np.testing.assert_array_equal(compiled.predict(small), model.predict(small))
+    assert compiled._source_model is None
+
+    large = training_data(compiled_forest.LARGE_BATCH_ROWS, seed=3)[0]
+    np.testing.assert_array_equal(compiled.predict(large), model.predict(large))
+    assert compiled._source_model is not None
+
+
+def test_missing_source_model_falls_back_to_node_arrays(tmp_path):
+    X, y = training_data()
+    model = MODELS['forest'](X, y)
+    joblib.dump(model, tmp_path / 'model.joblib')
+    compiled_forest.export_model(str(tmp_path / 'model.joblib'), str(tmp_path / 'model.forest'))
+    (tmp_path / 'model.joblib').unlink()
+
+    compiled = compiled_forest.load_compiled(str(tmp_path / 'model.forest'))
+    assert compiled.source is None
+    large = training_data(compiled_forest.LARGE_BATCH_ROWS, seed=3)[0]
+    np.testing.assert_array_equal(compiled.predict(large), model.predict(large))
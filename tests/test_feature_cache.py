@@ -0,0 +1,114 @@
+import importlib
+import os
+
+import numpy as np
+import pytest
+
+from bench.synthetic import write_metric_file, write_session
+from model import feature_cache, model_util
+from pcap import chunkConvert
+
+# 特征缓存的失效、淘汰和索引写入
+
+
+@pytest.fixture(scope='module')
+def session(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('session'))
+    pcap_file, metric_file = write_session(directory, n_chunks=30)
+    chunk_file = os.path.join(directory, 'session.chk')
+    chunkConvert.convert_file(pcap_file, chunk_file)
+    return chunk_file, metric_file
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    calls = []
+    extract = feature_cache.extract_features
+
+    def counted(*args):
+        calls.append(args[:2])
+        return extract(*args)
+
+    monkeypatch.setattr(feature_cache, 'extract_features', counted)
+    return calls
+
+
+def test_hit_and_invalidation(session, tmp_path, extractions, monkeypatch):
+    chunk_file, metric_file = session
+    metric_copy = str(tmp_path / 'copy_merged.txt')
+    with open(metric_file) as src, open(metric_copy, 'w') as dst:
+        dst.write(src.read())
+
+    cache = feature_cache.FeatureCache(str(tmp_path / 'cache'))
+    X, y = cache.load(chunk_file, metric_copy)
+    assert len(X) > 5 and len(extractions) == 1
+    np.testing.assert_array_equal(cache.load(chunk_file, metric_copy)[1], y)
+    # 新的实例从index.json读取文件哈希
+    cache = feature_cache.FeatureCache(str(tmp_path / 'cache'))
+    assert os.path.abspath(metric_copy) in cache.index
+    cache.load(chunk_file, metric_copy)
+    assert len(extractions) == 1
+
+    # 文件内容、对齐参数或特征版本变化后重新提取
+    write_metric_file(metric_copy, 200, 0.1, seed=1)
+    _, y2 = cache.load(chunk_file, metric_copy)
+    assert len(extractions) == 2 and not np.array_equal(y, y2)
+    cache.load(chunk_file, metric_copy, tolerance=0.05)
+    assert len(extractions) == 3
+    monkeypatch.setattr(model_util, 'FEATURE_VERSION', model_util.FEATURE_VERSION + 1)
+    cache.load(chunk_file, metric_copy)
+    assert len(extractions) == 4
+
+
+def test_evicts_least_recently_used(session, tmp_path):
+    chunk_file, metric_file = session
+    cache = feature_cache.FeatureCache(str(tmp_path / 'cache'))
+    paths = []
+    for i, tolerance in enumerate((0.1, 0.05, 0.2)):
+        cache.load(chunk_file, metric_file, tolerance)
+        paths.append(cache._entry_path(cache.key(chunk_file, metric_file, tolerance)))
+        os.utime(paths[-1], ns=((i + 1) * 10 ** 9, (i + 1) * 10 ** 9))
+
+    # 第一个条目最近被读取过, 超出上限时淘汰的是第二个
+    cache.get(cache.key(chunk_file, metric_file, 0.1))
+    cache.max_bytes = os.path.getsize(paths[0]) + os.path.getsize(paths[2])
+    cache.evict()
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
+
+
+def test_index_written_once_per_batch(session, tmp_path, monkeypatch):
+    chunk_file, metric_file = session
+    metric_files = []
+    for seed in range(5):
+        path = str(tmp_path / f'{seed}_merged.txt')
+        write_metric_file(path, 100, 0.1, seed=seed)
+        metric_files.append(path)
+
+    cache = feature_cache.FeatureCache(str(tmp_path / 'cache'))
+    writes = []
+    save_index = cache.save_index
+    monkeypatch.setattr(cache, 'save_index', lambda: writes.append(cache.dirty) or save_index())
+    cache.load_many([(chunk_file, path) for path in metric_files], workers=1)
+    assert writes == [True]
+    assert len(feature_cache.FeatureCache(cache.cache_dir).index) == 6
+
+
+def test_shared_cache_is_created_on_first_use(monkeypatch):
+    from model import multi_model
+    created = []
+
+    class CountedCache(feature_cache.FeatureCache):
+        def __init__(self, *args, **kwargs):
+            created.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(feature_cache, 'FeatureCache', CountedCache)
+    try:
+        # 导入时不读取缓存目录的索引
+        importlib.reload(multi_model)
+        assert created == []
+        cache = multi_model.shared_feature_cache()
+        assert multi_model.shared_feature_cache() is cache and created == [cache]
+    finally:
+        monkeypatch.undo()
+        importlib.reload(multi_model)
@@ -0,0 +1,30 @@
+import pytest
+
+import instrument
+
+# 没有resource模块的平台(Windows)上统计仍然可用
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setenv(instrument.ENV_VAR, '0')
+    instrument.reset()
+    instrument.enable()
+    yield
+    instrument.enable(False)
+    instrument.reset()
+
+
+@pytest.mark.parametrize('has_resource', [True, False])
+def test_stage_report(enabled, monkeypatch, has_resource):
+    if not has_resource:
+        monkeypatch.setattr(instrument, 'resource', None)
+    with instrument.stage('work') as stage:
+        stage.count('items', 3)
+        sum(range(100000))
+    data = instrument.report()
+    work = data['stages']['work']
+    assert work['calls'] == 1 and work['counters'] == {'items': 3}
+    assert work['cpu_seconds'] >= 0
+    assert (data['peak_rss_bytes'] > 0) == has_resource
+    assert 'qos_stage_cpu_seconds_total{stage="work"}' in instrument.to_prometheus(data)
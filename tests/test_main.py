@@ -0,0 +1,20 @@
+import pytest
+
+import main
+
+# 子命令参数的解析
+
+
+@pytest.mark.parametrize('extra', [[], ['--datasets', 'A0', 'A1', '--workers', '2'], ['--help'], ['-h']])
+def test_select_passes_arguments_through(monkeypatch, extra):
+    model_selection = pytest.importorskip('model.model_selection')
+    calls = []
+    monkeypatch.setattr(model_selection, 'main', lambda argv: calls.append(argv) or 0)
+    assert main.main(['select', *extra]) == 0
+    assert calls == [extra]
+
+
+def test_other_commands_reject_unknown_arguments(capsys):
+    with pytest.raises(SystemExit):
+        main.main(['export', '--datasets', 'A0'])
+    assert "unrecognized arguments: --datasets A0" in capsys.readouterr().err
@@ -0,0 +1,62 @@
+import dataclasses
+import random
+
+import pytest
+
+from bench.synthetic import metric_line
+from pcap import metricParser
+
+# 指标记录的解析与写出
+
+
+def sample_metrics(n=50, seed=0):
+    rnd = random.Random(seed)
+    text = '\n'.join(metric_line(rnd, round(i * 0.1, 3), 1600000000000 + i * 100) for i in range(n))
+    return text, metricParser.parse_metric(text)
+
+
+@pytest.mark.parametrize('buffer_valid', [True, False, None])
+def test_format_parses_back_to_equal_record(buffer_valid):
+    _, metrics = sample_metrics(1)
+    metric = metrics[0]
+    metric.playback = dataclasses.replace(metric.playback, buffer_valid=buffer_valid)
+    parsed = metricParser.parse_metric_line(metricParser.format_metric(metric))
+    assert parsed.playback.buffer_valid is buffer_valid
+    assert parsed == metric
+    assert metricParser.parse_metric_table(metricParser.format_metric(metric))[0] == metric
+
+
+def test_write_metric_round_trip(tmp_path):
+    _, metrics = sample_metrics()
+    assert {metric.playback.buffer_valid for metric in metrics} == {True, False, None}
+    path = str(tmp_path / 'session_merged.txt')
+    metricParser.write_metric(metrics, path)
+    assert metricParser.read_metric(path) == metrics
+    assert metricParser.read_metric_table(path).to_metrics() == metrics
+
+
+def test_table_matches_record_parser():
+    text, metrics = sample_metrics(300, seed=1)
+    table = metricParser.parse_metric_table(text)
+    assert len(table) == len(metrics)
+    assert table.to_metrics() == metrics
+    # 画质全为0的记录类型为-1, buffer_progress为null时为0
+    assert -1 in table.columns['playback_quality_type']
+    assert any(metric.playback.buffer_progress == 0 for metric in metrics)
+
+    expected = [(m.relative_time, m.playback.playback_event_type, m.playback.playback_quality_type,
+                 m.playback.buffer_warning) for m in metrics]
+    assert [(t, *labels) for t, labels in zip(table.relative_time.tolist(), table.labels().tolist())] == expected
+
+
+def test_table_of_empty_text():
+    assert metricParser.parse_metric('') == []
+    table = metricParser.parse_metric_table('')
+    assert len(table) == 0 and table.to_metrics() == []
+    assert table.labels().shape == (0, 3)
+
+
+def test_table_rejects_malformed_text():
+    text, _ = sample_metrics(3)
+    with pytest.raises(ValueError):
+        metricParser.parse_metric_table(text.replace('], [[', '], [', 1))
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from bench.synthetic import write_metric_file
+from model import model_util
+from pcap import metricParser
+from pcap.chunk import CHUNK_DTYPE
+
+# chunk特征与指标标签按请求时间对齐
+
+
+def chunk_records(request_times):
+    chunks = np.zeros(len(request_times), dtype=CHUNK_DTYPE)
+    chunks['request_time'] = request_times
+    chunks['size'] = np.arange(len(request_times)) + 1000
+    return chunks
+
+
+def test_match_nearest_tolerance_edge():
+    # 二进制可精确表示的时间, 相差恰好为容差时不匹配
+    times = np.array([2.0, 1.0, 3.0])
+    index, matched = model_util.match_nearest([1.0, 1.125, 1.25, 1.5, 0.75, 3.25, 5.0], times, 0.25)
+    assert index.tolist() == [1, 1, 1, 1, 1, 2, 2]
+    assert matched.tolist() == [True, True, False, False, False, False, False]
+
+    index, matched = model_util.match_nearest([1.25, 3.25], times, 0.375)
+    assert matched.tolist() == [True, True]
+
+
+def test_match_nearest_without_times():
+    index, matched = model_util.match_nearest([0.5, 1.0], np.zeros(0), 0.1)
+    assert len(index) == 2 and not matched.any()
+
+
+def test_prepare_data_matches_nearest_metric(tmp_path):
+    path = str(tmp_path / 'session_merged.txt')
+    write_metric_file(path, n_lines=50, interval=0.5)
+    metrics = metricParser.read_metric_table(path)
+    _, labels = model_util.metric_labels(metrics)
+
+    # 第2个chunk落在两条指标中间, 超出容差
+    X, y = model_util.prepare_data(chunk_records([0.0, 1.25, 2.0625, 4.9375]), metrics, tolerance=0.125)
+    assert X[:, 0].tolist() == [0.0, 2.0625, 4.9375]
+    assert X[:, 4].tolist() == [1000, 1002, 1003]
+    np.testing.assert_array_equal(y, labels[[0, 4, 10]])
+
+    # Metric列表与MetricTable的结果相同
+    X2, y2 = model_util.prepare_data(chunk_records([0.0, 1.25, 2.0625, 4.9375]), metrics.to_metrics(),
+                                     tolerance=0.125)
+    np.testing.assert_array_equal(X, X2)
+    np.testing.assert_array_equal(y, y2)
+
+    with pytest.raises(ValueError, match="1 chunks"):
+        model_util.prepare_data(chunk_records([0.0, 1.25]), metrics, tolerance=0.125, unmatched='raise')
+
+
+def test_prepare_data_with_empty_metric_file(tmp_path):
+    path = tmp_path / 'empty_merged.txt'
+    path.write_text('')
+    metrics = metricParser.read_metric_table(str(path))
+    X, y = model_util.prepare_data(chunk_records([0.0, 1.0]), metrics)
+    assert X.shape == (0, len(model_util.FEATURE_COLUMNS)) and y.shape == (0, 3)
+
+    with pytest.raises(ValueError, match="2 chunks"):
+        model_util.prepare_data(chunk_records([0.0, 1.0]), metrics, unmatched='raise')
+
+    X, y = model_util.prepare_data(chunk_records([]), [])
+    assert X.shape == (0, len(model_util.FEATURE_COLUMNS)) and y.shape == (0, 3)
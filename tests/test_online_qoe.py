@@ -0,0 +1,28 @@
+import main
+from model import online_qoe
+
+# online子命令: --follow-timeout只控制跟踪文件, --idle-timeout/--max-flows与convert相同, 交给检测器逐出流
+
+
+class ConstantModel:
+    def predict(self, features):
+        return [[0, 0, 0]] * len(features)
+
+
+def test_predictor_passes_eviction_to_detector():
+    predictor = online_qoe.OnlinePredictor(ConstantModel(), idle_timeout=30.0, max_flows=100)
+    assert predictor.detector.idle_timeout == 30.0
+    assert predictor.detector.max_flows == 100
+    assert predictor.detector.evicting
+
+
+def test_online_arguments(monkeypatch):
+    calls = []
+    monkeypatch.setattr(online_qoe, 'run_online', lambda *args: calls.append(args) or {'chunks': 0})
+    assert main.main(['online', 'x.pcap', '--follow', '--follow-timeout', '3',
+                      '--idle-timeout', '30', '--max-flows', '100']) == 0
+    assert calls == [('x.pcap', 'output/model_final.joblib', True, None, 3.0, 30.0, 100)]
+
+    calls.clear()
+    main.main(['online', 'x.pcap'])
+    assert calls == [('x.pcap', 'output/model_final.joblib', False, None, 5.0, None, None)]
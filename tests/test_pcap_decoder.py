@@ -0,0 +1,82 @@
+import socket
+import struct
+
+import numpy as np
+import pytest
+
+from bench.synthetic import write_session_pcap
+from pcap import pcapDecoder
+
+# read_columns一次解析的列数组与iter_packets逐包解析的记录相同
+
+
+def rewrite_frames(src, dst, rewrite, extra=b''):
+    """逐条改写src中记录的帧(rewrite(frame)返回新的帧), 再在末尾追加extra"""
+    data = open(src, 'rb').read()
+    out = bytearray(data[:pcapDecoder.PCAP_HEADER_LEN])
+    offset = pcapDecoder.PCAP_HEADER_LEN
+    while offset < len(data):
+        ts_sec, ts_usec, incl_len, orig_len = struct.unpack_from('<IIII', data, offset)
+        frame = data[offset + 16:offset + 16 + incl_len]
+        new = rewrite(frame)
+        out += struct.pack('<IIII', ts_sec, ts_usec, len(new), orig_len + len(new) - len(frame)) + new
+        offset += 16 + incl_len
+    with open(dst, 'wb') as f:
+        f.write(out + extra)
+
+
+def vlan_tag(frame):
+    return frame[:12] + struct.pack('!HH', 0x8100, 7) + frame[12:]
+
+
+def ipv6_record():
+    ip = struct.pack('!IHBB16s16s', 0x60000000, 20, 6, 64,
+                     socket.inet_pton(socket.AF_INET6, '2001:db8::1'),
+                     socket.inet_pton(socket.AF_INET6, '2001:db8::2'))
+    frame = b'\x00' * 12 + b'\x86\xdd' + ip + struct.pack('!HH', 50000, 443) + b'\x00' * 16
+    return struct.pack('<IIII', 1600000100, 0, len(frame), len(frame)) + frame
+
+
+@pytest.fixture(scope='module')
+def session_pcap(tmp_path_factory):
+    path = tmp_path_factory.mktemp('pcap') / 'session.pcap'
+    write_session_pcap(str(path), n_chunks=20, n_flows=2, n_background=10)
+    return str(path)
+
+
+def assert_columns_match_records(path):
+    columns = pcapDecoder.read_columns(path)
+    assert columns is not None
+    records = list(pcapDecoder.iter_packets(path))
+    assert len(records) > 0
+    for name, values in zip(pcapDecoder.COLUMNS, zip(*records)):
+        np.testing.assert_array_equal(columns[name], np.array(values), err_msg=name)
+    return columns
+
+
+def test_columns_match_records(session_pcap):
+    columns = assert_columns_match_records(session_pcap)
+    assert columns['records'] == len(columns['time'])
+
+
+def test_columns_match_records_with_vlan(session_pcap, tmp_path):
+    path = str(tmp_path / 'vlan.pcap')
+    rewrite_frames(session_pcap, path, vlan_tag)
+    assert_columns_match_records(path)
+
+
+def test_columns_skip_truncated_frames_and_records(session_pcap, tmp_path):
+    # 截断到链路层头部内的帧不是IP包, 文件末尾不完整的记录不读取
+    path = str(tmp_path / 'truncated.pcap')
+    frames = iter(range(10 ** 9))
+    rewrite_frames(session_pcap, path, lambda frame: frame[:10] if next(frames) % 7 == 0 else frame,
+                   extra=ipv6_record()[:30])
+    columns = assert_columns_match_records(path)
+    assert columns['records'] > len(columns['time'])
+
+
+def test_ipv6_falls_back_to_records(session_pcap, tmp_path):
+    path = str(tmp_path / 'ipv6.pcap')
+    rewrite_frames(session_pcap, path, lambda frame: frame, extra=ipv6_record())
+    assert pcapDecoder.read_columns(path) is None
+    assert list(pcapDecoder.iter_packets(path))[-1][4] == pcapDecoder.PROTO_TCP
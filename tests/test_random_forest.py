@@ -0,0 +1,40 @@
+import numpy as np
+
+from model.random_forest import IncrementalForest
+
+# 增量训练的森林在超过树的上限后仍保留每个批次的树
+
+
+def batches(n_batches, rows=60, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(n_batches):
+        X = rng.random((rows, 4))
+        y = np.column_stack([X[:, 0] > 0.5, X[:, 1] > 0.5, X[:, 2] > 0.5]).astype(int)
+        yield X, y
+
+
+def test_keeps_trees_from_first_batch():
+    model = IncrementalForest(trees_per_batch=20, max_trees=100, random_state=0)
+    for i, (X, y) in enumerate(batches(30)):
+        model.partial_fit(X, y)
+        if i == 0:
+            first = model.forests[0]
+    assert model.forests[0] is first
+    assert len(model.forests) == 30
+    assert all(forest.n_estimators == len(forest.estimators_) >= 1 for forest in model.forests)
+
+
+def test_stays_within_budget_while_batches_fit():
+    model = IncrementalForest(trees_per_batch=20, max_trees=100, random_state=0)
+    for X, y in batches(8):
+        model.partial_fit(X, y)
+        assert model.n_estimators <= 100
+    assert {forest.n_estimators for forest in model.forests} == {100 // 8}
+    assert model.predict(X).shape == y.shape
+
+
+def test_unbounded_keeps_every_tree():
+    model = IncrementalForest(trees_per_batch=5, max_trees=None, random_state=0)
+    for X, y in batches(4):
+        model.partial_fit(X, y)
+    assert model.n_estimators == 20